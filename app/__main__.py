@@ -1,64 +1,23 @@
-import errno
-import time
 import logging
-import os
-import shutil
 
-from discord.errors import LoginFailure
-
-from .config import CACHE_DIR
+from .config import CLUSTERS, SHARD_IDS
 
 logger = logging.getLogger("strongest.init")
 
 
-def create_cache_dir():
-    logger.info("Will create cache directory.")
-    try:
-        os.makedirs(CACHE_DIR)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
-
+if not SHARD_IDS:
+    # Cluster processes leave the shared cache directory to the launcher
+    from .cachedir import prepare_cache_dir
 
-def delete_cache_dir():
-    if os.path.exists(CACHE_DIR):
-        logger.info(
-            "Will clear cache directory. Press Ctrl+C within 3 seconds to abort!"
-        )
-        try:
-            time.sleep(3)
-        except KeyboardInterrupt:
-            logger.info("Aborting clear...")
-            return
-        try:
-            shutil.rmtree(CACHE_DIR)
-        except OSError as e:
-            if e.errno == errno.ENOTEMPTY:
-                # Directory is not empty, let's delete it recursively
-                for root, dirs, files in os.walk(CACHE_DIR, topdown=False):
-                    for name in files:
-                        os.remove(os.path.join(root, name))
-                    for name in dirs:
-                        os.rmdir(os.path.join(root, name))
-                os.rmdir(CACHE_DIR)
-            else:
-                raise
+    prepare_cache_dir()
 
+if __name__ == "__main__" and CLUSTERS > 1 and not SHARD_IDS:
+    from .cluster import run_launcher
 
-if os.path.exists(CACHE_DIR):
-    threshold_size = 16 * 1024 * 1024 * 1024  # 16GiB
-    cache_size = sum(f.stat().st_size for f in os.scandir(CACHE_DIR) if f.is_file())
-    if cache_size > threshold_size:
-        logger.info(
-            "Cache directory is above threshold, "
-            f"deleting contents ({cache_size} bytes)"
-        )
-        delete_cache_dir()
-        create_cache_dir()
-else:
-    create_cache_dir()
+    run_launcher()
+elif __name__ == "__main__":
+    from discord.errors import LoginFailure
 
-if __name__ == "__main__":
     from . import bot
     from .config import TOKEN
 
@@ -0,0 +1,98 @@
+import asyncio
+import glob
+import importlib
+import logging
+import os
+from typing import List
+
+import discord
+from discord.ext import commands
+
+from . import startup
+from .commandsync import sync_commands
+from .config import (
+    PREFIX,
+    SHARD_COUNT,
+    SHARD_IDS,
+    WATCHDOG_INTERVAL,
+    WATCHDOG_THRESHOLD,
+)
+from .intents import build_bot_options
+from .services.diagnostics import LoopWatchdog
+from .services.metrics import start_metrics_server
+
+logger = logging.getLogger("strongest.bootstrap")
+
+if SHARD_COUNT > 0:
+    bot = commands.AutoShardedBot(
+        PREFIX,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS or None,
+        **build_bot_options(),
+    )
+else:
+    bot = commands.Bot(PREFIX, **build_bot_options())
+
+
+modules_dir = os.path.join(os.path.dirname(__file__), "modules")
+extensions = [
+    f.replace(os.path.join(modules_dir, ""), "").replace(".py", "")
+    for f in glob.glob(os.path.join(modules_dir, "*.py"))
+    if not os.path.basename(f).startswith("__")
+]
+
+logger.info("Discovered modules: %s", ", ".join(extensions))
+startup.mark("import")
+
+
+async def load_extensions(extensions: List[str]):
+    for extension in extensions:
+        try:
+            await bot.load_extension(f"{__package__}.modules.{extension}")
+            logger.info(f"Loaded module {extension}.")
+        except Exception as e:
+            logger.error(f"Failed to load module {extension}.", exc_info=e)
+
+
+def warm_up() -> None:
+    """Does the heavy lifting we do not want in front of login: loading meta.json, importing yt-dlp and measuring the cache"""
+    from .cachedir import check_cache_size
+    from .models.song import meta_cache
+
+    meta_cache.warm()
+    startup.mark("cache")
+    importlib.import_module("yt_dlp")
+    startup.mark("yt_dlp")
+    check_cache_size()
+    logger.info("Startup phases: %s", startup.format_phases())
+
+
+@bot.event
+async def setup_hook():
+    await load_extensions(extensions)
+    startup.mark("extensions")
+    await start_metrics_server(bot)
+    if WATCHDOG_THRESHOLD > 0:
+        LoopWatchdog(WATCHDOG_INTERVAL, WATCHDOG_THRESHOLD).start()
+
+
+@bot.event
+async def on_ready():
+    logger = logging.getLogger("strongest.bot")
+    logger.info("Running on discord.py %s", discord.__version__)
+    await bot.wait_until_ready()
+    if "ready" not in startup.phases:
+        startup.mark("ready")
+        logger.info("Startup phases: %s", startup.format_phases())
+        asyncio.get_running_loop().run_in_executor(None, warm_up)
+    await sync_commands(bot)
+    logger.info(f"Logged in as {bot.user} (ID: {bot.user.id})")
+    if SHARD_COUNT > 0:
+        from .cluster import start_reporting
+
+        start_reporting(bot)
+    await bot.change_presence(
+        activity=discord.Activity(
+            type=discord.ActivityType.listening, name=f"kazoo screeching"
+        )
+    )
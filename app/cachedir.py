@@ -0,0 +1,76 @@
+import errno
+import logging
+import os
+import shutil
+import time
+
+from .config import CACHE_DIR
+
+logger = logging.getLogger("strongest.init")
+
+THRESHOLD_SIZE: int = 16 * 1024 * 1024 * 1024  # 16GiB
+# Left behind by check_cache_size, the cache is cleared on the next start when it exists
+CLEAR_MARKER: str = f"{CACHE_DIR}/.clear"
+
+
+def create_cache_dir():
+    logger.info("Will create cache directory.")
+    try:
+        os.makedirs(CACHE_DIR)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def delete_cache_dir():
+    if os.path.exists(CACHE_DIR):
+        logger.info(
+            "Will clear cache directory. Press Ctrl+C within 3 seconds to abort!"
+        )
+        try:
+            time.sleep(3)
+        except KeyboardInterrupt:
+            logger.info("Aborting clear...")
+            return
+        try:
+            shutil.rmtree(CACHE_DIR)
+        except OSError as e:
+            if e.errno == errno.ENOTEMPTY:
+                # Directory is not empty, let's delete it recursively
+                for root, dirs, files in os.walk(CACHE_DIR, topdown=False):
+                    for name in files:
+                        os.remove(os.path.join(root, name))
+                    for name in dirs:
+                        os.rmdir(os.path.join(root, name))
+                os.rmdir(CACHE_DIR)
+            else:
+                raise
+
+
+def prepare_cache_dir() -> None:
+    """Makes sure the cache directory exists and clears it if it was marked as too large
+
+    This only checks for the marker, measuring the cache is left to check_cache_size after login.
+    """
+    if not os.path.exists(CACHE_DIR):
+        create_cache_dir()
+        return
+    if os.path.exists(CLEAR_MARKER):
+        logger.info("Cache directory was marked as above threshold, deleting contents")
+        delete_cache_dir()
+        create_cache_dir()
+
+
+def check_cache_size() -> None:
+    """Measures the cache directory and marks it to be cleared on the next start if it is above threshold"""
+    try:
+        cache_size = sum(f.stat().st_size for f in os.scandir(CACHE_DIR) if f.is_file())
+    except FileNotFoundError:
+        return
+    if cache_size > THRESHOLD_SIZE:
+        logger.info(
+            "Cache directory is above threshold, "
+            f"it will be cleared on the next start ({cache_size} bytes)"
+        )
+        with open(CLEAR_MARKER, "w"):
+            pass
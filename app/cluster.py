@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from discord.ext import commands, tasks
+
+from .config import CACHE_DIR, CLUSTER_ID, CLUSTERS, SHARD_COUNT
+
+logger = logging.getLogger("strongest.cluster")
+
+REPORT_DIR: str = f"{CACHE_DIR}/shards"
+REPORT_INTERVAL: int = 30  # Seconds
+SUPERVISE_INTERVAL: int = 5  # Seconds, also the minimum delay before a crashed cluster is restarted
+
+
+def plan_clusters(shard_count: int, clusters: int) -> List[List[int]]:
+    """Splits the shard ids into one contiguous block per cluster process"""
+    size, extra = divmod(shard_count, clusters)
+    plan = []
+    start = 0
+    for i in range(clusters):
+        end = start + size + (1 if i < extra else 0)
+        plan.append(list(range(start, end)))
+        start = end
+    return [shards for shards in plan if shards]
+
+
+def get_rss() -> int:
+    """Returns the resident memory of this process in bytes, or 0 if it is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def build_report(bot: commands.Bot) -> Dict:
+    """Collects the health and load of every shard this process runs"""
+    shards: Dict[int, Dict] = {}
+    for shard_id, latency in getattr(bot, "latencies", [(0, bot.latency)]):
+        shard = bot.get_shard(shard_id) if hasattr(bot, "get_shard") else None
+        shards[shard_id] = {
+            "latency": latency,
+            "closed": shard.is_closed() if shard is not None else bot.is_closed(),
+            "guilds": 0,
+            "voice": 0,
+        }
+    for guild in bot.guilds:
+        shards.setdefault(guild.shard_id, {"guilds": 0, "voice": 0})["guilds"] += 1
+    for vc in bot.voice_clients:
+        shards.setdefault(vc.guild.shard_id, {"guilds": 0, "voice": 0})["voice"] += 1
+    cog = bot.get_cog("Default")
+    return {
+        "cluster": CLUSTER_ID,
+        "pid": os.getpid(),
+        "time": time.time(),
+        "rss": get_rss(),
+        "controllers": len(cog.controllers) if cog is not None else 0,
+        "shards": shards,
+    }
+
+
+def write_report(report: Dict) -> None:
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    path = f"{REPORT_DIR}/cluster-{report['cluster']}.json"
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(report, f)
+    os.replace(tmp, path)
+
+
+def read_reports() -> List[Dict]:
+    reports = []
+    if not os.path.isdir(REPORT_DIR):
+        return reports
+    for name in sorted(os.listdir(REPORT_DIR)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(f"{REPORT_DIR}/{name}") as f:
+                reports.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return reports
+
+
+def start_reporting(bot: commands.Bot) -> None:
+    """Starts writing this process's health report into the shared cache directory"""
+
+    @tasks.loop(seconds=REPORT_INTERVAL)
+    async def report() -> None:
+        write_report(build_report(bot))
+
+    if getattr(bot, "_health_report", None) is None:
+        bot._health_report = report
+        report.start()
+
+
+def log_reports() -> None:
+    now = time.time()
+    for report in read_reports():
+        if now - report["time"] > REPORT_INTERVAL * 3:
+            logger.warning(
+                "Cluster %d has not reported for %ds",
+                report["cluster"],
+                now - report["time"],
+            )
+            continue
+        for shard_id, shard in sorted(report["shards"].items(), key=lambda i: int(i[0])):
+            logger.info(
+                "Cluster %d shard %s: %d guilds, %d voice, %.0fms latency%s",
+                report["cluster"],
+                shard_id,
+                shard["guilds"],
+                shard["voice"],
+                (shard.get("latency") or 0) * 1000,
+                ", CLOSED" if shard.get("closed") else "",
+            )
+        logger.info(
+            "Cluster %d: %d controllers, %.1f MiB RSS",
+            report["cluster"],
+            report["controllers"],
+            report["rss"] / 1024 / 1024,
+        )
+
+
+def run_launcher() -> None:
+    """Runs one `python -m app` process per cluster and restarts the ones that exit"""
+    plan = plan_clusters(SHARD_COUNT, CLUSTERS)
+    if not plan:
+        logger.critical("BOT_CLUSTERS is set, but BOT_SHARD_COUNT is 0")
+        return
+    logger.info("Launching %d clusters for %d shards: %s", len(plan), SHARD_COUNT, plan)
+    processes: Dict[int, subprocess.Popen] = {}
+
+    def spawn(cluster: int) -> subprocess.Popen:
+        env = dict(
+            os.environ,
+            BOT_SHARD_IDS=",".join(str(i) for i in plan[cluster]),
+            BOT_CLUSTER_ID=str(cluster),
+        )
+        return subprocess.Popen([sys.executable, "-m", "app"], env=env)
+
+    last_report = 0.0
+    try:
+        while 1:
+            for cluster in range(len(plan)):
+                process = processes.get(cluster)
+                if process is not None and process.poll() is None:
+                    continue
+                if process is not None:
+                    logger.error(
+                        "Cluster %d exited with code %d, restarting it",
+                        cluster,
+                        process.returncode,
+                    )
+                processes[cluster] = spawn(cluster)
+            if time.monotonic() - last_report >= REPORT_INTERVAL:
+                log_reports()
+                last_report = time.monotonic()
+            time.sleep(SUPERVISE_INTERVAL)
+    except KeyboardInterrupt:
+        logger.info("Received keyboard interrupt, stopping clusters")
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
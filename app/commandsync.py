@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from discord.ext import commands
+
+from .config import CACHE_DIR
+from .filelock import file_lock
+
+logger = logging.getLogger("strongest.commandsync")
+
+FINGERPRINT_FILE: str = f"{CACHE_DIR}/command_tree.sha256"
+CLAIM_FILE: str = f"{FINGERPRINT_FILE}.claim"
+CLAIM_TIMEOUT: float = 60.0  # Seconds after which the claim of a process that died while syncing is ignored
+
+
+def fingerprint(bot: commands.Bot) -> str:
+    """Returns a hash of the global slash command payloads of the bot's command tree"""
+    payloads = []
+    for command in bot.tree.get_commands():
+        try:
+            payloads.append(command.to_dict(bot.tree))
+        except TypeError:
+            # discord.py < 2.4 does not take the tree
+            payloads.append(command.to_dict())
+    payloads.sort(key=lambda payload: payload["name"])
+    data = json.dumps(
+        {"application": bot.application_id, "commands": payloads},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def _claim(current: str, force: bool) -> bool:
+    """Decides under the lock whether this process syncs, and claims the sync if it does
+
+    Returns:
+        bool: Whether this process should sync
+    """
+    with file_lock(f"{FINGERPRINT_FILE}.lock"):
+        try:
+            with open(FINGERPRINT_FILE, "r") as f:
+                stored = f.read().strip()
+        except FileNotFoundError:
+            stored = None
+        if not force and stored == current:
+            logger.info("Command tree is unchanged, skipping sync")
+            return False
+        try:
+            with open(CLAIM_FILE, "r") as f:
+                claimed, since = f.read().split()
+            if not force and claimed == current and time.time() - float(since) < CLAIM_TIMEOUT:
+                logger.info("Command tree is being synced by another process, skipping sync")
+                return False
+        except (FileNotFoundError, ValueError):
+            pass
+        with open(CLAIM_FILE, "w") as f:
+            f.write(f"{current} {time.time()}")
+    return True
+
+
+def _finish(current: str | None) -> None:
+    """Stores the fingerprint that was synced, None if the sync failed, and drops the claim"""
+    with file_lock(f"{FINGERPRINT_FILE}.lock"):
+        if current is not None:
+            tmp = f"{FINGERPRINT_FILE}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(current)
+            os.replace(tmp, FINGERPRINT_FILE)
+        try:
+            os.remove(CLAIM_FILE)
+        except FileNotFoundError:
+            pass
+
+
+async def sync_commands(bot: commands.Bot, force: bool = False) -> bool:
+    """Syncs the command tree with discord, unless it matches the tree we synced last time
+
+    The fingerprint of the last sync is kept in the cache directory, so restarts and
+    other cluster processes skip the sync too. The file lock blocks, so it is taken in a thread
+    and only held to compare and write the fingerprint, never across the sync it self.
+    A process that syncs leaves a claim, so the others do not sync the same tree at the same time.
+
+    Args:
+        force (bool): Sync even if the fingerprint did not change
+
+    Returns:
+        bool: Whether a sync happened
+    """
+    current = fingerprint(bot)
+    if not await asyncio.to_thread(_claim, current, force):
+        return False
+    logger.info("Syncing command tree (%s)", "forced" if force else "changed")
+    try:
+        await bot.tree.sync()
+    except BaseException:
+        await asyncio.shield(asyncio.to_thread(_finish, None))
+        raise
+    await asyncio.to_thread(_finish, current)
+    return True
@@ -1,6 +1,7 @@
 import logging
+from typing import List
 
-from decouple import config
+from decouple import Csv, config
 
 logger = logging.getLogger("strongest.config")
 
@@ -19,3 +20,63 @@ CACHE_DIR: str = config("BOT_CACHE_DIR", None)
 if CACHE_DIR is None:
     CACHE_DIR = "./cache"
     logger.warn("BOT_CACHE_DIR not found in .env file, using default: './cache'")
+
+META_ENDPOINT: str | None = config("BOT_META_ENDPOINT", None)
+META_TIMEOUT: float = config("BOT_META_TIMEOUT", 5.0, cast=float)
+
+# 0 runs extraction and downloads on threads inside the bot process
+WORKER_PROCESSES: int = config("BOT_WORKER_PROCESSES", 0, cast=int)
+
+# 0 runs a single unsharded bot
+SHARD_COUNT: int = config("BOT_SHARD_COUNT", 0, cast=int)
+# Number of processes the launcher splits the shards between
+CLUSTERS: int = config("BOT_CLUSTERS", 1, cast=int)
+# Set by the launcher for each cluster process, empty means all shards
+SHARD_IDS: List[int] = config("BOT_SHARD_IDS", "", cast=Csv(int))
+CLUSTER_ID: int = config("BOT_CLUSTER_ID", 0, cast=int)
+
+# Urls of audio nodes (python -m app.node), empty keeps playlists in this process
+AUDIO_NODES: List[str] = config("BOT_AUDIO_NODES", "", cast=Csv())
+
+# Additional gateway intents on top of what the cogs need, "all" restores discord.Intents.all()
+EXTRA_INTENTS: List[str] = config("BOT_INTENTS", "", cast=Csv())
+# Disabling prefix commands drops the privileged message content intent
+PREFIX_COMMANDS: bool = config("BOT_PREFIX_COMMANDS", True, cast=bool)
+# Only has an effect with the members intent
+CHUNK_GUILDS: bool = config("BOT_CHUNK_GUILDS", False, cast=bool)
+
+# 0 disables the prometheus /metrics endpoint
+METRICS_PORT: int = config("BOT_METRICS_PORT", 0, cast=int)
+METRICS_HOST: str = config("BOT_METRICS_HOST", "127.0.0.1")
+
+# Seconds without activity (or alone in the voice channel) before a guild's player is hibernated, 0 disables it
+IDLE_TIMEOUT: float = config("BOT_IDLE_TIMEOUT", 600.0, cast=float)
+
+# Seconds between queue snapshots, which are resumed after a restart, 0 disables snapshots and resuming
+SNAPSHOT_INTERVAL: float = config("BOT_SNAPSHOT_INTERVAL", 60.0, cast=float)
+
+# Loudness songs are normalized to in LUFS, measured once per song and kept in the meta cache, 0 disables normalization
+LOUDNESS_TARGET: float = config("BOT_LOUDNESS_TARGET", -14.0, cast=float)
+
+# Seconds new guilds crossfade between songs, needs numpy, 0 disables it
+CROSSFADE: float = config("BOT_CROSSFADE", 0.0, cast=float)
+
+# Seconds of audio ahead of playback that are kept downloaded, grown by it self on slow downloads
+PREFETCH_LOOKAHEAD: float = config("BOT_PREFETCH_LOOKAHEAD", 60.0, cast=float)
+# The most seconds into a song that fetches are held back for guilds that skip often, 0 never holds back
+PREFETCH_HOLD: float = config("BOT_PREFETCH_HOLD", 30.0, cast=float)
+
+# Mbit/s all fragment and metadata fetches share on average, it paces when fetches start, 0 is unlimited
+BANDWIDTH_LIMIT: float = config("BOT_BANDWIDTH_LIMIT", 0.0, cast=float)
+# Share of the bandwidth only fetches that are needed right now may use, prefetching never gets it
+BANDWIDTH_RESERVE: float = config("BOT_BANDWIDTH_RESERVE", 0.3, cast=float)
+
+# MB of memory the first fragments of recently played songs are kept in, 0 plays everything from disk
+HOT_CACHE_SIZE: float = config("BOT_HOT_CACHE_SIZE", 0.0, cast=float)
+
+# Threads that send the voice frames of all guilds, 0 keeps discord.py's thread per playing guild
+VOICE_SENDERS: int = config("BOT_VOICE_SENDERS", 0, cast=int)
+
+# Seconds the event loop may be blocked before the watchdog logs its stack, 0 disables the watchdog
+WATCHDOG_THRESHOLD: float = config("BOT_WATCHDOG_THRESHOLD", 0.5, cast=float)
+WATCHDOG_INTERVAL: float = config("BOT_WATCHDOG_INTERVAL", 1.0, cast=float)
@@ -0,0 +1,32 @@
+import contextlib
+import os
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows, where we only ever run a single process
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Holds an exclusive lock on path for the duration of the with block.
+
+    The lock is an flock on a separate lock file, so it works across processes sharing the cache directory
+    as well as across threads of one process. The lock file and its directory are created if missing.
+
+    Example:
+        with file_lock(f"{filepath}.lock"):
+            if not os.path.exists(filepath):
+                download(filepath)
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,51 @@
+import logging
+from typing import Dict
+
+import discord
+
+from .config import CHUNK_GUILDS, EXTRA_INTENTS, PREFIX_COMMANDS
+
+logger = logging.getLogger("strongest.bootstrap")
+
+# Every intent the cogs use, and what for. Anything not listed here is off unless BOT_INTENTS enables it.
+REQUIRED_INTENTS: Dict[str, str] = {
+    "guilds": "guild_only commands, ctx.guild and channel lookups",
+    "voice_states": "joining voice and ctx.author.voice",
+}
+# Only needed when the prefix commands (&play, ...) are enabled
+PREFIX_INTENTS: Dict[str, str] = {
+    "guild_messages": "receiving prefix commands",
+    "message_content": "reading prefix commands (privileged)",
+}
+
+
+def build_intents() -> discord.Intents:
+    """Returns the gateway intents the bot needs, plus the ones enabled through BOT_INTENTS
+
+    Raises:
+        ValueError: BOT_INTENTS contains an unknown intent
+    """
+    if "all" in EXTRA_INTENTS:
+        logger.warn("BOT_INTENTS contains 'all', every member and presence will be cached")
+        return discord.Intents.all()
+    intents = discord.Intents.none()
+    required = dict(REQUIRED_INTENTS)
+    if PREFIX_COMMANDS:
+        required.update(PREFIX_INTENTS)
+    for name in list(required) + EXTRA_INTENTS:
+        if name not in discord.Intents.VALID_FLAGS:
+            raise ValueError(f"Unknown intent in BOT_INTENTS: {name}")
+        setattr(intents, name, True)
+    logger.info("Using intents: %s", ", ".join(name for name, value in intents if value))
+    return intents
+
+
+def build_bot_options() -> Dict:
+    """Returns the intent and member cache keyword arguments for the bot"""
+    intents = build_intents()
+    return {
+        "intents": intents,
+        # Only members in voice are cached, unless the members intent is enabled
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+        "chunk_guilds_at_startup": CHUNK_GUILDS and intents.members,
+    }
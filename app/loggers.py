@@ -1,10 +1,33 @@
-import sys
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import sys
 from typing import List
 
 from colorlog import ColoredFormatter
+from decouple import config
+
+# Read here instead of in config.py, because config.py logs while it loads and needs the handlers to exist
+log_file: str = config("BOT_LOG_FILE", "latest.log")
+log_level: str = config("BOT_LOG_LEVEL", "INFO").upper()
+log_format: str = config("BOT_LOG_FORMAT", "text").lower()  # text or json
+log_max_bytes: int = config("BOT_LOG_MAX_BYTES", 10 * 1024 * 1024, cast=int)
+log_backups: int = config("BOT_LOG_BACKUPS", 5, cast=int)
+# If set (e.g. "midnight" or "h"), the file rotates by time instead of by size
+log_rotate_when: str | None = config("BOT_LOG_ROTATE_WHEN", None)
+# Records waiting for the listener thread, more are dropped instead of blocking whoever logs
+log_queue_size: int = config("BOT_LOG_QUEUE_SIZE", 10000, cast=int)
 
-log_file = "latest.log"
+cluster_id: str | None = config("BOT_CLUSTER_ID", None)
+if cluster_id is not None:
+    # Every cluster process rotates its own file
+    root, ext = os.path.splitext(log_file)
+    log_file = f"{root}-cluster{cluster_id}{ext}"
 
 formatter = ColoredFormatter(
         "%(asctime)s %(log_color)s%(levelname)-8s%(reset)s [%(name)s] %(message)s",
@@ -21,21 +44,116 @@ formatter = ColoredFormatter(
     style="%",
 )
 
-file_handler = logging.FileHandler(log_file)
-console_handler = logging.StreamHandler(sys.stdout)
 
-file_handler.setFormatter(
-    logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-)
+class JsonFormatter(logging.Formatter):
+    """Formats every record as a single line json object"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data)
+
+
+def create_file_handler() -> logging.Handler:
+    if log_rotate_when is not None:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=log_rotate_when, backupCount=log_backups
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=log_max_bytes, backupCount=log_backups
+        )
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+    return handler
+
+
+console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setFormatter(formatter)
 
+class QueueHandler(logging.handlers.QueueHandler):
+    """Puts records on the queue for the listener thread, which formats and writes them
+
+    The stock handler formats every record in the logging thread and drops its exception info.
+    Here only the message is rendered, as its arguments may change once we return, and the exception info
+    is kept, so the listener formats tracebacks (and JsonFormatter puts them into its "exception" field).
+    When the queue is full, records are dropped rather than blocking the event loop, and the number
+    of dropped records is logged once there is room again.
+    """
+
+    dropped: int  # Since the last report, counted without a lock, so it is only about right
+
+    def __init__(self, queue: queue.Queue) -> None:
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            report = logging.LogRecord(
+                "strongest.loggers",
+                logging.WARNING,
+                __file__,
+                0,
+                "Dropped %d log records, the log queue was full",
+                (dropped,),
+                None,
+            )
+            if not self._put(self.prepare(report)):
+                self.dropped += dropped
+        if not self._put(record):
+            self.dropped += 1
+
+    def _put(self, record: logging.LogRecord) -> bool:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            return False
+        return True
+
+
+# Loggers only put records on this queue, the listener thread does the formatting and the disk and console writes
+log_queue: queue.Queue = queue.Queue(maxsize=log_queue_size)
+queue_handler = QueueHandler(log_queue)
+listener: logging.handlers.QueueListener | None = None
+
 
 def configure_logger(loggers: List[str] = None): # type: ignore
+    global listener
     if loggers is None:
         loggers = []
+    if listener is None:
+        handlers: List[logging.Handler] = [console_handler]
+        # Worker processes only log to the console, the file belongs to the bot process
+        if multiprocessing.parent_process() is None:
+            handlers.append(create_file_handler())
+        listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        listener.start()
+        atexit.register(listener.stop)
     for logger_name in loggers:
         logger = logging.getLogger(logger_name)
-        logger.setLevel(logging.INFO)
+        logger.setLevel(log_level)
 
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        logger.addHandler(queue_handler)
@@ -1,8 +1,10 @@
 import logging
 from enum import Enum
-from typing import List
+from typing import Dict, Iterator, List, Tuple
 
-from .song import Fragment
+from ..services import metrics
+from ..services.prefetch import PrefetchPolicy, get_lead
+from .song import Fragment, Meta
 from .song import Playlist as PlaylistLoader
 from .song import Song
 
@@ -20,6 +22,8 @@ class Playlist:
     loopmode: LoopMode
     current_song: int
     current_fragment: int
+    prefetch: PrefetchPolicy
+    _started: bool  # Whether get() returned a fragment of the current song, so ending it counts for the prefetch policy
 
     def __init__(self) -> None:
         logger.info("New playlist initialized")
@@ -27,6 +31,8 @@ class Playlist:
         self.loopmode = LoopMode.OFF
         self.current_song = 0
         self.current_fragment = 0
+        self.prefetch = PrefetchPolicy()
+        self._started = False
 
     async def get(self) -> str | None:
         """Returns the path to the fragment or None if there is no song
@@ -35,25 +41,31 @@ class Playlist:
             str: The path to the fragment to play
             None: There is no song to play
         """
-        logger.debug("Retrieving current song")
+        debug = logger.isEnabledFor(logging.DEBUG)  # Checked once, this runs for every fragment
+        if debug:
+            logger.debug("Retrieving current song")
         song_count: int = len(self.songs)
         if song_count == 0:
-            logger.debug("No songs present, returning None")
+            if debug:
+                logger.debug("No songs present, returning None")
             return None
         if self.current_song >= song_count:
-            logger.debug("Current song is out of range, returning None")
+            if debug:
+                logger.debug("Current song is out of range, returning None")
             return None
         song: Song = self.songs[self.current_song]
-        logger.debug("Waiting for current song to fetch metadata")
+        if debug:
+            logger.debug("Waiting for current song to fetch metadata")
         await song.wait_until_ready()
         fragment: Fragment = song.fragments[self.current_fragment]
-        logger.debug("Waiting for current song's fragment to cache")
+        if debug:
+            logger.debug("Waiting for current song's fragment to cache")
         await fragment.wait_until_downloaded()  # Makes sure the current fragment is downloaded
-        # Is the next fragment preloading? If not, preload it
-        self._preload_next_fragment(
-            song, self.current_fragment
-        )  # This function figures out by it self whether to run another download or not
-        logger.debug("Returning fragment path")
+        song.freeze_gain()  # Every fragment of the song plays at the gain it started with
+        self._started = True
+        self._prefetch(fragment.start)  # This function figures out by it self what to download, update_prefetch() continues it
+        if debug:
+            logger.debug("Returning fragment path")
         return fragment.get_fragment_filepath()
 
     async def next(self) -> None:
@@ -69,17 +81,21 @@ class Playlist:
         if self.current_fragment >= fragments_last_idx:
             # We were at the last fragment, next song
             logger.debug("This was the last fragment, moving to the next song")
+            # Played to the end, unless end_current_song() moved the pointer past the last fragment and recorded the skip
+            self._end_song(skipped=False)
             self._next_song()
         else:
             # We are not at the end of the song yet, move onto the next fragment
             logger.debug("More fragments are present, moving fragment")
             self._next_fragment()
 
-    def skip(self) -> None:
+    async def skip(self, played: float | None = None) -> None:
+        """Moves onto the next song, the current one counts as skipped at played seconds for the prefetch policy"""
         logger.debug("Skipping current song")
         if len(self.songs) == 0:
             logger.debug("There are no songs, will not skip anything")
             return
+        self._end_song(skipped=True, played=played)
         if self.current_song + 1 >= len(self.songs):
             self.current_song = len(self.songs)
             logger.debug(
@@ -88,16 +104,105 @@ class Playlist:
             return
         self._next_song()
 
-    def _next_fragment(self) -> None:
+    async def end_current_song(self, played: float | None = None) -> None:
+        """Moves the fragment pointer past the current song's last fragment, so the next call to next() moves onto the next song
+
+        The song counts as skipped at played seconds for the prefetch policy.
+        """
+        logger.debug("Ending current song")
+        self._end_song(skipped=True, played=played)
+        try:
+            self.current_fragment = len(self.songs[self.current_song].fragments)
+        except (IndexError, AttributeError):
+            # Out of the queue, or the song has no fragments yet
+            self.current_fragment = 2**64
+
+    async def seek(self, seconds: float) -> float:
+        """Moves the fragment pointer to the fragment of the current song that contains the given time
+
+        Returns:
+            float: Seconds from the start of that fragment to the time
+
+        Raises:
+            ValueError: There is no current song, it is still being fetched or the time is out of its range
+        """
+        if self.current_song >= len(self.songs):
+            raise ValueError("There is no song playing")
         song: Song = self.songs[self.current_song]
+        if not song.is_ready():
+            raise ValueError("The song is still being fetched")
+        for fragment in song.fragments:
+            if fragment.start <= seconds < fragment.end:
+                logger.debug("Seeking to fragment %d", fragment.fid)
+                self.current_fragment = fragment.fid
+                return seconds - fragment.start
+        raise ValueError("The time is past the end of the song")
+
+    def get_fragment_start(self) -> int:
+        """Returns the time in the current song at which the current fragment starts"""
+        try:
+            return self.songs[self.current_song].fragments[self.current_fragment].start
+        except (IndexError, AttributeError):
+            return 0
+
+    def get_fragment_end(self) -> int:
+        """Returns the time in the current song at which the current fragment ends"""
+        try:
+            return self.songs[self.current_song].fragments[self.current_fragment].end
+        except (IndexError, AttributeError):
+            return 0
+
+    def is_last_fragment(self) -> bool:
+        """Returns whether the current fragment is the last one of the current song"""
+        try:
+            return self.current_fragment == len(self.songs[self.current_song].fragments) - 1
+        except (IndexError, AttributeError):
+            return False
+
+    async def peek(self) -> Tuple[str, float] | None:
+        """Returns the first fragment of the song that plays after the current one, downloading it if needed
+
+        Returns:
+            Tuple[str, float]: The path to the fragment and the normalization gain of its song
+            None: The queue ends with the current song
+        """
+        song = self._get_next_song()
+        if song is None:
+            return None
+        await song.wait_until_ready()
+        if not song.fragments:
+            return None
+        fragment: Fragment = song.fragments[0]
+        await fragment.wait_until_downloaded()
+        return fragment.get_fragment_filepath(), song.freeze_gain()
+
+    def get_gain(self) -> float:
+        """Returns the loudness normalization gain of the current song in dB"""
+        try:
+            return self.songs[self.current_song].get_gain()
+        except IndexError:
+            return 0.0
+
+    def _end_song(self, skipped: bool, played: float | None = None) -> None:
+        """Records the end of the current song for the prefetch policy
+
+        Every way a song ends goes through here. Only songs get() returned a fragment of count, once,
+        so skipping past songs that never played does not look like the guild skips them right away.
+        """
+        if not self._started:
+            return
+        self._started = False
+        self.prefetch.record_song(skipped=skipped, played=played)
+
+    def _next_fragment(self) -> None:
         self.current_fragment += 1
+        metrics.PLAYLIST_ADVANCES.inc("fragment")
         logger.debug("Fragment pointer increased by 1")
-        # We download the next fragment, if there is one
-        self._preload_next_fragment(song, self.current_fragment)
 
     def _next_song(self) -> None:
         logger.debug("Fragment pointer reset to 0")
         self.current_fragment = 0
+        self._started = False
         if self.loopmode == LoopMode.CURRENT:
             logger.debug("Loop mode is current, will not move song pointer")
             return
@@ -109,6 +214,7 @@ class Playlist:
             )
             return
         self.current_song += 1
+        metrics.PLAYLIST_ADVANCES.inc("song")
         logger.debug("Song pointer increased by 1")
         # if our current song index is AFTER the end of the playlist
         if self.current_song >= song_count and self.loopmode == LoopMode.ALL:
@@ -118,42 +224,90 @@ class Playlist:
             self.current_song = 0
         # If loop mode is off, we just move onto the non-existent song.
         # Get current song will handle returning None if we are at the end of the playlist
-        # Load the first fragment
-        self._preload_next_song()  # Preload the next song if there is one
 
-    def _preload_next_fragment(self, song: Song, current_fragment: int) -> None:
-        logger.debug("Fragment preload requested in %s", song.meta.title)
-        fragments_last_idx: int = len(song.fragments) - 1
-        logger.debug("Last fragment index is %d", fragments_last_idx)
-        if current_fragment >= fragments_last_idx:
-            logger.debug(
-                "Will not preload fragment %d, as the current fragment is the last one",
-                current_fragment + 1,
-            )
-            logger.debug(
-                "As fragment %d is the last one, we will preload the next song.",
-                current_fragment,
-            )
-            self._preload_next_song()
-            return
-        logger.debug("Preloading fragment %d", current_fragment + 1)
-        song.fragments[
-            current_fragment + 1
-        ].start_download_thread()  # This won't do anything if it's already downloaded or already in the process of downloading
+    async def update_prefetch(self, played: float) -> float | None:
+        """Starts the downloads that are due at the given playback position, see _prefetch()
 
-    def _preload_next_song(self) -> None:
-        logger.debug("Next song preload requested")
-        song_count = len(self.songs)
-        # If there is another song after this one, preload it's first fragment
-        if self.current_song + 1 < song_count:
-            logger.debug("Next song exists, will preload its first fragment")
-            # If the next song exists
-            song = self.songs[self.current_song + 1]
-            self._preload_next_fragment(
-                song, -1
-            )  # We are not using the current_fragment to access the current fragment in this function, so this is fine
+        Args:
+            played (float): Seconds into the current song, counted from what was actually played
+
+        Returns:
+            float: Seconds of playback after which it should run again
+            None: Nothing is left to fetch ahead of the current fragment
+        """
+        return self._prefetch(played)
+
+    def _prefetch(self, played: float) -> float | None:
+        """Starts the downloads the prefetch policy wants ahead of the current fragment
+
+        Walks the fragments that play next, following the loop mode, until the audio before them is longer than the lookahead.
+        Fetches that are only needed if the current song is not skipped may be held back, see PrefetchPolicy.
+        The position is kept within the current fragment, whoever plays it calls this again as playback moves on.
+
+        Returns:
+            float: Seconds of playback until the next fetch is due, 0 while an upcoming song is still being fetched
+            None: Nothing is left to fetch ahead of the current fragment
+        """
+        try:
+            fragment: Fragment = self.songs[self.current_song].fragments[self.current_fragment]
+        except (IndexError, AttributeError):
+            return None
+        played = min(max(played, fragment.start), fragment.end)
+        hold = self.prefetch.get_hold() - played  # Seconds speculative fetches still wait
+        ahead = fragment.end - played  # Seconds of audio before the next fragment is needed
+        due: float | None = None  # Seconds until a fetch that was not started is due
+        for song, upcoming, needed in self._iter_upcoming():
+            if upcoming is None:
+                # Its fragments do not exist yet, so the walk continues once they do
+                return 0.0
+            length = upcoming.end - upcoming.start
+            lookahead = self.prefetch.get_lookahead(length)
+            if ahead > lookahead:
+                due = ahead - lookahead if due is None else min(due, ahead - lookahead)
+                break
+            if not needed and hold > 0 and ahead - hold > get_lead(length):
+                # Waits until the song played past the point the guild's skips usually happen at
+                due = hold if due is None else min(due, hold)
+            else:
+                upcoming.start_download_thread()  # This won't do anything if it's already downloaded or already in the process of downloading
+            ahead += length
+        return due
+
+    def _iter_upcoming(self) -> Iterator[Tuple[Song, Fragment | None, bool]]:
+        """Yields the fragments that play after the current one, following the loop mode
+
+        Returns:
+            Iterator[Tuple[Song, Fragment | None, bool]]: The song, its fragment or None if the song is not ready,
+            and whether the fragment is needed even if the current song is skipped
+        """
+        song: Song = self.songs[self.current_song]
+        for fragment in song.fragments[self.current_fragment + 1 :]:
+            yield song, fragment, False
+        for i, song in enumerate(self._iter_next_songs()):
+            if not song.is_ready():
+                yield song, None, i == 0
+                return
+            for fragment in song.fragments:
+                # Skipping moves onto the next song's first fragment
+                yield song, fragment, i == 0 and fragment.fid == 0
+
+    def _iter_next_songs(self) -> Iterator[Song]:
+        """Yields the songs next() moves onto once the current song ends, following the loop mode, each loop at most once"""
+        index = self.current_song
+        if index >= len(self.songs):
             return
-        logger.debug("Next song does not exist, will not preload")
+        for _ in range(len(self.songs)):
+            if self.loopmode != LoopMode.CURRENT:
+                index += 1
+            if index >= len(self.songs):
+                if self.loopmode != LoopMode.ALL:
+                    return
+                index = 0
+            yield self.songs[index]
+
+    def _get_next_song(self) -> Song | None:
+        """Returns the song next() moves onto once the current song ends, following the loop mode"""
+        return next(self._iter_next_songs(), None)
 
     async def add(self, url: str) -> None:
         logger.debug("Add job for %s requested", url)
@@ -182,7 +336,42 @@ class Playlist:
         else:
             self.songs = [song for song in self.songs if song.meta.url != identifier]
 
-    def clear(self) -> None:
+    def snapshot(self) -> Dict:
+        """Returns the queue and position as plain data, which restore() takes
+
+        Returns:
+            Dict: The song urls, the metadata of the songs that have it, pointers and loop mode
+        """
+        return {
+            "urls": [song.url for song in self.songs],
+            "meta": [song.meta.to_info() if song.is_ready() else None for song in self.songs],
+            "current_song": self.current_song,
+            "current_fragment": self.current_fragment,
+            "loopmode": self.loopmode.name,
+        }
+
+    def restore(self, state: Dict) -> None:
+        """Recreates the queue from a snapshot
+
+        Songs get their metadata injected from the snapshot (or the meta cache) and their fragments from the fragment cache,
+        so songs that were fetched before do not touch the network.
+        """
+        if "urls" not in state:
+            logger.warning("Not restoring a snapshot of a remote playlist")
+            return
+        logger.info("Restoring %d songs from a snapshot", len(state["urls"]))
+        infos = state.get("meta") or [None] * len(state["urls"])
+        self.songs = [
+            Song(url) if info is None else Song(url, meta=Meta(url, info=info))
+            for url, info in zip(state["urls"], infos)
+        ]
+        self.current_song = state["current_song"]
+        self.current_fragment = state["current_fragment"]
+        self.loopmode = LoopMode[state["loopmode"]]
+
+    async def clear(self, played: float | None = None) -> None:
+        """Empties the queue, a playing song counts as skipped at played seconds for the prefetch policy"""
+        self._end_song(skipped=True, played=played)
         self.songs.clear()
         self.current_song = 0
         self.current_fragment = 0
@@ -190,14 +379,14 @@ class Playlist:
     def get_loop_mode(self) -> str:
         return self.loopmode.name
 
-    def set_loop_mode(self, loop_mode: LoopMode) -> None:
+    async def set_loop_mode(self, loop_mode: LoopMode) -> None:
         self.loopmode = loop_mode
 
-    def cycle_loop_mode(self) -> LoopMode:
+    async def cycle_loop_mode(self) -> LoopMode:
         if self.loopmode == LoopMode.OFF:
-            self.set_loop_mode(LoopMode.CURRENT)
+            await self.set_loop_mode(LoopMode.CURRENT)
         elif self.loopmode == LoopMode.CURRENT:
-            self.set_loop_mode(LoopMode.ALL)
+            await self.set_loop_mode(LoopMode.ALL)
         else:
-            self.set_loop_mode(LoopMode.OFF)
+            await self.set_loop_mode(LoopMode.OFF)
         return self.get_loop_mode()
@@ -0,0 +1,125 @@
+import json
+import logging
+import urllib.parse
+import urllib.request
+from typing import Dict
+
+from ..config import META_ENDPOINT, META_TIMEOUT
+
+logger = logging.getLogger("strongest.resolver")
+
+# The only fields the queue, the cache and fragment planning ever read
+DISPLAY_FIELDS = (
+    "id",
+    "webpage_url",
+    "title",
+    "channel",
+    "uploader_url",
+    "channel_url",
+    "duration",
+)
+# Without these a song can not be shown or split into fragments
+REQUIRED_FIELDS = ("id", "webpage_url", "title", "duration")
+
+
+def get_video_id(url: str) -> str | None:
+    """Returns the list or video id of a youtube url, or None if it has neither"""
+    params = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    return params.get("list", params.get("v", [None]))[0]
+
+
+def display_fields(info: Dict) -> Dict:
+    """Trims an extractor result down to the fields needed to display and plan a song
+
+    Flat playlist entries carry their watch url in `url` instead of `webpage_url`, so that is used as a fallback.
+    """
+    trimmed = {key: info[key] for key in DISPLAY_FIELDS if info.get(key) is not None}
+    if "webpage_url" not in trimmed:
+        url = info.get("original_url") or info.get("url")
+        if url is not None:
+            trimmed["webpage_url"] = url
+    return trimmed
+
+
+def is_complete(info: Dict) -> bool:
+    """Returns whether trimmed display fields carry everything a song needs, see REQUIRED_FIELDS"""
+    return all(info.get(key) is not None for key in REQUIRED_FIELDS)
+
+
+def resolve(url: str) -> Dict:
+    """Fetches only the display metadata of a song
+
+    Formats and stream urls are not resolved here, that only happens once a fragment is downloaded.
+    If BOT_META_ENDPOINT is set, an oEmbed-style endpoint is asked first and yt-dlp is only used when it fails.
+
+    Returns:
+        Dict: The trimmed info dict, see DISPLAY_FIELDS
+    """
+    if META_ENDPOINT is not None:
+        info = _resolve_endpoint(url)
+        if info is not None:
+            return info
+    return _resolve_extractor(url)
+
+
+def _resolve_endpoint(url: str) -> Dict | None:
+    query = urllib.parse.urlencode({"url": url, "format": "json"})
+    logger.debug("Resolving %s using %s", url, META_ENDPOINT)
+    try:
+        with urllib.request.urlopen(
+            f"{META_ENDPOINT}?{query}", timeout=META_TIMEOUT
+        ) as response:
+            data = json.load(response)
+    except (OSError, ValueError) as e:
+        logger.warning("Metadata endpoint failed for %s", url, exc_info=e)
+        return None
+    if not isinstance(data, dict):
+        logger.warning("Metadata endpoint returned no object for %s", url)
+        return None
+    info = display_fields(
+        {
+            "id": data.get("id") or get_video_id(url),
+            "webpage_url": url,
+            "title": data.get("title"),
+            "channel": data.get("author_name"),
+            "channel_url": data.get("author_url"),
+            "duration": data.get("duration"),
+        }
+    )
+    # Plain oEmbed does not carry a duration, which we need to plan fragments
+    if not is_complete(info):
+        logger.debug("Metadata endpoint returned an incomplete result for %s", url)
+        return None
+    return info
+
+
+def _resolve_extractor(url: str) -> Dict:
+    """Resolves the display fields using yt-dlp
+
+    Raises:
+        ValueError: The extractor did not return what a song needs, see REQUIRED_FIELDS
+    """
+    # Imported here, as importing yt-dlp takes a while and is not needed until the first extraction
+    import yt_dlp
+
+    ydl_opts = {
+        "nocheckcertificate": True,
+        "quiet": True,
+        "no_warnings": True,
+        "no_playlist": True,
+        "no_search": True,
+        "verbose": False,
+        "skip_download": True,
+        # The player javascript is only needed to decipher stream urls
+        "extractor_args": {"youtube": {"player_skip": ["js"]}},
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        # process=False skips format selection and sorting entirely
+        info = display_fields(ydl.extract_info(url, download=False, process=False))
+        if not is_complete(info):
+            # Redirecting extractors return an unresolved url result, which only processing follows
+            logger.debug("Unprocessed extraction of %s is incomplete, processing it", url)
+            info = display_fields(ydl.extract_info(url, download=False))
+    if not is_complete(info):
+        raise ValueError(f"Could not resolve the metadata of {url}")
+    return info
@@ -1,18 +1,23 @@
 import asyncio
+import contextlib
 import json
 import logging
 import os
-import urllib
+import threading
+import time
 from typing import Dict, List
 
-import yt_dlp
-from yt_dlp.utils import download_range_func
-
+from ..config import CACHE_DIR, LOUDNESS_TARGET
+from ..filelock import file_lock
+from ..services import bandwidth, loudness, metrics, prefetch
+from ..services.workers import run_job
 from ..threaded_executor import ThreadedExecutor, threaded
+from .resolver import display_fields, get_video_id, resolve
 
 logger = logging.getLogger("strongest.song")
 
-CACHE_DIR = "./cache"
+REFRESH_INTERVAL: float = 5.0  # Seconds between looking for meta cache entries of other processes
+COMPACT_ENTRIES: int = 1000  # Journal entries after which they are folded into meta.json
 
 
 def initialize_cache():
@@ -29,43 +34,136 @@ def initialize_cache():
         except OSError as e:
             return
 
-initialize_cache()
 
 class MetaCache:
+    """Metadata cache backed by meta.json, shared by every process using the same cache directory
+
+    New entries are appended to a journal (meta.jsonl) under a file lock, which is folded into meta.json
+    once it holds COMPACT_ENTRIES entries, so a write costs one line instead of rewriting the whole file.
+    Lookups that miss read what other processes appended since, at most every REFRESH_INTERVAL seconds,
+    and only reload meta.json if it was compacted in the meantime.
+    Nothing is read on creation, the file is loaded by warm() or the first lookup that misses.
+    All of this blocks on the disk, so lookups and writes happen in fetch threads or executors, never on the bot's loop.
+    """
+
     _cache: Dict
+    _mtime: int | None  # Of the meta.json that was loaded
+    _journal_offset: int  # Bytes of the journal read so far
+    _journal_entries: int
+    _checked: float | None  # When other processes' changes were last looked for
+    _lock: threading.Lock
 
     def __init__(self) -> None:
         self._cache = dict()
-        try:
-            self.load()
-        except FileNotFoundError:
-            self.save()
+        self._mtime = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def warm(self) -> None:
+        """Creates meta.json if needed and loads it, so later lookups do not have to"""
+        initialize_cache()
+        with self._lock:
+            self._refresh(force=True)
 
-    def _get_params(self, url: str) -> Dict:
-        return urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    def _get_path(self) -> str:
+        return f"{CACHE_DIR}/meta.json"
+
+    def _get_journal_path(self) -> str:
+        return f"{CACHE_DIR}/meta.jsonl"
 
     def get(self, url: str, default: Dict | None = None) -> Dict | None:
-        params = self._get_params(url)
-        id = params.get("list", params.get("v", [None]))[0]
+        id = get_video_id(url)
         if id is None:
             return default
-        return self._cache.get(id, default)
+        with self._lock:
+            if id not in self._cache:
+                self._refresh()
+            data = self._cache.get(id)
+        metrics.META_CACHE.inc("miss" if data is None else "hit")
+        return default if data is None else data
 
     def set(self, url: str, data: Dict) -> None:
-        params = self._get_params(url)
-        id = params.get("list", params.get("v", [None]))[0]
+        id = get_video_id(url)
         if id is None:
             return None
-        self._cache[id] = data
-        self.save()
+        with self._lock, file_lock(f"{self._get_path()}.lock"):
+            # Catches up first, so our offset does not skip what other processes appended
+            self._refresh(force=True, locked=True)
+            self._cache[id] = data
+            with open(self._get_journal_path(), "ab") as f:
+                if f.tell() > self._journal_offset:
+                    # Ends the line a crashed writer cut off, so it does not swallow this entry
+                    f.write(b"\n")
+                f.write(json.dumps({"id": id, "data": data}).encode() + b"\n")
+                self._journal_offset = f.tell()
+            self._journal_entries += 1
+            if self._journal_entries >= COMPACT_ENTRIES:
+                logger.debug("Compacting %d journal entries into meta.json", self._journal_entries)
+                self.save()
 
     def save(self) -> None:
-        with open(f"{CACHE_DIR}/meta.json", "w") as f:
+        """Writes every entry to meta.json and empties the journal, the caller holds the file lock"""
+        path = self._get_path()
+        # Written to a temporary file first, so other processes never read a half written file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
             json.dump(self._cache, f)
+        os.replace(tmp, path)
+        open(self._get_journal_path(), "w").close()
+        self._mtime = os.stat(path).st_mtime_ns
+        self._journal_offset = 0
+        self._journal_entries = 0
 
     def load(self) -> None:
-        with open(f"{CACHE_DIR}/meta.json", "r") as f:
+        """Reads meta.json and the journal, the caller holds the file lock"""
+        path = self._get_path()
+        with open(path, "r") as f:
             self._cache = json.load(f)
+        self._mtime = os.stat(path).st_mtime_ns
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._read_journal()
+
+    def _read_journal(self) -> None:
+        """Applies the journal entries appended since it was last read"""
+        try:
+            with open(self._get_journal_path(), "rb") as f:
+                f.seek(self._journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A line without its newline was cut off by a crashed writer, the next entry starts after it
+        complete = data[: data.rfind(b"\n") + 1]
+        self._journal_offset += len(complete)
+        for line in complete.splitlines():
+            self._journal_entries += 1
+            try:
+                entry = json.loads(line)
+                self._cache[entry["id"]] = entry["data"]
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Skipping a corrupt meta cache journal entry")
+
+    def _refresh(self, force: bool = False, locked: bool = False) -> None:
+        """Picks up what other processes wrote, at most every REFRESH_INTERVAL seconds unless forced"""
+        now = time.monotonic()
+        if not force and self._checked is not None and now - self._checked < REFRESH_INTERVAL:
+            return
+        self._checked = now
+        # Writers append and compact under the lock, so the journal is never read half written
+        with contextlib.nullcontext() if locked else file_lock(f"{self._get_path()}.lock"):
+            try:
+                mtime = os.stat(self._get_path()).st_mtime_ns
+            except FileNotFoundError:
+                # Not created yet, only the journal has entries
+                self._read_journal()
+                return
+            if mtime != self._mtime:
+                logger.debug("meta.json was changed by another process, reloading")
+                self.load()
+            else:
+                self._read_journal()
 
 
 meta_cache: MetaCache = MetaCache()
@@ -77,12 +175,14 @@ class Meta:
     title: str
     channel_name: str
     channel_url: str
+    loudness: float | None  # LUFS of the song's first fragment, stored in the meta cache once analysed
     _fetch_thread: ThreadedExecutor | None
     _meta_injection: Dict | None
 
     def __init__(self, url: str, info: Dict | None = None) -> None:
         logger.info("Created SongMeta object for %s", url)
-        self._meta_injection = meta_cache.get(url, info)
+        self.loudness = None
+        self._meta_injection = info
         self._fetch_thread = self._fetch_meta(url)
 
     async def wait_until_fetched(self) -> None:
@@ -98,6 +198,32 @@ class Meta:
         logger.debug("Someone is waiting for a song object to fetch meta data")
         await self._fetch_thread.wait()
 
+    def to_info(self) -> Dict:
+        """Returns the fetched metadata in the form it can be injected back with
+
+        Returns:
+            Dict: The display fields, see resolver.DISPLAY_FIELDS
+        """
+        info = {
+            "id": self.vid,
+            "webpage_url": self.url,
+            "title": self.title,
+            "channel": self.channel_name,
+            "channel_url": self.channel_url,
+            "duration": self.duration,
+        }
+        if self.loudness is not None:
+            info["loudness"] = self.loudness
+        return info
+
+    def set_loudness(self, lufs: float | None) -> None:
+        """Stores the analysed loudness of the song with its metadata, blocks on the meta cache"""
+        if lufs is None:
+            # Analysed again the next time the song is downloaded or played
+            return
+        self.loudness = lufs
+        meta_cache.set(self.url, {**self._meta_injection, "loudness": lufs})
+
     def get_fragment_dir(self) -> str:
         """
         Return the directory path for where the fragments of this song will be stored
@@ -107,6 +233,8 @@ class Meta:
     @threaded
     async def _fetch_meta(self, url) -> None:
         logger.info("Started fetching metadata for %s", url)
+        # Looked up here, as a miss may read the meta cache's files, cached entries win over the injected ones
+        self._meta_injection = meta_cache.get(url, self._meta_injection)
         if self._meta_injection is not None:
             logger.info("Metadata for %s appears to be injected", url)
             info = self._meta_injection
@@ -119,44 +247,79 @@ class Meta:
                     "channel_url", self.url
                 )
                 self.duration = info["duration"]
+                self.loudness = info.get("loudness")
                 logger.info("Finished injecting metadata for %s", url)
                 return
             except KeyError:
                 logger.error(
                     "Failed to inject metadata for %s, will retry using fetch", url
                 )
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "nocheckcertificate": True,
-            "quiet": True,
-            "no_warnings": True,
-            "no_playlist": True,
-            "no_search": True,
-            "verbose": False,
-            "simulate": True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            self._meta_injection = info
-
-            self.vid = info["id"]
-            self.url = info["webpage_url"]
-            self.title = info["title"]
-            self.channel_name = info.get("channel", "")
-            self.channel_url = info.get("uploader_url") or info.get(
-                "channel_url", self.url
-            )
-            self.duration = info["duration"]
+        # Only the display fields are resolved here, formats are resolved by the fragment download
+        limiter = bandwidth.get_limiter()
+        lease = limiter.request(bandwidth.META_BYTES, urgent=True)
+        try:
+            limiter.wait(lease)
+            metrics.JOBS_IN_FLIGHT.inc("meta")
+            try:
+                info = await run_job(resolve, url)
+            finally:
+                metrics.JOBS_IN_FLIGHT.dec("meta")
+        finally:
+            limiter.release(lease)
+        self._meta_injection = info
+
+        self.vid = info["id"]
+        self.url = info["webpage_url"]
+        self.title = info["title"]
+        self.channel_name = info.get("channel", "")
+        self.channel_url = info.get("uploader_url") or info.get(
+            "channel_url", self.url
+        )
+        self.duration = info["duration"]
         logger.info("Finished fetching metadata for %s", url)
         meta_cache.set(url, info)
 
 
+def download_fragment(url: str, filepath: str, start: int, end: int) -> None:
+    """Downloads the section from start to end of url into filepath
+
+    This is a module level function so it can run in a worker process.
+    The fragment file is locked while downloading, so processes sharing the cache never download it twice.
+    """
+    import yt_dlp
+    from yt_dlp.utils import download_range_func
+
+    yt_opts = {
+        "format": "bestaudio/best",
+        "outtmpl": filepath,
+        "extractaudio": True,
+        "audioformat": "webm",
+        "nocheckcertificate": True,
+        "quiet": True,
+        "no_warnings": True,
+        "no_playlist": True,
+        "no_search": True,
+        "verbose": False,
+        "download_ranges": download_range_func(None, [(start, end)]),
+        "force_keyframes_at_cuts": True,
+    }
+    with file_lock(f"{filepath}.lock"):
+        if os.path.exists(filepath):
+            # Another process downloaded it while we waited for the lock
+            return
+        with yt_dlp.YoutubeDL(yt_opts) as ydl:
+            ydl.download(url)
+
+
 class Fragment:
     fid: int
     start: int
     end: int
     meta: Meta
     _download_thread: ThreadedExecutor | None
+    _lease: bandwidth.Lease | None  # While the download waits for or uses the bandwidth budget
+    _urgent: bool  # Someone waits for the download, it is not just fetched ahead
+    _lease_lock: threading.Lock  # Makes requesting the lease and marking the download urgent atomic
 
     def __init__(self, meta: Meta, fid: int, start: int, end: int) -> None:
         logger.debug("Created fragment from %d to %d for %s", start, end, meta.url)
@@ -165,6 +328,9 @@ class Fragment:
         self.start = start
         self.end = end
         self._download_thread = None
+        self._lease = None
+        self._urgent = False
+        self._lease_lock = threading.Lock()
 
     def is_downloaded(self) -> bool:
         """Returns whether the fragment's file is downloaded or not
@@ -182,6 +348,14 @@ class Fragment:
             "Someone is waiting for a fragment of %s to download", self.meta.url
         )
         self.start_download_thread()  # Doesn't do anything if the download thread is already running
+        # The download thread requests its lease under the same lock, so it either sees the download is urgent
+        # or has its lease promoted here
+        with self._lease_lock:
+            self._urgent = True
+            lease = self._lease
+        if lease is not None:
+            # Started as a prefetch, which playback caught up with
+            bandwidth.get_limiter().promote(lease)
         await self._download_thread.wait()
 
     def start_download_thread(self):
@@ -213,62 +387,124 @@ class Fragment:
         """
         return f"{self.meta.get_fragment_dir()}/{self.fid}"
 
+    def _analyse_loudness(self) -> None:
+        """Measures the song's loudness from its first fragment, once, unless the meta cache already has it
+
+        The first fragment is a fixed window, the whole song for most songs, so every play uses the same gain.
+        It is analysed in the background, so the download that playback waits for is not held up by the decode.
+        """
+        if self.fid != 0 or self.meta.loudness is not None or not LOUDNESS_TARGET:
+            return
+        loudness.analyse_later(self.get_fragment_filepath(), self.meta.set_loudness)
+
     @threaded
     async def _download(self) -> None:
+        debug = logger.isEnabledFor(logging.DEBUG)
         if self.is_downloaded():
+            metrics.FRAGMENT_CACHE.inc("hit")
+            if debug:
+                logger.debug(
+                    "Fragment %d to %d of %s is cached! Will not re-download.",
+                    self.start,
+                    self.end,
+                    self.meta.url,
+                )
+            self._analyse_loudness()
+            return
+        if debug:
             logger.debug(
-                "Fragment %d to %d of %s is cached! Will not re-download.",
+                "Starting download of fragment %d to %d of %s",
+                self.start,
+                self.end,
+                self.meta.url,
+            )
+        metrics.FRAGMENT_CACHE.inc("miss")
+        limiter = bandwidth.get_limiter()
+        with self._lease_lock:
+            self._lease = limiter.request(
+                bandwidth.estimate_fragment(self.end - self.start), self._urgent
+            )
+        size: int | None = None
+        try:
+            limiter.wait(self._lease)  # Only blocks this download's thread
+            metrics.JOBS_IN_FLIGHT.inc("fragment")
+            started = time.perf_counter()
+            try:
+                await run_job(
+                    download_fragment,
+                    self.meta.url,
+                    self.get_fragment_filepath(),
+                    self.start,
+                    self.end,
+                )
+            finally:
+                metrics.JOBS_IN_FLIGHT.dec("fragment")
+            elapsed = time.perf_counter() - started
+            if self.is_downloaded():
+                size = os.path.getsize(self.get_fragment_filepath())
+        finally:
+            limiter.release(self._lease, size)
+            self._lease = None
+        metrics.FRAGMENT_DOWNLOAD_SECONDS.observe(elapsed)
+        if size is not None:
+            prefetch.record_download(self.end - self.start, elapsed)
+            bandwidth.record_fragment(self.end - self.start, size)
+            metrics.FRAGMENT_DOWNLOAD_BYTES.observe(size)
+            self._analyse_loudness()
+        if debug:
+            logger.debug(
+                "Finished download of fragment %d to %d of %s",
                 self.start,
                 self.end,
                 self.meta.url,
             )
-            return
-        logger.debug(
-            "Starting download of fragment %d to %d of %s",
-            self.start,
-            self.end,
-            self.meta.url,
-        )
-        yt_opts = {
-            "format": "bestaudio/best",
-            "outtmpl": self.get_fragment_filepath(),
-            "extractaudio": True,
-            "audioformat": "webm",
-            "nocheckcertificate": True,
-            "quiet": True,
-            "no_warnings": True,
-            "no_playlist": True,
-            "no_search": True,
-            "verbose": False,
-            "download_ranges": download_range_func(None, [(self.start, self.end)]),
-            "force_keyframes_at_cuts": True,
-        }
-
-        with yt_dlp.YoutubeDL(yt_opts) as ydl:
-            ydl.download(self.meta.url)
-        logger.debug(
-            "Finished download of fragment %d to %d of %s",
-            self.start,
-            self.end,
-            self.meta.url,
-        )
 
 
 class Song:
+    url: str
     meta: Meta
     fragments: List[Fragment]
+    _gain: float | None  # Fixed once the song starts playing, see freeze_gain()
     _setup_task: asyncio.Task
 
     def __init__(self, url: str, meta: Meta | None = None) -> None:
         logger.info("Created new song: %s", url)
+        self.url = url
         self.meta = meta
+        self._gain = None
         self._setup_task = asyncio.get_event_loop().create_task(self._download(url))
 
+    def is_ready(self) -> bool:
+        """Returns whether the meta data is fetched and the fragments are created"""
+        return self._setup_task.done()
+
     async def wait_until_ready(self) -> None:
         """Waits until the file's meta data is fetched and fragments are prepared to be downloaded"""
         logger.debug("Someone is waiting for a song to finish initialization")
         await self._setup_task
 
+    def get_gain(self) -> float:
+        """Returns the normalization gain in dB, from the loudness stored with the song's metadata
+
+        Once the song started playing, this is the gain it was frozen at.
+        """
+        if self._gain is not None:
+            return self._gain
+        return loudness.get_gain(self.meta.loudness if self.is_ready() else None)
+
+    def freeze_gain(self) -> float:
+        """Fixes the gain for the rest of the play, so every fragment plays at the same level
+
+        A song played before its first analysis finished stays at unity gain instead of jumping at the next fragment,
+        the plays after it use the stored loudness.
+
+        Returns:
+            float: The gain in dB
+        """
+        if self._gain is None:
+            self._gain = self.get_gain()
+        return self._gain
+
     async def _download(self, url) -> None:
         if self.meta is None:
             logger.debug("Creating Metadata object")
@@ -300,6 +536,33 @@ class Song:
         self.fragments = fragments
 
 
+def fetch_playlist(url: str) -> Dict:
+    """Fetches the display fields of a playlist's entries
+
+    This is a module level function so it can run in a worker process.
+
+    Returns:
+        Dict: {"entries": [...]} with every entry trimmed by display_fields
+    """
+    import yt_dlp
+
+    ydl = yt_dlp.YoutubeDL(
+        {
+            "nocheckcertificate": True,
+            "quiet": True,
+            "no_warnings": True,
+            "no_playlist": True,
+            "no_search": True,
+            "verbose": False,
+            "playlistend": 50,
+            "extract_flat": "in_playlist",
+        }
+    )
+    with ydl:
+        info = ydl.extract_info(url, download=False)
+    return {"entries": [display_fields(video) for video in info.get("entries") or []]}
+
+
 class Playlist:
     url: str
     songs: List[Song]
@@ -338,19 +601,17 @@ class Playlist:
         logger.info("PlaylistLoader started fetching urls for %s", self.url)
         cached = meta_cache.get(self.url)
         if cached is None:
-            ydl = yt_dlp.YoutubeDL(
-                {
-                    "nocheckcertificate": True,
-                    "quiet": True,
-                    "no_warnings": True,
-                    "no_playlist": True,
-                    "no_search": True,
-                    "verbose": False,
-                    "playlistend": 50,
-                }
-            )
-            with ydl:
-                info = ydl.extract_info(self.url, download=False)
+            limiter = bandwidth.get_limiter()
+            lease = limiter.request(bandwidth.META_BYTES, urgent=True)
+            try:
+                limiter.wait(lease)
+                metrics.JOBS_IN_FLIGHT.inc("playlist")
+                try:
+                    info = await run_job(fetch_playlist, self.url)
+                finally:
+                    metrics.JOBS_IN_FLIGHT.dec("playlist")
+            finally:
+                limiter.release(lease)
             meta_cache.set(self.url, info)
         else:
             info = cached
@@ -1,26 +1,102 @@
+import asyncio
+import io
+import time
 from typing import Dict, List
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
+from app.config import IDLE_TIMEOUT, SNAPSHOT_INTERVAL
+from app.services import bandwidth, crossfade, hotcache, snapshots
 from app.services.audiocontroller import AudioController
+from app.services.broadcast import get_broadcast
+from app.services.filters import MAX_BASS, MAX_SPEED, MAX_VOLUME, MIN_SPEED
+from app.services.hibernation import REAP_INTERVAL, Hibernator
 from app.models.playlist import LoopMode, Playlist
 from app.embed_factory import create_embed
+from app.commandsync import sync_commands
+from app.services.diagnostics import sample_stacks
+
+# Users allowed to run the developer commands (/debug, /sync)
+DEVELOPERS: List[int] = [
+    380987045008506880,
+    936226256159125525,
+    722480803896098876,
+]
+
+
+def parse_time(text: str) -> int | None:
+    """Parses seconds, mm:ss or hh:mm:ss into seconds, None if it is not a valid time"""
+    seconds = 0
+    try:
+        for part in text.strip().split(":")[-3:]:
+            value = int(part)
+            if value < 0:
+                return None
+            seconds = seconds * 60 + value
+    except ValueError:
+        return None
+    return seconds
+
+
+def format_time(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
 
 
 class Default(commands.Cog):
     bot: commands.Bot
     controllers: Dict[int, AudioController]
+    hibernator: Hibernator
+    snapshot_store: snapshots.SnapshotStore
+    _resumed: bool
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.controllers = dict()
+        self.hibernator = Hibernator(IDLE_TIMEOUT)
+        self.snapshot_store = snapshots.SnapshotStore()
+        self._resumed = False
+
+    async def cog_load(self):
+        if IDLE_TIMEOUT > 0:
+            self._reap.start()
+        if SNAPSHOT_INTERVAL > 0:
+            self._snapshot.change_interval(seconds=SNAPSHOT_INTERVAL)
+            self._snapshot.start()
+
+    async def cog_unload(self):
+        self._reap.cancel()
+        if self._snapshot.is_running():
+            self._snapshot.cancel()
+            # Last snapshot before shutting down, while we are still in the voice channels
+            self.snapshot_store.save_all(snapshots.collect(self))
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # on_ready also fires after reconnects, we only resume once
+        if self._resumed or SNAPSHOT_INTERVAL <= 0:
+            return
+        self._resumed = True
+        await snapshots.resume(self, self.snapshot_store)
+
+    @tasks.loop(seconds=REAP_INTERVAL)
+    async def _reap(self):
+        await self.hibernator.reap(self.controllers)
+
+    @tasks.loop(seconds=60)
+    async def _snapshot(self):
+        # Collected on the loop, as it reads the controllers, written on a thread
+        states = snapshots.collect(self)
+        await asyncio.to_thread(self.snapshot_store.save_all, states)
 
     def _get_controller(self, guild: discord.Guild):
         c = self.controllers.get(guild.id, None)
         if c is None:
-            self.controllers[guild.id] = AudioController(self.bot, guild)
-        return self.controllers[guild.id]
+            c = self.controllers[guild.id] = self.hibernator.rehydrate(self.bot, guild)
+        c.touch()
+        return c
 
     @commands.hybrid_command(
         name="debug",
@@ -31,11 +107,7 @@ class Default(commands.Cog):
     @commands.has_permissions()
     @commands.cooldown(1, 2, commands.BucketType.member)
     async def _debug(self, ctx: commands.Context):
-        if ctx.author.id not in [
-            380987045008506880,
-            936226256159125525,
-            722480803896098876,
-        ]:
+        if ctx.author.id not in DEVELOPERS:
             await ctx.reply(
                 embed=create_embed(
                     "Error", "This command can only be used by the bot's developers!"
@@ -79,6 +151,7 @@ class Default(commands.Cog):
             )
         )
         """
+        await controller.sync_playlist()
         playlist: Playlist = controller._playlist
         data: List[str] = []
         # VC Connected?
@@ -163,6 +236,31 @@ class Default(commands.Cog):
                 )
         # Loop mode
         data.append("Loop: " + f"`{playlist.loopmode.name.title()}`")
+        # Player state machine
+        data.append("Player State: " + f"`{controller.get_state().name.title()}`")
+        position = controller.get_position()
+        if position is not None:
+            data.append("Position: " + f"`{format_time(position)}`")
+        data.append("Filters: " + controller.filters.describe())
+        data.append("Normalization: " + f"`{playlist.get_gain():+.1f}dB`")
+        data.append("Crossfade: " + f"`{controller.crossfade:g}s`")
+        if isinstance(playlist, Playlist):
+            data.append("Prefetch: " + playlist.prefetch.describe())
+            data.append("Bandwidth: " + bandwidth.get_limiter().describe())
+        data.append("Hot cache: " + hotcache.get_cache().describe())
+        if controller.broadcast is not None:
+            data.append(
+                "Broadcast: " + f"`{len(controller.broadcast.listeners)}` listening along"
+            )
+        listening = controller.get_listening()
+        if listening is not None:
+            data.append("Listening along with: " + f"`{listening.host_id}`")
+        for previous, state, elapsed in controller.get_transitions()[-4:]:
+            data.append(
+                f"- `{previous.name.title()}` -> `{state.name.title()}` after `{elapsed:.3f}s`"
+            )
+        # Voice send path
+        data.append("Voice " + controller.voice_stats.describe())
 
         # Send response
         await ctx.reply(
@@ -171,6 +269,65 @@ class Default(commands.Cog):
             )
         )
 
+    @commands.hybrid_command(
+        name="profile",
+        usage="&profile [seconds]",
+        description="Samples what every thread is doing and sends a flame graph file",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 60, commands.BucketType.default)
+    async def _profile(self, ctx: commands.Context, seconds: int = 10):
+        if ctx.author.id not in DEVELOPERS:
+            await ctx.reply(
+                embed=create_embed(
+                    "Error", "This command can only be used by the bot's developers!"
+                )
+            )
+            return
+        if seconds < 1 or seconds > 60:
+            await ctx.reply(
+                embed=create_embed(
+                    "Error", "The profile must be between 1 and 60 seconds long"
+                )
+            )
+            return
+        await ctx.defer()
+        # The sampler runs in its own thread, so it also catches a blocked event loop
+        folded = await asyncio.to_thread(sample_stacks, seconds)
+        await ctx.reply(
+            embed=create_embed(
+                "Profile",
+                f"Sampled every thread for {seconds} seconds.\n"
+                + "Open the file in <https://www.speedscope.app> or run it through `flamegraph.pl`.",
+            ),
+            file=discord.File(
+                io.BytesIO(folded.encode()), filename=f"profile-{int(time.time())}.folded"
+            ),
+        )
+
+    @commands.hybrid_command(
+        name="sync",
+        usage="&sync",
+        description="Forces the slash commands to sync with discord",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 60, commands.BucketType.default)
+    async def _sync(self, ctx: commands.Context):
+        if ctx.author.id not in DEVELOPERS:
+            await ctx.reply(
+                embed=create_embed(
+                    "Error", "This command can only be used by the bot's developers!"
+                )
+            )
+            return
+        await ctx.defer()
+        await sync_commands(self.bot, force=True)
+        await ctx.reply(
+            embed=create_embed("Synced", "The slash commands have been synced.")
+        )
+
     @commands.hybrid_command(
         name="restart",
         usage="&restart",
@@ -384,18 +541,104 @@ class Default(commands.Cog):
                 )
             )
             return
-        if num == 1:
-            await controller.skip(quiet=True)
-        else:
-            for _ in range(num - 1):
-                controller._playlist.skip()
-            await controller.skip(quiet=True)
+        await controller.skip(quiet=True, count=num)
         await ctx.reply(
             embed=create_embed(
                 "Fast-forward", f"Skipped {num} song{'s' if num > 1 else ''}"
             )
         )
 
+    @commands.hybrid_command(
+        name="seek",
+        usage="&seek <time>",
+        description="Jumps to a time in the current song, given as seconds, mm:ss or hh:mm:ss",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 2, commands.BucketType.member)
+    async def _seek(self, ctx: commands.Context, position: str):
+        seconds = parse_time(position)
+        if seconds is None:
+            await ctx.reply(
+                embed=create_embed(
+                    "Error", "The time must be given as seconds, mm:ss or hh:mm:ss"
+                )
+            )
+            return
+        controller: AudioController = self._get_controller(ctx.guild)
+        if not controller.is_connected():
+            await ctx.reply(
+                embed=create_embed(
+                    "Error", "The bot is currently not in a voice channel!"
+                )
+            )
+            return
+        try:
+            await controller.seek(seconds)
+        except ValueError as e:
+            await ctx.reply(embed=create_embed("Error", str(e)))
+            return
+        await ctx.reply(
+            embed=create_embed("Seek", f"Jumped to `{format_time(seconds)}`")
+        )
+
+    @commands.hybrid_command(
+        name="broadcast",
+        usage="&broadcast",
+        description="Toggles letting other servers listen along to this server's player",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 2, commands.BucketType.member)
+    async def _broadcast(self, ctx: commands.Context):
+        controller: AudioController = self._get_controller(ctx.guild)
+        if controller.broadcast is not None:
+            controller.stop_broadcast()
+            await ctx.reply(
+                embed=create_embed("Broadcast", "Other servers no longer listen along")
+            )
+            return
+        await controller.start_broadcast()
+        await ctx.reply(
+            embed=create_embed(
+                "Broadcast",
+                f"Other servers can now listen along with `/listen {ctx.guild.id}`",
+            )
+        )
+
+    @commands.hybrid_command(
+        name="listen",
+        usage="&listen <server id>",
+        description="Plays what another server is broadcasting, your queue is kept for later",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 2, commands.BucketType.member)
+    async def _listen(self, ctx: commands.Context, server: str):
+        broadcast = get_broadcast(int(server)) if server.isdigit() else None
+        if broadcast is None or broadcast.host_id == ctx.guild.id:
+            await ctx.reply(
+                embed=create_embed("Error", "That server is not broadcasting")
+            )
+            return
+        controller: AudioController = self._get_controller(ctx.guild)
+        if not controller.is_connected():
+            if ctx.author.voice is None:
+                await ctx.reply(
+                    embed=create_embed(
+                        "Error", "You must run this command in a voice channel"
+                    )
+                )
+                return
+            await controller.join(ctx.author.voice.channel, ctx.channel)
+        await controller.listen(broadcast)
+        await ctx.reply(
+            embed=create_embed(
+                "Listening Along",
+                "Now playing what the other server is playing\nUse `/play` to go back to your own queue",
+            )
+        )
+
     @commands.hybrid_command(
         name="queue",
         usage="&queue [page]",
@@ -406,6 +649,7 @@ class Default(commands.Cog):
     @commands.cooldown(1, 2, commands.BucketType.member)
     async def _queue(self, ctx: commands.Context, page: int = 1):
         controller: AudioController = self._get_controller(ctx.guild)
+        await controller.sync_playlist()
         queue, remaining = controller.get_queue(
             template_remaining="{}", character_limit_per_page=1700
         )  # Leaves us with 300 characters to work with per page
@@ -440,20 +684,109 @@ class Default(commands.Cog):
     async def _loop(self, ctx: commands.Context, mode: str = None):
         controller: AudioController = self._get_controller(ctx.guild)
         if mode is None:
-            loop_mode = controller._playlist.cycle_loop_mode()
+            loop_mode = await controller._playlist.cycle_loop_mode()
         else:
             mode = mode.lower()
             if mode.startswith("a"):
-                controller._playlist.set_loop_mode(LoopMode.ALL)
+                await controller._playlist.set_loop_mode(LoopMode.ALL)
             elif mode.startswith("c") or mode.startswith("s"):
-                controller._playlist.set_loop_mode(LoopMode.CURRENT)
+                await controller._playlist.set_loop_mode(LoopMode.CURRENT)
             else:
-                controller._playlist.set_loop_mode(LoopMode.OFF)
+                await controller._playlist.set_loop_mode(LoopMode.OFF)
             loop_mode = controller._playlist.get_loop_mode()
         await ctx.reply(
             embed=create_embed("Loop", f"Loop mode has been set to `{loop_mode}`")
         )
 
+    async def _set_filters(self, ctx: commands.Context, **changes):
+        controller: AudioController = self._get_controller(ctx.guild)
+        if changes:
+            await controller.set_filters(controller.filters.replace(**changes))
+        await ctx.reply(embed=create_embed("Filters", controller.filters.describe()))
+
+    @commands.hybrid_command(
+        name="volume",
+        usage="&volume [percent]",
+        description=f"Sets the volume, from 0 to {MAX_VOLUME * 100:.0f} percent",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 2, commands.BucketType.member)
+    async def _volume(self, ctx: commands.Context, percent: float = None):
+        if percent is None:
+            await self._set_filters(ctx)
+            return
+        await self._set_filters(ctx, volume=percent / 100)
+
+    @commands.hybrid_command(
+        name="bassboost",
+        usage="&bassboost [gain]",
+        description=f"Boosts (or cuts) the bass by up to {MAX_BASS:g}dB, 0 turns it off",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 2, commands.BucketType.member)
+    async def _bassboost(self, ctx: commands.Context, gain: float = None):
+        if gain is None:
+            await self._set_filters(ctx)
+            return
+        await self._set_filters(ctx, bass=gain)
+
+    @commands.hybrid_command(
+        name="speed",
+        usage="&speed [factor]",
+        description=f"Changes the tempo without changing the pitch, from {MIN_SPEED:g}x to {MAX_SPEED:g}x",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 2, commands.BucketType.member)
+    async def _speed(self, ctx: commands.Context, factor: float = None):
+        if factor is None:
+            await self._set_filters(ctx)
+            return
+        await self._set_filters(ctx, speed=factor)
+
+    @commands.hybrid_command(
+        name="nightcore",
+        usage="&nightcore",
+        description="Toggles nightcore, which raises both the pitch and the tempo",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 2, commands.BucketType.member)
+    async def _nightcore(self, ctx: commands.Context):
+        controller: AudioController = self._get_controller(ctx.guild)
+        await self._set_filters(ctx, nightcore=not controller.filters.nightcore)
+
+    @commands.hybrid_command(
+        name="crossfade",
+        usage="&crossfade [seconds]",
+        description=f"Fades songs into each other for up to {crossfade.MAX_CROSSFADE:g} seconds, 0 turns it off",
+    )
+    @commands.guild_only()
+    @commands.has_permissions()
+    @commands.cooldown(1, 2, commands.BucketType.member)
+    async def _crossfade(self, ctx: commands.Context, seconds: float = None):
+        if not crossfade.is_available():
+            await ctx.reply(
+                embed=create_embed(
+                    "Error",
+                    "Crossfading is not available on this bot, it needs numpy (the `crossfade` extra)",
+                )
+            )
+            return
+        controller: AudioController = self._get_controller(ctx.guild)
+        if seconds is not None:
+            controller.set_crossfade(seconds)
+        await ctx.reply(
+            embed=create_embed(
+                "Crossfade",
+                f"Songs crossfade for `{controller.crossfade:g}s`"
+                if controller.crossfade
+                else "Crossfade is off",
+            )
+        )
+
     @commands.hybrid_command(
         name="clear",
         usage="&clear",
@@ -464,8 +797,7 @@ class Default(commands.Cog):
     @commands.cooldown(1, 2, commands.BucketType.member)
     async def _clear(self, ctx: commands.Context):
         controller: AudioController = self._get_controller(ctx.guild)
-        controller._playlist.clear()
-        await controller.skip()
+        await controller.clear()
         await ctx.reply(embed=create_embed("Queue", "The queue has been cleared!"))
 
 
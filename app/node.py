@@ -0,0 +1,23 @@
+import argparse
+import logging
+
+from aiohttp import web
+
+from .services.audionode import AudioNode
+
+logger = logging.getLogger("strongest.audionode")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Runs an audio node, which hosts playlists and the fragment cache for a front-end"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    logger.info("Starting audio node on %s:%d", args.host, args.port)
+    web.run_app(AudioNode().create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
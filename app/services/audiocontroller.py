@@ -1,33 +1,86 @@
 import asyncio
 import logging
-from typing import List, Tuple
+import time
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, List, Tuple
 
 import discord
 from discord.ext import commands
 
+from ..config import CROSSFADE, VOICE_SENDERS
 from ..models.playlist import Playlist
-from ..models.song import Fragment
+from . import bandwidth, crossfade, hotcache, metrics
+from .broadcast import IDLE_WAIT, Broadcast, BroadcastSource, ListenerSource, open_broadcast
+from .crossfade import MAX_CROSSFADE, CrossfadeSource
+from .filters import AudioFilters
+from .prefetch import MIN_INTERVAL
+from .remoteplaylist import RemotePlaylist, get_node_pool
+from .sender import MultiplexedVoiceClient
+from .voicestats import FRAME_LENGTH, InstrumentedSource, VoiceStats
 
 logger = logging.getLogger("strongest.audiocontroller")
 
+TRANSITION_HISTORY: int = 32
+
+
+class PlayerState(Enum):
+    IDLE = 0
+    LOADING = 1  # Waiting for the playlist to hand us a downloaded fragment
+    PLAYING = 2  # The voice client is playing a fragment
+    ADVANCING = 3  # Moving the playlist pointers to the next fragment
+
 
 class AudioController:
     bot: commands.Bot
     guild: discord.Guild
+    voice_stats: VoiceStats
+    filters: AudioFilters
+    crossfade: float  # Seconds, 0 plays songs back to back
+    broadcast: Broadcast | None  # Hosted by this guild
+    last_active: float
     _vc: discord.VoiceClient | None
     _callback_channel: discord.TextChannel
-    _playlist: Playlist
-    _finished_playing: asyncio.Event | None
+    _playlist: Playlist | RemotePlaylist
     _play_task: asyncio.Task | None
+    _state: PlayerState
+    _state_since: float
+    _transitions: Deque[Tuple[PlayerState, PlayerState, float]]
+    _play_requested: float | None
+    _fragment_finished: float | None
+    _alone_since: float | None
+    _source: InstrumentedSource | None
+    _position_base: float
+    _source_rate: float
+    _seek_offset: float | None
+    _listening: ListenerSource | None
     __loop: asyncio.AbstractEventLoop
 
     def __init__(self, bot: commands.Bot, guild: discord.Guild) -> None:
         logger.info("Initialized AudioController for %s (%d)", guild.name, guild.id)
         self.bot = bot
         self.guild = guild
-        self._playlist = Playlist()
-        self._finished_playing = None
+        pool = get_node_pool()
+        self._playlist = (
+            Playlist() if pool is None else RemotePlaylist(pool, guild.id)
+        )
         self._play_task = None
+        self._state = PlayerState.IDLE
+        self._state_since = time.perf_counter()
+        self._transitions = deque(maxlen=TRANSITION_HISTORY)
+        self._play_requested = None
+        self._fragment_finished = None
+        self.voice_stats = VoiceStats()
+        self.filters = AudioFilters()
+        self.crossfade = min(max(CROSSFADE, 0.0), MAX_CROSSFADE)
+        self.broadcast = None
+        self.last_active = time.monotonic()
+        self._alone_since = None
+        self._source = None
+        self._position_base = 0.0
+        self._source_rate = 1.0
+        self._seek_offset = None
+        self._listening = None
         self.__loop = asyncio.get_running_loop()
 
         self._callback_channel = None
@@ -38,35 +91,277 @@ class AudioController:
     def is_connected(self) -> bool:
         return self._vc is not None
 
+    def is_playing(self) -> bool:
+        return self._play_task is not None
+
+    def has_queue(self) -> bool:
+        """Returns whether there are songs left to play"""
+        return self._playlist.current_song < len(self._playlist.songs)
+
+    def touch(self) -> None:
+        """Marks the controller as used, which resets its idle time"""
+        self.last_active = time.monotonic()
+
+    def idle_for(self, now: float) -> float:
+        """Returns how long the controller has been idle
+
+        A connected controller is idle while nobody else is in its voice channel, a disconnected one is idle
+        from the last time it was used, as long as it is not playing.
+
+        Returns:
+            float: Seconds, 0 if it is in use
+        """
+        if self.broadcast is not None and self.broadcast.listeners:
+            # Other guilds are listening along
+            return 0
+        if self._vc is not None:
+            if any(not member.bot for member in self._vc.channel.members):
+                self._alone_since = None
+                return 0
+            if self._alone_since is None:
+                self._alone_since = now
+            return now - self._alone_since
+        if self._play_task is not None:
+            return 0
+        return now - self.last_active
+
+    def snapshot(self) -> Dict:
+        """Returns the queue and where the player is as plain data, which restore() takes
+
+        Returns:
+            Dict: The guild, playlist snapshot, filters, crossfade, voice channel and callback channel
+        """
+        return {
+            "guild": self.guild.id,
+            "playlist": self._playlist.snapshot(),
+            "filters": self.filters.to_dict(),
+            "crossfade": self.crossfade,
+            "channel": self._vc.channel.id if self._vc is not None else None,
+            "callback_channel": (
+                self._callback_channel.id if self._callback_channel is not None else None
+            ),
+        }
+
+    def restore(self, state: Dict) -> None:
+        """Restores the queue and filters of a snapshot, does not join or start playing"""
+        self._playlist.restore(state["playlist"])
+        if "filters" in state:
+            self.filters = AudioFilters.from_dict(state["filters"])
+        self.crossfade = state.get("crossfade", self.crossfade)
+
+    async def resume(self, state: Dict) -> bool:
+        """Restores the queue of a snapshot, and rejoins the voice channel and plays on if it was in one
+
+        Returns:
+            bool: True if playback was resumed, False if only the queue was restored
+        """
+        self.restore(state)
+        channel = self.guild.get_channel(state["channel"]) if state["channel"] else None
+        if channel is None or not self.has_queue():
+            return False
+        # The callback channel may have been deleted in the meantime, which does not stop us from playing
+        callback_channel = (
+            self.guild.get_channel(state["callback_channel"])
+            if state["callback_channel"]
+            else None
+        )
+        logger.info("Resuming playback in %s (%d)", self.guild.name, self.guild.id)
+        await self.join(channel, callback_channel)
+        await self.play()
+        return True
+
+    async def hibernate(self) -> Dict | None:
+        """Stops the player and leaves without clearing the queue
+
+        Returns:
+            Dict: A snapshot to restore the queue from
+            None: There was nothing left to play, so nothing to restore
+        """
+        logger.info("Hibernating AudioController for %s (%d)", self.guild.name, self.guild.id)
+        state = self.snapshot() if self.has_queue() else None
+        if self._vc is not None or self._play_task is not None:
+            await self.stop(clear=False)
+        if state is None and isinstance(self._playlist, RemotePlaylist):
+            await self._playlist.release()
+        return state
+
+    def get_position(self) -> float | None:
+        """Returns the playback position in the current song, counted from the frames sent so far
+
+        Returns:
+            float: Seconds from the start of the song
+            None: Nothing is playing
+        """
+        if self._state != PlayerState.PLAYING or self._source is None:
+            return None
+        return (
+            self._position_base
+            + self._source.frames * FRAME_LENGTH * self._source_rate
+        )
+
+    async def seek(self, seconds: float) -> None:
+        """Continues the current song from the given time
+
+        Only the fragment that contains the time is needed, which is played with an input offset.
+        If it is cached, playback continues right away, otherwise only that fragment is downloaded.
+
+        Raises:
+            ValueError: Nothing is playing, or the time is out of the song's range
+        """
+        if self._state != PlayerState.PLAYING or self._vc is None:
+            raise ValueError("Nothing is playing right now")
+        offset = await self._playlist.seek(seconds)
+        logger.debug("Seeking to %.1fs, %.1fs into the fragment", seconds, offset)
+        # The play task skips moving to the next fragment and starts the one we seeked to at the offset
+        self._seek_offset = offset
+        self._source = None
+        self._vc.stop()
+
+    async def _restart(self) -> None:
+        """Restarts the playing fragment at the current position, so changes to how fragments are opened
+        are heard within a frame instead of at the next fragment
+        """
+        position = self.get_position()
+        if position is None:
+            # Picked up when the next fragment starts
+            return
+        try:
+            await self.seek(position)
+        except ValueError:
+            # The fragment just ended, the next one is opened with the changes anyway
+            pass
+
+    async def set_filters(self, filters: AudioFilters) -> None:
+        """Replaces the audio filters, a playing fragment continues with the new filter graph"""
+        self.filters = filters
+        await self._restart()
+
+    async def start_broadcast(self) -> Broadcast:
+        """Lets other guilds listen along, see broadcast.Broadcast
+
+        Returns:
+            Broadcast: The broadcast of this guild
+        """
+        if self.broadcast is None:
+            self.broadcast = open_broadcast(self.guild.id)
+            # Listeners hear the playing fragment right away, not from the next one
+            await self._restart()
+        return self.broadcast
+
+    def stop_broadcast(self) -> None:
+        """Ends the broadcast of this guild, its listeners stop playing"""
+        broadcast, self.broadcast = self.broadcast, None
+        if broadcast is not None:
+            broadcast.close()
+
+    def is_listening(self) -> bool:
+        return self._listening is not None
+
+    def get_listening(self) -> Broadcast | None:
+        """Returns the broadcast this guild listens to"""
+        return self._listening.broadcast if self._listening is not None else None
+
+    async def listen(self, broadcast: Broadcast) -> None:
+        """Plays another guild's broadcast instead of the queue, which is kept for later
+
+        Raises:
+            ValueError: The bot is not in a voice channel
+        """
+        if self._vc is None:
+            raise ValueError("The bot is currently not in a voice channel!")
+        await self._cleanup()
+        # A shared sender thread must not wait for the host, it sends silence instead
+        wait = 0 if isinstance(self._vc, MultiplexedVoiceClient) else IDLE_WAIT
+        source = ListenerSource(broadcast, self.guild.id, wait, self.voice_stats)
+
+        def after(error: Exception | None) -> None:
+            # Runs on the audio player thread
+            self.__loop.call_soon_threadsafe(self._listening_ended, source, error)
+
+        logger.info("Listening along with %d", broadcast.host_id)
+        self._listening = source
+        self._vc.play(source, after=after)
+
+    def stop_listening(self) -> None:
+        source, self._listening = self._listening, None
+        if source is None:
+            return
+        source.close()
+        if self._vc is not None:
+            self._vc.stop()
+
+    def _listening_ended(self, source: ListenerSource, error: Exception | None) -> None:
+        if error is not None:
+            logger.error("Listening along failed", exc_info=error)
+        if self._listening is source:
+            logger.info("The broadcast of %d ended", source.broadcast.host_id)
+            self._listening = None
+
+    def set_crossfade(self, seconds: float) -> float:
+        """Sets how long songs crossfade, takes effect from the next song that starts
+
+        Returns:
+            float: The crossfade in seconds, clamped to what is supported
+        """
+        self.crossfade = min(max(seconds, 0.0), MAX_CROSSFADE)
+        return self.crossfade
+
+    def get_state(self) -> PlayerState:
+        return self._state
+
+    def get_transitions(self) -> List[Tuple[PlayerState, PlayerState, float]]:
+        """Returns the most recent state transitions of the player
+
+        Returns:
+            List[Tuple[PlayerState, PlayerState, float]]: (from, to, seconds spent in from), oldest first
+        """
+        return list(self._transitions)
+
     async def join(
-        self, channel: discord.VoiceChannel, callback_channel: discord.TextChannel
+        self,
+        channel: discord.VoiceChannel,
+        callback_channel: discord.TextChannel | None,
     ) -> None:
         logger.info(
             "Joining channel %s with callback in %s",
             channel.name,
-            callback_channel.name,
+            callback_channel.name if callback_channel is not None else None,
         )
         if self._vc is not None:
             logger.warn("Already in a voice channel! Will not overwrite.")
             return
-        self._vc = await channel.connect()
+        if VOICE_SENDERS:
+            self._vc = await channel.connect(cls=MultiplexedVoiceClient)
+        else:
+            self._vc = await channel.connect()
         self._callback_channel = callback_channel
 
-    async def leave(self) -> None:
+    async def leave(self, clear: bool = True) -> None:
         logger.info("Leaving current channel")
         await self._vc.disconnect()
         self._vc = None
         self._callback_channel = None
-        self._playlist.clear()
+        self._alone_since = None
+        if clear:
+            await self._playlist.clear()
+            if isinstance(self._playlist, RemotePlaylist):
+                # Nothing is left to resume, so the node can drop the queue
+                await self._playlist.release()
 
     async def queue(self, url: str) -> None:
         logger.info("Queuing %s", url)
+        bandwidth.guild.set(self.guild.id)
         try:
             await self._playlist.add(url)
             logger.info("Queued %s successfully", url)
         except Exception as e:
             logger.error("Something went wrong queuing %s", url, exc_info=e)
 
+    async def sync_playlist(self) -> None:
+        """Refreshes the mirrored queue state when the playlist lives on an audio node"""
+        if isinstance(self._playlist, RemotePlaylist):
+            await self._playlist.refresh()
+
     def get_queue(
         self,
         template: str = "[{}](<{}>) uploaded by [{}](<{}>)",
@@ -86,7 +381,7 @@ class AudioController:
                 song.meta.channel_url,
             )
             for song in self._playlist.songs
-            if song._setup_task.done()
+            if song.is_ready()
         ]
         remaining = template_remaining.format(len(self._playlist.songs) - len(queued))
         partitioned = []
@@ -101,127 +396,275 @@ class AudioController:
         partitioned.append(partition)
         return partitioned, remaining
 
-    async def skip(self, quiet: bool = False) -> None:
-        """Skips the current song
+    async def skip(self, quiet: bool = False, count: int = 1) -> None:
+        """Skips the current song, and the count - 1 songs after it
         Returns:
             None
         """
-        logger.debug("Skipping the current song")
-        try:
-            self._playlist.current_fragment = len(
-                self._playlist.songs[self._playlist.current_song].fragments
-            )
-        except IndexError as e:
-            logger.error("bruh", exc_info=e)  # TODO: Actually debug what's wrong
-            self._playlist.current_fragment = 2**64
-        self._vc.stop()
+        logger.debug("Skipping %d songs", count)
+        self._seek_offset = None
+        # Only the playing song was skipped at this position, the ones after it never started
+        played = self.get_position()
+        for _ in range(count - 1):
+            await self._playlist.skip(played)
+            played = None
+        await self._playlist.end_current_song(played)
+        if self._vc is not None:
+            self._vc.stop()
+
+    async def clear(self) -> None:
+        """Empties the queue and stops the playing song"""
+        logger.debug("Clearing the queue")
+        await self._playlist.clear(self.get_position())
+        await self.skip()
 
     async def play(self) -> None:
         """
         Initialities the audio player task
 
         This method checks if a play task is already running.
-        If not, it creates a new event object to track when the audio playback has finished.
-        It then sets the event to indicate that the audio has finished playing.
-        Finally, it creates a new play task using the `_play` method and assigns it to the `_play_task` attribute.
+        If not, it creates a new play task using the `_play` method and assigns it to the `_play_task` attribute.
 
         Returns:
             None
         """
         logger.info("Controller play command issued")
+        # The own queue replaces whatever we were listening along to
+        self.stop_listening()
         if self._play_task is None:
             logger.info("Starting new play task")
-            self._finished_playing = asyncio.Event()
-            self._finished_playing.set()
-            # TODO? Perhaps use a seperate thread for the play loop it self (asyncio "executor" param)
+            self._play_requested = time.perf_counter()
             self._play_task = asyncio.create_task(self._play())
         else:
             logger.warn("Already playing! Nothing will be done.")
 
-    async def stop(self) -> None:
+    async def stop(self, clear: bool = True) -> None:
         """Stops the audio player
         Returns:
             None
         """
         logger.info("Controller stop command issued")
+        self.stop_broadcast()
+        self.stop_listening()
         if self._play_task is None:
             logger.warn("We are already stopped")
             if self._vc is not None:
                 logger.warn("Leaving the voice channel, as it is connected anyway")
-                await self.leave()
+                await self.leave(clear)
             return
         logger.debug("Running cleanup and leave")
         await self._cleanup()
-        await self.leave()
+        if self._vc is not None:
+            await self.leave(clear)
         logger.info("Stopped!")
 
     async def _play(self) -> None:
         """Asynchronously plays audio from the playlist.
-        It continuously retrieves fragments from the playlist and plays them using the voice client.
-        It sets up an event to signal when the audio playback is finished.
-        If there are no more songs in the playlist, it sends a message to the callback channel and then performs cleanup before returning.
+
+        The player is a state machine: LOADING -> PLAYING -> ADVANCING -> LOADING ...
+        The voice client's `after` callback only posts to a queue owned by this task, so discord.py's player thread is never blocked on the event loop.
+        Callbacks of a previous task post into that task's queue and are therefore ignored.
+        When the playlist runs out, the task ends by it self in the IDLE state.
         """
         logger.debug("New play task started")
-        if self._finished_playing is None:
-            self._finished_playing = asyncio.Event()
-        while 1:
-            self._finished_playing.clear()
-            logger.debug("Retrieving fragment")
-            frag_path: str | None = await self._playlist.get()
-            if frag_path is None:
-                try:
+        # Everything this task fetches, and the prefetches it starts, count as this guild's
+        bandwidth.guild.set(self.guild.id)
+        finished: asyncio.Queue = asyncio.Queue()
+        self._fragment_finished = None
+        self._seek_offset = None
+        # The next song's first fragment, partly played by a crossfade, and the path it was opened from
+        handover: Tuple[InstrumentedSource, str] | None = None
+
+        def after(error: Exception | None) -> None:
+            # Runs on the audio player thread, must not wait on anything
+            self.__loop.call_soon_threadsafe(finished.put_nowait, error)
+
+        try:
+            while 1:
+                self._transition(PlayerState.LOADING)
+                logger.debug("Retrieving fragment")
+                frag_path: str | None = await self._playlist.get()
+                if frag_path is None:
                     logger.debug("Fragment is none, returning")
                     return
+                logger.debug("Starting audio playback")
+                self._transition(PlayerState.PLAYING)
+                if self._play_requested is not None:
+                    metrics.TIME_TO_FIRST_AUDIO.observe(
+                        time.perf_counter() - self._play_requested
+                    )
+                    self._play_requested = None
+                if self._fragment_finished is not None:
+                    self.voice_stats.record_gap(
+                        time.perf_counter() - self._fragment_finished
+                    )
+                offset, self._seek_offset = self._seek_offset or 0.0, None
+                head, handover = handover, None
+                if head is not None and head[1] == frag_path and offset == 0:
+                    # The crossfade already played the start of this fragment
+                    self._source = head[0]
+                else:
+                    if head is not None:
+                        head[0].cleanup()
+                    self._source = self._open(
+                        frag_path, self._playlist.get_gain(), offset
+                    )
+                self._source_rate = self.filters.get_rate()
+                self._position_base = self._playlist.get_fragment_start() + offset
+                source: discord.AudioSource = self._source
+                mixer: CrossfadeSource | None = None
+                prepare: asyncio.Task | None = None
+                if (
+                    self.crossfade
+                    and crossfade.is_available()
+                    and self._playlist.is_last_fragment()
+                ):
+                    source = mixer = self._create_crossfade()
+                    prepare = asyncio.create_task(self._prepare_crossfade(mixer))
+                if self.broadcast is not None:
+                    # Encoded once here, for us and every guild listening along
+                    source = BroadcastSource(source, self.broadcast)
+                self._vc.play(source, after=after)
+                logger.debug("Waiting until fragment playback finishes")
+                waiter = asyncio.ensure_future(finished.get())
+                try:
+                    # The downloads ahead start as playback reaches them, so a pause or skip does not fetch early
+                    delay: float | None = MIN_INTERVAL
+                    while not (await asyncio.wait((waiter,), timeout=delay))[0]:
+                        delay = await self._update_prefetch()
+                    error: Exception | None = waiter.result()
                 finally:
-                    logger.debug("Fragment was none, calling cleanup")
-                    await self._cleanup()
-            # await self._announce_current_song() #! Broken asf, announcing by fragment instead of song
-            # TODO: Maybe we can use PCMAudio to read from a buffer instead of a file?
-            logger.debug("Starting audio playback")
-            self._vc.play(
-                discord.FFmpegPCMAudio(frag_path),
-                after=lambda _: asyncio.run_coroutine_threadsafe(
-                    self._next(), self.__loop
-                ).result(),
+                    waiter.cancel()
+                    if prepare is not None:
+                        prepare.cancel()
+                self._fragment_finished = time.perf_counter()
+                if error is not None:
+                    logger.error("Fragment playback failed", exc_info=error)
+                logger.debug("Fragment playback finished!")
+                self._transition(PlayerState.ADVANCING)
+                if mixer is not None:
+                    handover = mixer.take_head()
+                if self._seek_offset is None:
+                    await self._playlist.next()
+        except Exception as e:
+            logger.error(
+                "An exception occoured in the play task, playback will stop!",
+                exc_info=e,
             )
-            logger.debug("Waiting until fragment playback finishes")
-            await self._finished_playing.wait()
-            logger.debug("Fragment playback finished!")
+        finally:
+            if handover is not None:
+                handover[0].cleanup()
+            self._transition(PlayerState.IDLE)
+            if self._play_task is asyncio.current_task():
+                self._play_task = None
 
-    async def _next(self) -> None:
-        """Asynchronously moves the current song to the next item in the playlist and unblocks the audio playback process. (Blocked event-wise)
-
-        This method checks if the current play task has been cancelled. If it has, the method returns immediately as to not interfiere with cleanup.
-        Otherwise, it proceeds to the next item in the playlist and starts playing it.
-        After that, it sets an event to indicate that the playback has finished.
+    async def _update_prefetch(self) -> float | None:
+        """Lets the playlist start the downloads that are due at the playback position
 
         Returns:
-            None
+            float: Seconds until it should run again
+            None: Nothing is left to fetch until the next fragment
         """
+        position = self.get_position()
+        if position is None or self._vc is None or self._vc.is_paused():
+            return MIN_INTERVAL
         try:
-            logger.debug("Moving queue position using _next")
-            if self._play_task.cancelled():
-                return
-            await self._playlist.next()
-            # await self._play() #! This would do recursion, whereas we already have a loop for playing the audio
-            self._finished_playing.set()
+            due = await self._playlist.update_prefetch(position)
         except Exception as e:
-            logger.error(
-                "An exception occoured while executing _next, we will do a cleanup!",
-                exc_info=e,
-            )
-            await self._cleanup()
+            logger.warning("Could not prefetch the upcoming fragments", exc_info=e)
+            return None
+        if due is None:
+            return None
+        # The playlist counts in song time, which filters like nightcore play faster than real time
+        return max(due / self._source_rate, MIN_INTERVAL)
+
+    def _create_crossfade(self) -> CrossfadeSource:
+        """Wraps the source of the current fragment, the last of its song, so the next song fades in over its end"""
+        # Output frames left in the fragment, counted from where the source started like its frame counter
+        remaining = (
+            self._playlist.get_fragment_end() - self._position_base
+        ) / self._source_rate
+        fade_frames = int(self.crossfade / FRAME_LENGTH)
+        fade_start = max(int(remaining / FRAME_LENGTH) - fade_frames, 0)
+        return CrossfadeSource(self._source, fade_start, fade_frames)
+
+    async def _prepare_crossfade(self, mixer: CrossfadeSource) -> None:
+        """Opens the first fragment of the next song shortly before the fade and hands it to the mixer
+
+        Without it in time, the song ends without a crossfade.
+        """
+        try:
+            peeked = await self._playlist.peek()
+        except Exception as e:
+            logger.warning("Could not load the next song for the crossfade", exc_info=e)
+            return
+        if peeked is None:
+            return
+        path, gain = peeked
+        # Opening it early would keep an idle ffmpeg process around for most of the song
+        await asyncio.sleep(max(mixer.get_fade_in() - 1.0, 0.0))
+        mixer.set_head(self._open(path, gain, first=True), path)
+
+    def _open(
+        self, path: str, gain: float, offset: float = 0.0, first: bool | None = None
+    ) -> InstrumentedSource:
+        """Opens a fragment for playback with the current filters, from memory if it is in the hot cache
+
+        Only first fragments (of the current song unless first is given) played from the start use the hot cache,
+        which misses load in the background, so this never waits on the disk. Fragments on an audio node are
+        streamed from it, so they do not use it.
+        """
+        options = self.filters.build(gain)
+        if first is None:
+            first = self._playlist.get_fragment_start() == 0
+        cache = hotcache.get_cache()
+        if (
+            cache.budget
+            and first
+            and offset == 0
+            and not isinstance(self._playlist, RemotePlaylist)
+        ):
+            data = cache.get(path)
+            if data is not None:
+                return InstrumentedSource(
+                    hotcache.MemoryPCMAudio(data, options=options), self.voice_stats
+                )
+            if cache.should_load(path):
+                # Checking the size needs the file, so it happens in the executor with the read
+                self.__loop.run_in_executor(None, cache.load, path)
+        # -ss before -i seeks in the input, so ffmpeg does not decode what it skips
+        before_options = f"-ss {offset:.3f}" if offset > 0 else None
+        return InstrumentedSource(
+            discord.FFmpegPCMAudio(path, before_options=before_options, options=options),
+            self.voice_stats,
+        )
+
+    def _transition(self, state: PlayerState) -> None:
+        now = time.perf_counter()
+        elapsed = now - self._state_since
+        self._transitions.append((self._state, state, elapsed))
+        metrics.PLAYER_STATE.observe(elapsed, self._state.name.lower())
+        logger.debug(
+            "Player %s -> %s after %.3fs", self._state.name, state.name, elapsed
+        )
+        self._state = state
+        self._state_since = now
 
     async def _cleanup(self) -> None:
         """
         Asynchronous function to perform cleanup tasks. No parameters. Returns None.
-        Makes sure the audio player is stopped and then resets to default state.
+        Makes sure the play task has finished and the audio player is stopped.
         """
         logger.debug("Cleanup issued")
-        self._play_task.cancel()
-        if self._vc.is_playing():
+        self.stop_listening()
+        task, self._play_task = self._play_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self._vc is not None and self._vc.is_playing():
             logger.debug("Cleanup found we are playing, stopping")
             self._vc.stop()
-        self._finished_playing.set()
-        self._play_task = None
         logger.debug("Finished cleanup")
@@ -0,0 +1,174 @@
+import itertools
+import logging
+import os
+import uuid
+from typing import Any, Dict, Iterator
+
+from aiohttp import web
+
+from ..config import CACHE_DIR
+from ..models.playlist import LoopMode, Playlist
+from ..models.song import Song
+from . import bandwidth
+
+logger = logging.getLogger("strongest.audionode")
+
+
+def describe_song(song: Song) -> Dict:
+    if not song.is_ready():
+        return {"ready": False}
+    return {
+        "ready": True,
+        "title": song.meta.title,
+        "url": song.meta.url,
+        "channel_name": song.meta.channel_name,
+        "channel_url": song.meta.channel_url,
+        "vid": song.meta.vid,
+        "fragments": len(song.fragments),
+        "bounds": [[fragment.start, fragment.end] for fragment in song.fragments],
+        "gain": song.get_gain(),
+    }
+
+
+def describe_playlist(playlist: Playlist) -> Dict:
+    return {
+        "songs": [describe_song(song) for song in playlist.songs],
+        "current_song": playlist.current_song,
+        "current_fragment": playlist.current_fragment,
+        "loopmode": playlist.loopmode.name,
+    }
+
+
+class AudioNode:
+    """Hosts the Playlist and fragment cache of many guilds for a gateway front-end
+
+    The front-end drives each guild's Playlist over a small JSON RPC (POST /rpc/{op}) and plays the fragments
+    straight from GET /fragments/{vid}/{fid}, so extraction, downloading and the cache live in this process.
+    Every state sent back is stamped with this process' epoch and an increasing sequence number,
+    so the front-end can drop states that arrive after newer ones.
+    """
+
+    playlists: Dict[int, Playlist]
+    epoch: str
+    _sequence: Iterator[int]
+
+    def __init__(self) -> None:
+        self.playlists = dict()
+        self.epoch = uuid.uuid4().hex
+        self._sequence = itertools.count()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes(
+            [
+                web.post("/rpc/{op}", self._rpc),
+                web.get("/fragments/{vid}/{fid}", self._fragment),
+                web.get("/stats", self._stats),
+            ]
+        )
+        return app
+
+    def get_load(self) -> int:
+        """Returns the number of guilds with a queue plus the number of fragments being downloaded"""
+        downloading = 0
+        for playlist in self.playlists.values():
+            for song in playlist.songs:
+                if not song.is_ready():
+                    downloading += 1
+                    continue
+                downloading += sum(
+                    1
+                    for fragment in song.fragments
+                    if fragment._download_thread is not None
+                    and not fragment._download_thread.is_set()
+                )
+        return len(self.playlists) + downloading
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {"guilds": len(self.playlists), "load": self.get_load()}
+        )
+
+    async def _fragment(self, request: web.Request) -> web.StreamResponse:
+        root = os.path.realpath(CACHE_DIR)
+        path = os.path.realpath(
+            os.path.join(root, request.match_info["vid"], request.match_info["fid"])
+        )
+        if os.path.dirname(os.path.dirname(path)) != root or not os.path.isfile(path):
+            raise web.HTTPNotFound()
+        return web.FileResponse(path)
+
+    async def _rpc(self, request: web.Request) -> web.Response:
+        op = request.match_info["op"]
+        body: Dict = await request.json()
+        guild: int = body["guild"]
+        if op == "release":
+            playlist = self.playlists.pop(guild, None)
+            if playlist is not None:
+                await playlist.clear()
+            return web.json_response({"result": None, "state": None})
+        handler = getattr(self, f"_op_{op}", None)
+        if handler is None:
+            raise web.HTTPNotFound()
+        # The bandwidth budget is shared fairly between the front-end's guilds
+        bandwidth.guild.set(guild)
+        playlist = self.playlists.get(guild)
+        if playlist is None:
+            playlist = self.playlists[guild] = Playlist()
+        try:
+            result = await handler(playlist, body)
+        except Exception as e:
+            logger.error("RPC %s failed for guild %d", op, guild, exc_info=e)
+            return web.json_response({"error": repr(e)}, status=500)
+        return web.json_response(
+            {
+                "result": result,
+                "state": describe_playlist(playlist),
+                "epoch": self.epoch,
+                "sequence": next(self._sequence),
+            }
+        )
+
+    async def _op_state(self, playlist: Playlist, body: Dict) -> Any:
+        return None
+
+    async def _op_add(self, playlist: Playlist, body: Dict) -> Any:
+        await playlist.add(body["url"])
+
+    async def _op_get(self, playlist: Playlist, body: Dict) -> Any:
+        path = await playlist.get()
+        if path is None:
+            return None
+        # The front-end only gets the part of the path the fragment route serves
+        return os.path.relpath(path, CACHE_DIR).replace(os.sep, "/")
+
+    async def _op_peek(self, playlist: Playlist, body: Dict) -> Any:
+        result = await playlist.peek()
+        if result is None:
+            return None
+        path, gain = result
+        return [os.path.relpath(path, CACHE_DIR).replace(os.sep, "/"), gain]
+
+    async def _op_next(self, playlist: Playlist, body: Dict) -> Any:
+        await playlist.next()
+
+    async def _op_skip(self, playlist: Playlist, body: Dict) -> Any:
+        await playlist.skip(body.get("played"))
+
+    async def _op_prefetch(self, playlist: Playlist, body: Dict) -> Any:
+        return await playlist.update_prefetch(body["played"])
+
+    async def _op_seek(self, playlist: Playlist, body: Dict) -> Any:
+        return await playlist.seek(body["seconds"])
+
+    async def _op_end_current_song(self, playlist: Playlist, body: Dict) -> Any:
+        await playlist.end_current_song(body.get("played"))
+
+    async def _op_clear(self, playlist: Playlist, body: Dict) -> Any:
+        await playlist.clear(body.get("played"))
+
+    async def _op_remove(self, playlist: Playlist, body: Dict) -> Any:
+        await playlist.remove(body["identifier"])
+
+    async def _op_loop(self, playlist: Playlist, body: Dict) -> Any:
+        await playlist.set_loop_mode(LoopMode[body["mode"]])
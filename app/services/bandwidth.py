@@ -0,0 +1,236 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from ..config import BANDWIDTH_LIMIT, BANDWIDTH_RESERVE
+from . import metrics
+
+logger = logging.getLogger("strongest.bandwidth")
+
+BURST: float = 1.0  # Seconds of the limit the buckets hold, so idle time does not add up to a burst
+MAX_RESERVE: float = 0.9  # Fetches ahead always keep a share, or they would never run
+RATE_WINDOW: float = 10.0  # Seconds the achieved rates are averaged over
+META_BYTES: float = 500e3  # What a metadata fetch is charged, yt-dlp does not report what it downloaded
+AUDIO_BYTES: float = 20e3  # Bytes per second of audio a fragment is charged before downloads were measured
+SMOOTHING: float = 0.2  # Weight of the newest fragment in the bytes per second of audio
+
+# The guild fetches are charged to, set by whoever acts for a guild
+# Tasks and @threaded jobs started from there inherit it
+guild: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "strongest_bandwidth_guild", default=None
+)
+
+_audio_bytes: float = AUDIO_BYTES
+
+
+def estimate_fragment(seconds: float) -> float:
+    """Returns the bytes a fragment of that many seconds of audio is expected to download"""
+    return seconds * _audio_bytes
+
+
+def record_fragment(seconds: float, size: float) -> None:
+    """Adds a downloaded fragment to the bytes per second of audio estimate"""
+    global _audio_bytes
+    if seconds > 0 and size > 0:
+        _audio_bytes += SMOOTHING * (size / seconds - _audio_bytes)
+
+
+class Lease:
+    """A fetch waiting for, or admitted to, the bandwidth budget"""
+
+    guild: int | None
+    cost: float  # Bytes charged on admission, corrected on release
+    urgent: bool  # Needed now, like the fragment that is about to play, rather than fetched ahead
+    granted: bool
+    requested: float
+
+    def __init__(self, guild: int | None, cost: float, urgent: bool) -> None:
+        self.guild = guild
+        self.cost = cost
+        self.urgent = urgent
+        self.granted = False
+        self.requested = time.perf_counter()
+
+
+class BandwidthLimiter:
+    """Process wide token buckets that admit fragment and metadata fetches
+
+    Every fetch is charged its (estimated) bytes when it is admitted, and the difference to what it really
+    downloaded once it is done, so the average stays within the limit. The limit only paces when fetches start,
+    a fetch that was admitted downloads at full speed: fragments are section downloads that yt-dlp hands to ffmpeg,
+    which ignores yt-dlp's ratelimit, so there is no way to cap a single download.
+    Fetches needed now draw from the full rate. Fetches ahead also draw from a second bucket that only refills
+    at the rate minus BOT_BANDWIDTH_RESERVE, so whatever prefetching does, the reserved share is left for
+    the fragments guilds are waiting on.
+    Waiting fetches are admitted needed now first, then round robin across guilds, so one guild queuing a huge
+    playlist only gets its turn like everyone else.
+    Fetches run in their own threads (@threaded), so waiting for admission blocks the thread, not the event loop.
+    """
+
+    rate: float  # Bytes per second, 0 is unlimited
+    reserve: float  # Share of the rate only fetches needed now may use
+    _tokens: float
+    _ahead_tokens: float
+    _updated: float
+    _waiting: Dict[int | None, List[Lease]]
+    _turn: Deque[int | None]  # Guilds with waiting fetches, the next to be admitted first
+    _history: Deque[Tuple[float, float, bool]]  # (finished, bytes, urgent) of recent fetches
+    _cond: threading.Condition
+
+    def __init__(self, rate: float, reserve: float) -> None:
+        self.rate = max(rate, 0.0)
+        self.reserve = min(max(reserve, 0.0), MAX_RESERVE)
+        self._tokens = self.rate * BURST
+        self._ahead_tokens = self._get_ahead_rate() * BURST
+        self._updated = time.perf_counter()
+        self._waiting = dict()
+        self._turn = deque()
+        self._history = deque()
+        self._cond = threading.Condition()
+
+    def _get_ahead_rate(self) -> float:
+        return self.rate * (1 - self.reserve)
+
+    def request(self, cost: float, urgent: bool) -> Lease:
+        """Queues a fetch of the guild set in `guild`, wait() blocks until it is admitted"""
+        lease = Lease(guild.get(), cost, urgent)
+        if not self.rate:
+            lease.granted = True
+            return lease
+        with self._cond:
+            if lease.guild not in self._waiting:
+                self._waiting[lease.guild] = []
+                self._turn.append(lease.guild)
+            self._waiting[lease.guild].append(lease)
+            self._grant()
+        return lease
+
+    def wait(self, lease: Lease) -> None:
+        """Blocks the calling thread until the fetch is admitted"""
+        with self._cond:
+            while not lease.granted:
+                self._cond.wait(self._get_delay())
+                self._grant()
+
+    def promote(self, lease: Lease) -> None:
+        """Turns a fetch ahead into one needed now, for a prefetch that playback caught up with"""
+        with self._cond:
+            if lease.urgent or lease.granted:
+                return
+            lease.urgent = True
+            self._grant()
+
+    def release(self, lease: Lease, size: float | None = None) -> None:
+        """Ends a fetch, size is what it really downloaded, None keeps the estimate"""
+        size = lease.cost if size is None else size
+        with self._cond:
+            if not lease.granted:
+                # Given up while waiting, it downloaded nothing
+                self._remove(lease)
+                self._cond.notify_all()
+                return
+            if self.rate:
+                self._tokens -= size - lease.cost
+                if not lease.urgent:
+                    self._ahead_tokens -= size - lease.cost
+            self._history.append((time.perf_counter(), size, lease.urgent))
+        metrics.BANDWIDTH_BYTES.inc("now" if lease.urgent else "ahead", amount=size)
+
+    def get_rates(self) -> Dict[str, float]:
+        """Returns the achieved bytes per second over the last RATE_WINDOW seconds, of fetches needed now and ahead"""
+        rates = {"now": 0.0, "ahead": 0.0}
+        with self._cond:
+            cutoff = time.perf_counter() - RATE_WINDOW
+            while self._history and self._history[0][0] < cutoff:
+                self._history.popleft()
+            for _, size, urgent in self._history:
+                rates["now" if urgent else "ahead"] += size / RATE_WINDOW
+        return rates
+
+    def get_waiting(self) -> int:
+        with self._cond:
+            return sum(len(leases) for leases in self._waiting.values())
+
+    def describe(self) -> str:
+        rates = self.get_rates()
+        limit = (
+            f"`{self.rate * 8 / 1e6:g}Mbit/s` ({self.reserve:.0%} reserved)"
+            if self.rate
+            else "`unlimited`"
+        )
+        return "{}, now `{:.1f}Mbit/s`, ahead `{:.1f}Mbit/s`, `{}` waiting".format(
+            limit, rates["now"] * 8 / 1e6, rates["ahead"] * 8 / 1e6, self.get_waiting()
+        )
+
+    def _refill(self) -> None:
+        now = time.perf_counter()
+        elapsed, self._updated = now - self._updated, now
+        self._tokens = min(self._tokens + elapsed * self.rate, self.rate * BURST)
+        ahead_rate = self._get_ahead_rate()
+        self._ahead_tokens = min(self._ahead_tokens + elapsed * ahead_rate, ahead_rate * BURST)
+
+    def _get_delay(self) -> float:
+        """Returns how long until the buckets may admit the next fetch"""
+        delay = max(-self._tokens / self.rate, -self._ahead_tokens / self._get_ahead_rate(), 0.0)
+        return min(max(delay, 0.005), 1.0)
+
+    def _pick(self) -> Lease | None:
+        """Returns the next fetch to admit, needed now first, then round robin across guilds"""
+        for urgent in (True, False):
+            for key in self._turn:
+                for lease in self._waiting[key]:
+                    if lease.urgent == urgent:
+                        return lease
+        return None
+
+    def _grant(self) -> None:
+        self._refill()
+        granted = False
+        while self._tokens > 0:
+            lease = self._pick()
+            if lease is None or (not lease.urgent and self._ahead_tokens <= 0):
+                break
+            self._remove(lease)
+            if lease.guild in self._waiting:
+                # Goes to the back of the line
+                self._turn.remove(lease.guild)
+                self._turn.append(lease.guild)
+            self._tokens -= lease.cost
+            if not lease.urgent:
+                self._ahead_tokens -= lease.cost
+            lease.granted = granted = True
+            metrics.BANDWIDTH_WAIT.observe(
+                time.perf_counter() - lease.requested, "now" if lease.urgent else "ahead"
+            )
+        if granted:
+            self._cond.notify_all()
+
+    def _remove(self, lease: Lease) -> None:
+        leases = self._waiting.get(lease.guild)
+        if leases is None or lease not in leases:
+            return
+        leases.remove(lease)
+        if not leases:
+            del self._waiting[lease.guild]
+            self._turn.remove(lease.guild)
+
+
+_limiter: BandwidthLimiter | None = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> BandwidthLimiter:
+    """Returns the process wide limiter, configured by BOT_BANDWIDTH_LIMIT and BOT_BANDWIDTH_RESERVE"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = BandwidthLimiter(BANDWIDTH_LIMIT * 1e6 / 8, BANDWIDTH_RESERVE)
+            metrics.BANDWIDTH_LIMIT.set(_limiter.rate, "total")
+            metrics.BANDWIDTH_LIMIT.set(_limiter._get_ahead_rate(), "ahead")
+            metrics.BANDWIDTH_RATE.set_callback(
+                lambda: {(key,): rate for key, rate in _limiter.get_rates().items()}
+            )
+    return _limiter
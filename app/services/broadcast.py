@@ -0,0 +1,190 @@
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, Set
+
+import discord
+
+from .voicestats import VoiceStats
+
+logger = logging.getLogger("strongest.broadcast")
+
+BUFFER: int = 50  # Packets (one second) a listener may fall behind before it skips ahead
+IDLE_WAIT: float = 0.5  # Seconds a listener waits for the host before sending silence
+SLACK: int = 2  # Packets a listener that can not wait starts behind live, so it rarely catches up with the host
+# An opus frame of silence, what discord.py sends it self when a player stops
+SILENCE: bytes = b"\xf8\xff\xfe"
+
+_broadcasts: Dict[int, "Broadcast"] = dict()
+
+
+class Broadcast:
+    """The opus stream of a host guild, which other guilds listen along to
+
+    The host's player decodes and encodes every frame once (BroadcastSource), and every listener sends the
+    same packets (ListenerSource), so the CPU cost grows with the number of broadcasts, not listeners.
+    Packets are published by the host's player thread and read by the listeners' player threads,
+    which block until the host produces the next one, so listeners are paced by the host.
+    """
+
+    host_id: int
+    listeners: Set[int]
+    closed: bool
+    _encoder: discord.opus.Encoder | None
+    _packets: Deque[bytes]
+    _seq: int  # Sequence number of the next packet
+    _cond: threading.Condition
+
+    def __init__(self, host_id: int) -> None:
+        self.host_id = host_id
+        self.listeners = set()
+        self.closed = False
+        self._encoder = None
+        self._packets = deque(maxlen=BUFFER)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def encode(self, pcm: bytes) -> bytes:
+        """Encodes a frame for every listener, with one encoder that lives as long as the broadcast"""
+        if self._encoder is None:
+            self._encoder = discord.opus.Encoder()
+        return self._encoder.encode(pcm, self._encoder.SAMPLES_PER_FRAME)
+
+    def publish(self, packet: bytes) -> None:
+        with self._cond:
+            if self.closed:
+                return
+            self._packets.append(packet)
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get_live(self) -> int:
+        """Returns the sequence number of the next packet, where new listeners start"""
+        with self._cond:
+            return self._seq
+
+    def next_packet(self, listener: "ListenerSource") -> bytes:
+        """Returns the listener's next packet and moves its cursor, waiting for the host to produce it
+
+        Returns:
+            bytes: The packet, silence while the host is not playing, or empty once the broadcast or listener is closed
+        """
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self.closed or listener.closed or self._seq > listener.cursor,
+                timeout=listener.wait,
+            ):
+                listener.record_silence()
+                return SILENCE
+            if self.closed or listener.closed:
+                return b""
+            oldest = self._seq - len(self._packets)
+            if listener.cursor < oldest:
+                # Fell behind by more than the buffer, continue live
+                listener.cursor = oldest
+            packet = self._packets[listener.cursor - oldest]
+            listener.cursor += 1
+            return packet
+
+    def wake(self) -> None:
+        """Wakes the listeners waiting for a packet, so closed ones return"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        """Ends the broadcast, listeners finish playing as if their song ended"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        if _broadcasts.get(self.host_id) is self:
+            del _broadcasts[self.host_id]
+        logger.info("Broadcast of %d closed", self.host_id)
+
+
+class BroadcastSource(discord.AudioSource):
+    """Encodes the host's PCM once and publishes every packet to the broadcast, the host plays the same packets"""
+
+    source: discord.AudioSource
+    broadcast: Broadcast
+
+    def __init__(self, source: discord.AudioSource, broadcast: Broadcast) -> None:
+        self.source = source
+        self.broadcast = broadcast
+
+    def read(self) -> bytes:
+        data = self.source.read()
+        if not data:
+            return b""
+        packet = self.broadcast.encode(data)
+        self.broadcast.publish(packet)
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        self.source.cleanup()
+
+
+class ListenerSource(discord.AudioSource):
+    """Plays a broadcast in a listening guild, starting live"""
+
+    broadcast: Broadcast
+    guild_id: int
+    cursor: int  # Sequence number of the next packet to send
+    closed: bool
+    wait: float  # Seconds a read waits for the host, 0 when the player must never block
+    stats: VoiceStats | None  # Of the listening guild
+
+    def __init__(
+        self,
+        broadcast: Broadcast,
+        guild_id: int,
+        wait: float = IDLE_WAIT,
+        stats: VoiceStats | None = None,
+    ) -> None:
+        self.broadcast = broadcast
+        self.guild_id = guild_id
+        self.cursor = broadcast.get_live()
+        if not wait:
+            self.cursor = max(self.cursor - SLACK, 0)
+        self.closed = False
+        self.wait = wait
+        self.stats = stats
+        broadcast.listeners.add(guild_id)
+
+    def read(self) -> bytes:
+        packet = self.broadcast.next_packet(self)
+        if packet and self.stats is not None:
+            self.stats.frames += 1
+        return packet
+
+    def record_silence(self) -> None:
+        """Counts a packet of silence sent in place of the host's, which did not arrive in time"""
+        if self.stats is not None:
+            self.stats.silent_frames += 1
+
+    def is_opus(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        """Ends playback, the player it self can not interrupt a read that waits for the host"""
+        self.closed = True
+        self.broadcast.wake()
+
+    def cleanup(self) -> None:
+        self.closed = True
+        self.broadcast.listeners.discard(self.guild_id)
+
+
+def open_broadcast(host_id: int) -> Broadcast:
+    """Returns the broadcast of a host guild, starting it if needed"""
+    broadcast = _broadcasts.get(host_id)
+    if broadcast is None:
+        broadcast = _broadcasts[host_id] = Broadcast(host_id)
+        logger.info("Broadcast of %d opened", host_id)
+    return broadcast
+
+
+def get_broadcast(host_id: int) -> Broadcast | None:
+    return _broadcasts.get(host_id)
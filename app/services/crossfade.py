@@ -0,0 +1,131 @@
+import threading
+from typing import Tuple
+
+import discord
+
+from .voicestats import FRAME_LENGTH, InstrumentedSource
+
+try:
+    import numpy
+except ImportError:  # Crossfading is optional, it is disabled without numpy
+    numpy = None
+
+MAX_CROSSFADE: float = 12.0  # Seconds
+SAMPLES_PER_FRAME: int = discord.opus.Encoder.SAMPLES_PER_FRAME  # Per channel
+
+
+def is_available() -> bool:
+    """Returns whether crossfading can be used, it needs numpy"""
+    return numpy is not None
+
+
+class CrossfadeSource(discord.AudioSource):
+    """Plays the last fragment of a song and blends the first fragment of the next song into its tail
+
+    Every frame of the fade is mixed with equal power gain ramps, computed by numpy over the whole 20ms frame.
+    The source ends as soon as the fade is done (or the tail runs out), and the head is handed over to the
+    play task, which plays the rest of it as the next fragment, so nothing is decoded twice.
+    The head is opened by the event loop while the player thread reads, so handing it around is locked.
+    Only the tail counts into VoiceStats during the fade, every mixed frame is one frame sent.
+    """
+
+    tail: InstrumentedSource
+    fade_start: int  # The frame of the tail the fade starts at
+    fade_frames: int
+    completed: bool  # Ended by it self, not stopped
+    _head: InstrumentedSource | None
+    _head_path: str | None
+    _mixed: int
+    _closed: bool
+    _lock: threading.Lock
+
+    def __init__(self, tail: InstrumentedSource, fade_start: int, fade_frames: int) -> None:
+        self.tail = tail
+        self.fade_start = fade_start
+        self.fade_frames = max(fade_frames, 1)
+        self.completed = False
+        self._head = None
+        self._head_path = None
+        self._mixed = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def get_fade_in(self) -> float:
+        """Returns the seconds until the fade starts"""
+        return max(self.fade_start - self.tail.frames, 0) * FRAME_LENGTH
+
+    def set_head(self, head: InstrumentedSource, path: str) -> None:
+        """Hands the mixer the start of the next song, called from the event loop"""
+        with self._lock:
+            if not self._closed:
+                head.counted = False
+                self._head = head
+                self._head_path = path
+                return
+        # Stopped before the head was ready
+        head.cleanup()
+
+    def take_head(self) -> Tuple[InstrumentedSource, str] | None:
+        """Returns the partly played head if the fade happened
+
+        Returns:
+            Tuple[InstrumentedSource, str]: The head, now owned by the caller, and the path it was opened from
+            None: There is nothing to continue, the next fragment has to be opened from the start
+        """
+        with self._lock:
+            head, self._head = self._head, None
+        if head is None:
+            return None
+        if self.completed and self._mixed:
+            # Played on its own from here
+            head.counted = True
+            return head, self._head_path
+        # The fade was interrupted
+        head.cleanup()
+        return None
+
+    def read(self) -> bytes:
+        if self.completed:
+            return b""
+        data = self.tail.read()
+        if not data:
+            self.completed = True
+            return b""
+        head = self._head
+        if head is None or self.tail.frames < self.fade_start:
+            return data
+        other = head.read()
+        if not other:
+            # The next song is shorter than the fade
+            return data
+        mixed = self._mix(data, other)
+        self._mixed += 1
+        if self._mixed >= self.fade_frames:
+            self.completed = True
+        return mixed
+
+    def _mix(self, tail: bytes, head: bytes) -> bytes:
+        ramp = numpy.arange(
+            self._mixed * SAMPLES_PER_FRAME, (self._mixed + 1) * SAMPLES_PER_FRAME
+        ) * (numpy.pi / 2 / (self.fade_frames * SAMPLES_PER_FRAME))
+        fade_out = numpy.cos(ramp)[:, None]
+        fade_in = numpy.sin(ramp)[:, None]
+        # Stereo s16le, one row per sample, so the gains apply to both channels at once
+        mixed = (
+            numpy.frombuffer(tail, numpy.int16).reshape(-1, 2) * fade_out
+            + numpy.frombuffer(head, numpy.int16).reshape(-1, 2) * fade_in
+        )
+        return numpy.clip(mixed, -32768, 32767).astype(numpy.int16).tobytes()
+
+    def cleanup(self) -> None:
+        with self._lock:
+            self._closed = True
+            head = self._head
+            if self.completed and self._mixed:
+                # Kept for take_head()
+                head = None
+            else:
+                self._head = None
+        if head is not None:
+            head.cleanup()
+        self.tail.cleanup()
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from types import FrameType
+
+from . import metrics
+
+logger = logging.getLogger("strongest.diagnostics")
+
+
+class LoopWatchdog:
+    """Watches the event loop from a separate thread
+
+    Every interval it schedules a callback on the loop and waits for it to run.
+    The wait is the event loop lag, reported as the strongest_event_loop_lag_seconds metric.
+    If the callback has not run after threshold seconds, the stack the loop thread is stuck in is logged.
+    """
+
+    interval: float
+    threshold: float
+    _loop: asyncio.AbstractEventLoop
+    _loop_thread: int
+    _thread: threading.Thread
+    _stopped: threading.Event
+
+    def __init__(self, interval: float, threshold: float) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        # Must be created on the loop's thread
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="strongest-loop-watchdog", daemon=True
+        )
+
+    def start(self) -> None:
+        logger.info(
+            "Watching the event loop every %.2fs, threshold %.2fs",
+            self.interval,
+            self.threshold,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            seen = threading.Event()
+            sent = time.perf_counter()
+            try:
+                self._loop.call_soon_threadsafe(seen.set)
+            except RuntimeError:
+                # The loop is closed
+                return
+            if not seen.wait(self.threshold):
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = "".join(traceback.format_stack(frame)) if frame else "unknown"
+                logger.warning(
+                    "Event loop is blocked for more than %.2fs, it is running:\n%s",
+                    self.threshold,
+                    stack,
+                )
+                seen.wait()
+                logger.warning(
+                    "Event loop was blocked for %.2fs", time.perf_counter() - sent
+                )
+            metrics.LOOP_LAG.set(time.perf_counter() - sent)
+
+
+def _fold(frame: FrameType) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> str:
+    """Samples the stacks of every thread for a while
+
+    This blocks for the given time, so it should be run in a thread of its own.
+
+    Returns:
+        str: The samples in the folded format (`thread;outer;...;inner count` per line),
+             which flamegraph.pl, speedscope and inferno take as is
+    """
+    me = threading.get_ident()
+    samples: Counter = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            samples[f"{names.get(ident, ident)};{_fold(frame)}"] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common()) + "\n"
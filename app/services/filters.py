@@ -0,0 +1,85 @@
+from typing import Dict, List
+
+# asetrate raises pitch and tempo together, which is what nightcore is
+NIGHTCORE_RATE: float = 1.25
+MIN_SPEED: float = 0.5  # The range of a single atempo filter
+MAX_SPEED: float = 2.0
+MAX_VOLUME: float = 2.0
+MAX_BASS: float = 20.0  # dB
+
+
+class AudioFilters:
+    """A guild's audio filters, applied by ffmpeg while it decodes a fragment
+
+    They become part of the ffmpeg filter graph (-af), so there is no per-frame work in Python,
+    unlike discord.PCMVolumeTransformer.
+    """
+
+    volume: float  # 1.0 leaves the volume as is
+    bass: float  # Gain of the low shelf in dB, 0 disables it
+    speed: float  # Tempo without changing the pitch
+    nightcore: bool
+
+    def __init__(
+        self,
+        volume: float = 1.0,
+        bass: float = 0.0,
+        speed: float = 1.0,
+        nightcore: bool = False,
+    ) -> None:
+        self.volume = min(max(volume, 0.0), MAX_VOLUME)
+        self.bass = min(max(bass, -MAX_BASS), MAX_BASS)
+        self.speed = min(max(speed, MIN_SPEED), MAX_SPEED)
+        self.nightcore = nightcore
+
+    def replace(self, **changes) -> "AudioFilters":
+        """Returns a copy with some of the filters changed"""
+        return AudioFilters(**dict(self.to_dict(), **changes))
+
+    def get_rate(self) -> float:
+        """Returns how many seconds of the song one second of output covers"""
+        return self.speed * (NIGHTCORE_RATE if self.nightcore else 1.0)
+
+    def build(self, gain: float = 0.0) -> str | None:
+        """Returns the ffmpeg output options for these filters
+
+        Args:
+            gain (float): Loudness normalization gain in dB, merged into the volume filter
+
+        Returns:
+            str: The -af option
+            None: No filter is enabled
+        """
+        chain: List[str] = []
+        if self.bass:
+            chain.append(f"bass=g={self.bass:g}:f=110:w=0.6")
+        if self.nightcore:
+            chain.append(
+                f"aresample=48000,asetrate={48000 * NIGHTCORE_RATE:g},aresample=48000"
+            )
+        if self.speed != 1.0:
+            chain.append(f"atempo={self.speed:g}")
+        volume = self.volume * 10 ** (gain / 20)
+        if volume != 1.0:
+            chain.append(f"volume={volume:.4g}")
+        if not chain:
+            return None
+        return f'-af "{",".join(chain)}"'
+
+    def describe(self) -> str:
+        return (
+            f"Volume `{self.volume * 100:.0f}%`, bass `{self.bass:+g}dB`, "
+            + f"speed `{self.speed:g}x`, nightcore `{'on' if self.nightcore else 'off'}`"
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "volume": self.volume,
+            "bass": self.bass,
+            "speed": self.speed,
+            "nightcore": self.nightcore,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "AudioFilters":
+        return cls(**data)
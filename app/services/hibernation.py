@@ -0,0 +1,80 @@
+import json
+import logging
+import time
+import zlib
+from typing import Dict
+
+import discord
+from discord.ext import commands
+
+from .audiocontroller import AudioController
+
+logger = logging.getLogger("strongest.hibernation")
+
+REAP_INTERVAL: int = 30  # Seconds
+
+
+class Hibernator:
+    """Drops idle AudioControllers and keeps their queues as compressed snapshots
+
+    A hibernated guild only costs the bytes of its snapshot. Guilds without a queue are dropped entirely.
+    The next command in the guild rehydrates its controller from the snapshot.
+    """
+
+    timeout: float
+    hibernated: Dict[int, bytes]
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self.hibernated = dict()
+
+    async def reap(self, controllers: Dict[int, AudioController]) -> int:
+        """Hibernates every controller that has been idle for longer than the timeout
+
+        Returns:
+            int: The number of controllers that were hibernated
+        """
+        now = time.monotonic()
+        reaped = 0
+        for guild_id, controller in list(controllers.items()):
+            if controller.idle_for(now) < self.timeout:
+                continue
+            try:
+                state = await controller.hibernate()
+            except Exception as e:
+                logger.error("Failed to hibernate the controller of %d", guild_id, exc_info=e)
+                continue
+            # A command may have rehydrated a new controller while we were leaving
+            if controllers.get(guild_id) is controller:
+                del controllers[guild_id]
+            if state is not None:
+                self.store(guild_id, state)
+            reaped += 1
+        if reaped:
+            logger.info(
+                "Hibernated %d idle controllers, %d active and %d hibernated remain",
+                reaped,
+                len(controllers),
+                len(self.hibernated),
+            )
+        return reaped
+
+    def store(self, guild_id: int, state: Dict) -> None:
+        """Keeps a snapshot to rehydrate the guild's controller from"""
+        self.hibernated[guild_id] = zlib.compress(json.dumps(state).encode())
+
+    def snapshots(self) -> Dict[int, Dict]:
+        """Returns the snapshots of every hibernated guild"""
+        return {
+            guild_id: json.loads(zlib.decompress(data))
+            for guild_id, data in self.hibernated.items()
+        }
+
+    def rehydrate(self, bot: commands.Bot, guild: discord.Guild) -> AudioController:
+        """Creates the controller of a guild, with the queue it had when it was hibernated"""
+        controller = AudioController(bot, guild)
+        data = self.hibernated.pop(guild.id, None)
+        if data is not None:
+            logger.info("Rehydrating the controller of %s (%d)", guild.name, guild.id)
+            controller.restore(json.loads(zlib.decompress(data)))
+        return controller
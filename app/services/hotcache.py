@@ -0,0 +1,153 @@
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Set
+
+import discord
+
+from ..config import HOT_CACHE_SIZE
+from . import metrics
+
+logger = logging.getLogger("strongest.hotcache")
+
+MIN_PLAYS: int = 2  # Plays before a fragment may push others out, one-off songs only fill free space
+TRACKED_PLAYS: int = 10000  # Fragments whose recent plays are counted
+
+
+class MemoryPCMAudio(discord.FFmpegPCMAudio):
+    """FFmpegPCMAudio that decodes a fragment held in memory, written to ffmpeg's stdin by discord.py's pipe writer"""
+
+    def __init__(self, data: bytes, **kwargs: Any) -> None:
+        super().__init__(io.BytesIO(data), pipe=True, **kwargs)
+
+    def cleanup(self) -> None:
+        process = getattr(self, "_process", None)
+        if process:
+            # Reaped here, as discord.py would flush the stdin the pipe writer already closed and fail
+            process.kill()
+            process.wait()
+        super().cleanup()
+
+
+class HotCache:
+    """Keeps the first fragments of recently and frequently played songs in memory
+
+    Fragment files are read once and then played from memory, so replaying a popular song neither touches
+    the (possibly networked) cache volume nor waits for it. Entries are evicted least recently played first
+    to stay within the byte budget. A fragment only pushes others out once it was played MIN_PLAYS times,
+    so a burst of songs that are played once does not flush the popular ones.
+    get() and should_load() run on the bot's event loop and only look at memory, load() runs in executor threads
+    and does everything that touches the file, so the entries are locked.
+    """
+
+    budget: int  # Bytes, 0 disables the cache
+    used: int
+    hits: int
+    misses: int
+    _entries: OrderedDict[str, bytes]  # Least recently played first
+    _plays: OrderedDict[str, int]
+    _loading: Set[str]
+    _lock: threading.Lock
+
+    def __init__(self, budget: int) -> None:
+        self.budget = max(budget, 0)
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._plays = OrderedDict()
+        self._loading = set()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> bytes | None:
+        """Returns the fragment file's content if it is in memory, and counts the play
+
+        Returns:
+            bytes: The file's content
+            None: The fragment is not in memory, see should_load()
+        """
+        with self._lock:
+            self._plays[path] = self._plays.get(path, 0) + 1
+            self._plays.move_to_end(path)
+            if len(self._plays) > TRACKED_PLAYS:
+                self._plays.popitem(last=False)
+            data = self._entries.get(path)
+            if data is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(path)
+                self.hits += 1
+        metrics.HOT_CACHE_REQUESTS.inc("miss" if data is None else "hit")
+        return data
+
+    def should_load(self, path: str) -> bool:
+        """Returns whether a fragment that missed should be passed to load(), and marks it as loading if it is
+
+        Whether it is worth loading depends on its size, which load() checks once it has the file open.
+        """
+        with self._lock:
+            if path in self._entries or path in self._loading:
+                return False
+            self._loading.add(path)
+            return True
+
+    def _is_worth(self, path: str, size: int) -> bool:
+        if size > self.budget:
+            return False
+        return self.used + size <= self.budget or self._plays.get(path, 0) >= MIN_PLAYS
+
+    def load(self, path: str) -> None:
+        """Reads a fragment file into memory if it is worth it, evicting the least recently played entries, blocks on the file"""
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                with self._lock:
+                    worth = self._is_worth(path, size)
+                data = f.read() if worth else None
+        except OSError as e:
+            logger.warning("Could not load %s into memory", path, exc_info=e)
+            data = None
+        with self._lock:
+            self._loading.discard(path)
+            if data is None:
+                return
+            while self._entries and self.used + len(data) > self.budget:
+                _, evicted = self._entries.popitem(last=False)
+                self.used -= len(evicted)
+            self._entries[path] = data
+            self.used += len(data)
+
+    def get_hit_rate(self) -> float | None:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else None
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"used": self.used, "budget": self.budget, "entries": len(self._entries)}
+
+    def describe(self) -> str:
+        if not self.budget:
+            return "`disabled`"
+        hit_rate = self.get_hit_rate()
+        return "`{:.1f}`/`{:g}MB` in `{}` fragments, hit rate `{}`".format(
+            self.used / 1e6,
+            self.budget / 1e6,
+            len(self._entries),
+            f"{hit_rate:.0%}" if hit_rate is not None else "-",
+        )
+
+
+_cache: HotCache | None = None
+
+
+def get_cache() -> HotCache:
+    """Returns the process wide cache, sized by BOT_HOT_CACHE_SIZE"""
+    global _cache
+    if _cache is None:
+        _cache = HotCache(int(HOT_CACHE_SIZE * 1e6))
+        metrics.HOT_CACHE_BYTES.set_callback(
+            lambda: {(key,): value for key, value in _cache.get_stats().items()}
+        )
+    return _cache
@@ -0,0 +1,95 @@
+import logging
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Set
+
+from ..config import LOUDNESS_TARGET
+
+logger = logging.getLogger("strongest.loudness")
+
+MAX_GAIN: float = 12.0  # dB, quiet songs are not boosted into clipping
+MIN_GAIN: float = -24.0
+SILENCE: float = -70.0  # LUFS, the absolute gate of EBU R128, there is nothing to normalize below it
+
+# The integrated loudness from the summary ebur128 logs when it is done
+_INTEGRATED = re.compile(r"I:\s+(-?[\d.]+|-inf) LUFS")
+
+_analyser: ThreadPoolExecutor | None = None
+_pending: Set[str] = set()  # Files queued for analyse_later(), so a file is decoded once however often it is played
+_pending_lock = threading.Lock()
+
+
+def analyse(filepath: str) -> float | None:
+    """Measures the integrated loudness of a fragment file
+
+    Decodes the whole fragment with ffmpeg's ebur128 filter, so callers store the result with the song's metadata.
+
+    Returns:
+        float: The integrated loudness in LUFS
+        None: The file could not be analysed
+    """
+    try:
+        result = subprocess.run(
+            [
+                "ffmpeg",
+                "-hide_banner",
+                "-nostats",
+                "-i", filepath,
+                "-af", "ebur128=framelog=quiet",
+                "-f", "null",
+                "-",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=120,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning("Could not analyse the loudness of %s", filepath, exc_info=e)
+        return None
+    matches = _INTEGRATED.findall(result.stderr)
+    if result.returncode != 0 or not matches:
+        logger.warning(
+            "Could not analyse the loudness of %s, ffmpeg exited with %d",
+            filepath,
+            result.returncode,
+        )
+        return None
+    return max(float(matches[-1]), SILENCE)
+
+
+def analyse_later(filepath: str, done: Callable[[float | None], None]) -> None:
+    """Analyses a fragment file in a background thread and passes the loudness to done
+
+    Runs after the download, outside of the fragment's file lock, so neither playback nor other processes
+    wait for the decode. Files are analysed one at a time, so analyses do not compete with downloads for the CPU.
+    """
+    global _analyser
+    with _pending_lock:
+        if filepath in _pending:
+            return
+        _pending.add(filepath)
+        if _analyser is None:
+            _analyser = ThreadPoolExecutor(1, thread_name_prefix="loudness")
+
+    def run() -> None:
+        try:
+            lufs = analyse(filepath)
+        finally:
+            with _pending_lock:
+                _pending.discard(filepath)
+        done(lufs)
+
+    _analyser.submit(run)
+
+
+def get_gain(lufs: float | None) -> float:
+    """Returns the gain in dB that brings a song of the given loudness to the target
+
+    Returns:
+        float: The gain, 0 when normalization is disabled or the loudness is unknown
+    """
+    if not LOUDNESS_TARGET or lufs is None or lufs <= SILENCE:
+        return 0.0
+    return min(max(LOUDNESS_TARGET - lufs, MIN_GAIN), MAX_GAIN)
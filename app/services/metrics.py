@@ -0,0 +1,362 @@
+import logging
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, Sequence, Tuple
+
+from ..config import METRICS_HOST, METRICS_PORT
+
+# Imported by the models, which also run in worker processes, so discord.py and aiohttp are only imported by the server
+if TYPE_CHECKING:
+    from discord.ext import commands
+
+logger = logging.getLogger("strongest.metrics")
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    """Base of the metric types, rendered in the prometheus text format
+
+    Updating a metric only touches a dict under a lock, all the formatting happens when /metrics is scraped.
+    """
+
+    type: str = "untyped"
+    name: str
+    help: str
+    labels: Sequence[str]
+    _lock: threading.Lock
+    _values: Dict[LabelValues, float]
+    _callback: Callable[[], Dict[LabelValues, float]] | None
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = dict()
+        self._callback = None
+        REGISTRY.append(self)
+
+    def set_callback(self, callback: Callable[[], Dict[LabelValues, float]]) -> None:
+        """Reads the values from callback on every scrape instead of from inc/set"""
+        self._callback = callback
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        if self._callback is not None:
+            return [("", values, value) for values, value in self._callback().items()]
+        with self._lock:
+            return [("", values, value) for values, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, values, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{self._format_labels(values)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+    def _format_labels(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [
+            f'{label}="{_escape(value)}"' for label, value in zip(self.labels, values)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *values: str) -> None:
+        with self._lock:
+            self._values[values] = value
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def dec(self, *values: str, amount: float = 1) -> None:
+        self.inc(*values, amount=-amount)
+
+
+class Histogram(Metric):
+    type = "histogram"
+    buckets: Sequence[float]
+    _counts: Dict[LabelValues, List[int]]
+    _sums: Dict[LabelValues, float]
+    # Histograms keep their own series, _values is unused.
+    # A callback returns the bucket counts (not cumulative, the last is +Inf) and the sum of each series instead.
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        buckets: Sequence[float],
+        labels: Sequence[str] = (),
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = sorted(buckets)
+        self._counts = dict()
+        self._sums = dict()
+
+    def observe(self, value: float, *values: str) -> None:
+        with self._lock:
+            counts = self._counts.get(values)
+            if counts is None:
+                counts = self._counts[values] = [0] * (len(self.buckets) + 1)
+                self._sums[values] = 0.0
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[values] += value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        if self._callback is not None:
+            series = [
+                (values, list(counts), total)
+                for values, (counts, total) in self._callback().items()
+            ]
+        else:
+            with self._lock:
+                series = [
+                    (values, list(counts), self._sums[values])
+                    for values, counts in self._counts.items()
+                ]
+        for values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, float("inf")], counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{self._format_labels(values, le)} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{self._format_labels(values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(values)} {cumulative}")
+        return "\n".join(lines)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY: List[Metric] = []
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (64e3, 256e3, 1e6, 2e6, 4e6, 8e6, 16e6, 64e6)
+
+TIME_TO_FIRST_AUDIO = Histogram(
+    "strongest_time_to_first_audio_seconds",
+    "Time from a play request on an idle player to the first fragment playing",
+    SECONDS_BUCKETS,
+)
+PLAYER_STATE = Histogram(
+    "strongest_player_state_seconds",
+    "Time the audio player spent in a state before moving on",
+    SECONDS_BUCKETS,
+    ["state"],
+)
+PLAYLIST_ADVANCES = Counter(
+    "strongest_playlist_advances_total",
+    "Playlist pointer moves, to the next fragment or the next song",
+    ["kind"],
+)
+FRAGMENT_DOWNLOAD_SECONDS = Histogram(
+    "strongest_fragment_download_seconds",
+    "Duration of fragment downloads",
+    SECONDS_BUCKETS,
+)
+FRAGMENT_DOWNLOAD_BYTES = Histogram(
+    "strongest_fragment_download_bytes",
+    "Size of downloaded fragments",
+    BYTES_BUCKETS,
+)
+FRAGMENT_CACHE = Counter(
+    "strongest_fragment_cache_requests_total",
+    "Fragment cache lookups by download jobs",
+    ["result"],
+)
+META_CACHE = Counter(
+    "strongest_meta_cache_requests_total",
+    "Metadata cache lookups",
+    ["result"],
+)
+JOBS_IN_FLIGHT = Gauge(
+    "strongest_jobs_in_flight",
+    "Extraction and download jobs currently running",
+    ["kind"],
+)
+QUEUE_LENGTH = Gauge(
+    "strongest_queue_length",
+    "Songs left in the queue of a guild, including the current one",
+    ["guild"],
+)
+VOICE_SESSIONS = Gauge("strongest_voice_sessions", "Connected voice clients")
+CONTROLLERS = Gauge(
+    "strongest_controllers",
+    "Guild audio controllers in memory (active) or stored as a snapshot (hibernated)",
+    ["state"],
+)
+VOICE_FRAMES = Counter(
+    "strongest_voice_frames_total",
+    "Audio frames read for a guild's voice client, by what happened to them",
+    ["guild", "kind"],
+)
+BROADCAST_LISTENERS = Gauge(
+    "strongest_broadcast_listeners",
+    "Guilds listening along to the broadcast of a host guild",
+    ["guild"],
+)
+FRAME_READ = Histogram(
+    "strongest_voice_frame_read_seconds",
+    "Time to read one 20ms frame from the audio source, over the guilds in memory",
+    (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05),
+)
+FRAGMENT_GAP = Histogram(
+    "strongest_fragment_gap_seconds",
+    "Time between a fragment ending and the next one starting to play",
+    SECONDS_BUCKETS,
+)
+BANDWIDTH_LIMIT = Gauge(
+    "strongest_bandwidth_limit_bytes",
+    "Configured bytes per second of fetches, in total and for fetches ahead, 0 is unlimited. Only paces when fetches start, single downloads are not capped",
+    ["share"],
+)
+BANDWIDTH_RATE = Gauge(
+    "strongest_bandwidth_rate_bytes",
+    "Bytes per second of fetches needed now and fetched ahead, by when they finished, over the last 10 seconds",
+    ["priority"],
+)
+BANDWIDTH_BYTES = Counter(
+    "strongest_bandwidth_bytes_total",
+    "Bytes fetched, needed now or fetched ahead",
+    ["priority"],
+)
+BANDWIDTH_WAIT = Histogram(
+    "strongest_bandwidth_wait_seconds",
+    "Time fetches waited for the bandwidth budget",
+    SECONDS_BUCKETS,
+    ["priority"],
+)
+HOT_CACHE_REQUESTS = Counter(
+    "strongest_hot_cache_requests_total",
+    "First fragments played from memory (hit) or from disk (miss)",
+    ["result"],
+)
+HOT_CACHE_BYTES = Gauge(
+    "strongest_hot_cache_bytes",
+    "Memory used by and budget of the in-memory fragment tier, and the fragments in it",
+    ["kind"],
+)
+LOOP_LAG = Gauge(
+    "strongest_event_loop_lag_seconds",
+    "How long the last watchdog probe waited for the event loop",
+)
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def track_bot(bot: "commands.Bot") -> None:
+    """Reads the per guild queue lengths and the voice sessions from the bot on every scrape"""
+
+    def queue_lengths() -> Dict[LabelValues, float]:
+        cog = bot.get_cog("Default")
+        if cog is None:
+            return {}
+        return {
+            (str(guild_id),): max(
+                len(controller._playlist.songs) - controller._playlist.current_song, 0
+            )
+            for guild_id, controller in cog.controllers.items()
+        }
+
+    def voice_frames() -> Dict[LabelValues, float]:
+        cog = bot.get_cog("Default")
+        if cog is None:
+            return {}
+        samples = {}
+        for guild_id, controller in cog.controllers.items():
+            stats = controller.voice_stats
+            guild = str(guild_id)
+            samples[(guild, "read")] = stats.frames
+            samples[(guild, "late")] = stats.late_frames
+            samples[(guild, "missed")] = stats.missed_frames
+            samples[(guild, "silent")] = stats.silent_frames
+        return samples
+
+    def frame_reads() -> Dict[LabelValues, Tuple[List[int], float]]:
+        cog = bot.get_cog("Default")
+        if cog is None:
+            return {}
+        counts = [0] * (len(FRAME_READ.buckets) + 1)
+        total = 0.0
+        for controller in cog.controllers.values():
+            stats = controller.voice_stats
+            for i, count in enumerate(stats.read_buckets):
+                counts[i] += count
+            total += stats.read_seconds
+        return {(): (counts, total)}
+
+    def controllers() -> Dict[LabelValues, float]:
+        cog = bot.get_cog("Default")
+        if cog is None:
+            return {}
+        return {
+            ("active",): len(cog.controllers),
+            ("hibernated",): len(cog.hibernator.hibernated),
+        }
+
+    def broadcast_listeners() -> Dict[LabelValues, float]:
+        cog = bot.get_cog("Default")
+        if cog is None:
+            return {}
+        return {
+            (str(guild_id),): len(controller.broadcast.listeners)
+            for guild_id, controller in cog.controllers.items()
+            if controller.broadcast is not None
+        }
+
+    QUEUE_LENGTH.set_callback(queue_lengths)
+    BROADCAST_LISTENERS.set_callback(broadcast_listeners)
+    CONTROLLERS.set_callback(controllers)
+    VOICE_FRAMES.set_callback(voice_frames)
+    FRAME_READ.set_callback(frame_reads)
+    VOICE_SESSIONS.set_callback(lambda: {(): len(bot.voice_clients)})
+
+
+async def start_metrics_server(bot: "commands.Bot") -> None:
+    """Serves /metrics on BOT_METRICS_HOST:BOT_METRICS_PORT, does nothing if the port is 0"""
+    if METRICS_PORT <= 0:
+        return
+    from aiohttp import web
+
+    async def handle(request: "web.Request") -> "web.Response":
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    track_bot(bot)
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info("Serving metrics on http://%s:%d/metrics", METRICS_HOST, METRICS_PORT)
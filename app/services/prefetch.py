@@ -0,0 +1,88 @@
+import logging
+from collections import deque
+from typing import Deque
+
+from ..config import PREFETCH_HOLD, PREFETCH_LOOKAHEAD
+
+logger = logging.getLogger("strongest.prefetch")
+
+SAFETY: float = 2.0  # Fetches start this many expected download times before their audio is needed
+FALLBACK_LEAD: float = 20.0  # Seconds of lead a held back fetch keeps while no download was measured yet
+SMOOTHING: float = 0.2  # Weight of the newest sample in the moving averages
+SKIP_RATE: float = 0.3  # Share of songs a guild skips from which speculative fetches are held back
+SKIP_POSITIONS: int = 20  # Recent skips the hold is derived from
+MIN_INTERVAL: float = 1.0  # Seconds the player waits at least between two prefetch walks
+
+# Seconds of audio downloaded per second, measured over every guild as they share the link
+_throughput: float | None = None
+
+
+def record_download(audio_seconds: float, seconds: float) -> None:
+    """Adds a finished download to the throughput average"""
+    global _throughput
+    if audio_seconds <= 0 or seconds <= 0:
+        return
+    sample = audio_seconds / seconds
+    if _throughput is None:
+        _throughput = sample
+    else:
+        _throughput += SMOOTHING * (sample - _throughput)
+
+
+def get_throughput() -> float | None:
+    """Returns the seconds of audio downloaded per second or None if nothing was downloaded yet"""
+    return _throughput
+
+
+def get_lead(audio_seconds: float) -> float:
+    """Returns how many seconds before its audio is needed a fetch of that length has to start"""
+    if _throughput is None:
+        return FALLBACK_LEAD
+    return SAFETY * audio_seconds / _throughput
+
+
+class PrefetchPolicy:
+    """Decides how far ahead of playback a guild's playlist downloads fragments
+
+    Fragments are fetched once the audio before them is shorter than BOT_PREFETCH_LOOKAHEAD, or earlier
+    if the measured throughput says their download would not finish in time otherwise.
+    A guild that skips many songs gets its speculative fetches, the ones only needed if the song is not skipped,
+    held back until the song has played about as long as the guild's skips usually take.
+    """
+
+    skip_rate: float  # Moving average of the share of songs skipped
+    _skips: Deque[float]  # Seconds into the song of the most recent skips
+
+    def __init__(self) -> None:
+        self.skip_rate = 0.0
+        self._skips = deque(maxlen=SKIP_POSITIONS)
+
+    def record_song(self, skipped: bool, played: float | None = None) -> None:
+        """Records a song that ended, played is where it was skipped at"""
+        self.skip_rate += SMOOTHING * (float(skipped) - self.skip_rate)
+        if skipped and played is not None:
+            self._skips.append(played)
+
+    def get_lookahead(self, audio_seconds: float) -> float:
+        """Returns the seconds of audio before a fragment of that length at which it is fetched"""
+        return max(PREFETCH_LOOKAHEAD, get_lead(audio_seconds))
+
+    def get_hold(self) -> float:
+        """Returns how far into a song speculative fetches wait, 0 when the guild rarely skips
+
+        Returns:
+            float: Seconds, the point by which 90% of the guild's recent skips happened, at most BOT_PREFETCH_HOLD
+        """
+        if self.skip_rate < SKIP_RATE or not self._skips:
+            return 0.0
+        skips = sorted(self._skips)
+        return min(skips[min(int(len(skips) * 0.9), len(skips) - 1)], PREFETCH_HOLD)
+
+    def describe(self) -> str:
+        throughput = get_throughput()
+        return "lookahead `{:g}s`, downloads `{}`, skip rate `{:.0%}`, hold `{:g}s`".format(
+            PREFETCH_LOOKAHEAD,
+            f"{throughput:.0f}x realtime" if throughput is not None else "not measured",
+            self.skip_rate,
+            self.get_hold(),
+        )
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+
+import aiohttp
+
+from ..config import AUDIO_NODES
+from ..models.playlist import LoopMode
+
+logger = logging.getLogger("strongest.remoteplaylist")
+
+
+class RemoteMeta:
+    url: str
+    vid: str
+    title: str
+    channel_name: str
+    channel_url: str
+
+    def __init__(self, data: Dict) -> None:
+        self.url = data["url"]
+        self.vid = data["vid"]
+        self.title = data["title"]
+        self.channel_name = data["channel_name"]
+        self.channel_url = data["channel_url"]
+
+
+class RemoteSong:
+    """Read only view of a Song living on an audio node"""
+
+    meta: RemoteMeta | None
+    fragments: List[int]
+    bounds: List[Tuple[int, int]]
+    gain: float
+    _ready: bool
+
+    def __init__(self, data: Dict) -> None:
+        self._ready = data["ready"]
+        self.meta = RemoteMeta(data) if self._ready else None
+        if self._ready:
+            # Only the fragment ids and times, the fragments them selves live on the node
+            self.fragments = list(range(data["fragments"]))
+            self.bounds = [(start, end) for start, end in data.get("bounds", [])]
+            self.gain = data.get("gain", 0.0)
+
+    def is_ready(self) -> bool:
+        return self._ready
+
+
+class NodePool:
+    """The audio nodes the front-end can hand guilds to"""
+
+    urls: List[str]
+    _session: aiohttp.ClientSession | None
+
+    def __init__(self, urls: List[str]) -> None:
+        self.urls = [url.rstrip("/") for url in urls]
+        self._session = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            # Fragment requests wait for the download, so there is no total timeout
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=5)
+            )
+        return self._session
+
+    async def pick(self) -> str:
+        """Returns the url of the least loaded node that responds
+
+        Raises:
+            RuntimeError: No node responded
+        """
+
+        async def load(url: str) -> int | None:
+            try:
+                async with self.get_session().get(
+                    f"{url}/stats", timeout=aiohttp.ClientTimeout(total=5)
+                ) as response:
+                    return (await response.json())["load"]
+            except (aiohttp.ClientError, asyncio.TimeoutError, KeyError) as e:
+                logger.warning("Audio node %s is not responding", url, exc_info=e)
+                return None
+
+        loads = await asyncio.gather(*[load(url) for url in self.urls])
+        candidates = [(l, url) for l, url in zip(loads, self.urls) if l is not None]
+        if not candidates:
+            raise RuntimeError("No audio node is available")
+        node = min(candidates)[1]
+        logger.info("Picked audio node %s (loads: %s)", node, loads)
+        return node
+
+
+class RemotePlaylist:
+    """Drop-in replacement for Playlist that drives a guild's playlist on an audio node
+
+    The node is picked by load on the first call. Every response carries the node's playlist state,
+    which is mirrored locally so the synchronous getters keep working.
+    Calls that move the pointers or change the queue are sent one after another in the order they were made,
+    so the node applies them in that order. The rest (get, peek, add, prefetch, state) can wait on downloads
+    and run alongside, so the node stamps every state with a sequence number and older states are dropped.
+    """
+
+    songs: List[RemoteSong]
+    loopmode: LoopMode
+    current_song: int
+    current_fragment: int
+    guild_id: int
+    _pool: NodePool
+    _node: str | None
+    _node_lock: asyncio.Lock
+    _order_lock: asyncio.Lock  # Held while an ordered call is sent, waiters get it first come first served
+    _sequence: Tuple[str, int] | None  # (node epoch, sequence) of the mirrored state
+
+    def __init__(self, pool: NodePool, guild_id: int) -> None:
+        logger.info("New remote playlist initialized for %d", guild_id)
+        self.songs = []
+        self.loopmode = LoopMode.OFF
+        self.current_song = 0
+        self.current_fragment = 0
+        self.guild_id = guild_id
+        self._pool = pool
+        self._node = None
+        self._node_lock = asyncio.Lock()
+        self._order_lock = asyncio.Lock()
+        self._sequence = None
+
+    async def _call(self, op: str, **kwargs: Any) -> Any:
+        """Sends an RPC after every ordered one made before it, and returns its result"""
+        async with self._order_lock:
+            return await self._send(op, kwargs)
+
+    async def _send(self, op: str, kwargs: Dict) -> Any:
+        async with self._node_lock:
+            if self._node is None:
+                self._node = await self._pool.pick()
+        async with self._pool.get_session().post(
+            f"{self._node}/rpc/{op}", json={"guild": self.guild_id, **kwargs}
+        ) as response:
+            data = await response.json()
+        if response.status != 200:
+            raise RuntimeError(f"Audio node {self._node} failed {op}: {data.get('error')}")
+        if data["state"] is not None:
+            sequence = (data["epoch"], data["sequence"])
+            # A restarted node counts from 0 again under a new epoch, so only states of the same epoch are compared
+            if (
+                self._sequence is None
+                or sequence[0] != self._sequence[0]
+                or sequence[1] > self._sequence[1]
+            ):
+                self._sequence = sequence
+                self._mirror(data["state"])
+        return data["result"]
+
+    def _mirror(self, state: Dict) -> None:
+        self.songs = [RemoteSong(song) for song in state["songs"]]
+        self.current_song = state["current_song"]
+        self.current_fragment = state["current_fragment"]
+        self.loopmode = LoopMode[state["loopmode"]]
+
+    async def get(self) -> str | None:
+        """Returns the url of the fragment on the node or None if there is no song"""
+        path = await self._send("get", {})
+        if path is None:
+            return None
+        return f"{self._node}/fragments/{path}"
+
+    async def next(self) -> None:
+        await self._call("next")
+
+    async def add(self, url: str) -> None:
+        # Loading a list can take a while, which must not hold up skips
+        await self._send("add", {"url": url})
+
+    async def remove(self, identifier: int | str) -> None:
+        await self._call("remove", identifier=identifier)
+
+    async def refresh(self) -> None:
+        await self._send("state", {})
+
+    async def seek(self, seconds: float) -> float:
+        try:
+            return await self._call("seek", seconds=seconds)
+        except RuntimeError as e:
+            # The node's ValueError only arrives as its repr
+            raise ValueError("Could not seek to that time") from e
+
+    def get_fragment_start(self) -> int:
+        try:
+            return self.songs[self.current_song].bounds[self.current_fragment][0]
+        except (IndexError, AttributeError):
+            return 0
+
+    def get_fragment_end(self) -> int:
+        try:
+            return self.songs[self.current_song].bounds[self.current_fragment][1]
+        except (IndexError, AttributeError):
+            return 0
+
+    def is_last_fragment(self) -> bool:
+        try:
+            return self.current_fragment == len(self.songs[self.current_song].fragments) - 1
+        except (IndexError, AttributeError):
+            return False
+
+    async def peek(self) -> Tuple[str, float] | None:
+        """Returns the url of the next song's first fragment on the node and its gain, or None"""
+        result = await self._send("peek", {})
+        if result is None:
+            return None
+        path, gain = result
+        return f"{self._node}/fragments/{path}", gain
+
+    async def update_prefetch(self, played: float) -> float | None:
+        # Only starts downloads on the node, so it does not wait for the calls that move the pointers
+        return await self._send("prefetch", {"played": played})
+
+    def get_gain(self) -> float:
+        try:
+            return self.songs[self.current_song].gain
+        except (IndexError, AttributeError):
+            return 0.0
+
+    async def release(self) -> None:
+        """Drops this guild's playlist on the node"""
+        if self._node is not None:
+            await self._call("release")
+        self.songs = []
+        self.current_song = 0
+        self.current_fragment = 0
+
+    def snapshot(self) -> Dict:
+        # The queue it self stays on the node until release() is called, so the node is all we need
+        return {"node": self._node}
+
+    def restore(self, state: Dict) -> None:
+        if "node" not in state:
+            logger.warning("Not restoring a snapshot of a local playlist")
+            return
+        self._node = state["node"]
+
+    async def skip(self, played: float | None = None) -> None:
+        await self._call("skip", played=played)
+
+    async def end_current_song(self, played: float | None = None) -> None:
+        await self._call("end_current_song", played=played)
+
+    async def clear(self, played: float | None = None) -> None:
+        await self._call("clear", played=played)
+
+    def get_loop_mode(self) -> str:
+        return self.loopmode.name
+
+    async def set_loop_mode(self, loop_mode: LoopMode) -> None:
+        await self._call("loop", mode=loop_mode.name)
+
+    async def cycle_loop_mode(self) -> LoopMode:
+        if self.loopmode == LoopMode.OFF:
+            await self.set_loop_mode(LoopMode.CURRENT)
+        elif self.loopmode == LoopMode.CURRENT:
+            await self.set_loop_mode(LoopMode.ALL)
+        else:
+            await self.set_loop_mode(LoopMode.OFF)
+        return self.get_loop_mode()
+
+
+_node_pool: NodePool | None = None
+
+
+def get_node_pool() -> NodePool | None:
+    """Returns the process wide audio node pool
+
+    Returns:
+        NodePool: The pool
+        None: No audio nodes are configured (BOT_AUDIO_NODES), playlists are local
+    """
+    global _node_pool
+    if not AUDIO_NODES:
+        return None
+    if _node_pool is None:
+        _node_pool = NodePool(AUDIO_NODES)
+    return _node_pool
@@ -0,0 +1,317 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, List
+
+import discord
+from discord.opus import Encoder
+from discord.player import AudioSource
+from discord.enums import SpeakingState
+
+from ..config import VOICE_SENDERS
+
+logger = logging.getLogger("strongest.sender")
+
+DELAY: float = Encoder.FRAME_LENGTH / 1000.0
+RESOLUTION: float = 0.001  # Seconds per slot of the timer wheel
+WHEEL_SLOTS: int = 64  # Covers three frames ahead, players are never scheduled further out
+PRIMERS: int = 4  # Threads that read the first frame of new sources
+
+_schedulers: List["SendScheduler"] = []
+_primer: ThreadPoolExecutor | None = None
+_warned: bool = False  # Whether the fallback to discord.py's own players was logged
+
+
+class SendScheduler(threading.Thread):
+    """Sends the frames of many voice players from a single thread
+
+    Players sit in a timer wheel of 1ms slots. Every slot that comes due is emptied, each of its players
+    reads and sends one frame and is put back into the slot of its next frame. The thread sleeps until the
+    next slot with players in it, so it wakes about as often as there are distinct send times, not 50 times
+    per second for every guild like discord.py's thread per AudioPlayer does.
+    Everything a player does runs on this thread, so a source that blocks delays every player of the scheduler.
+    """
+
+    players: int
+    _slots: List[List["MultiplexedPlayer"]]
+    _incoming: Deque["MultiplexedPlayer"]
+    _wake: threading.Event
+    _origin: float
+    _tick: int  # The next slot to process
+
+    def __init__(self, name: str = "voice-sender") -> None:
+        super().__init__(daemon=True, name=name)
+        self.players = 0
+        self._slots = [[] for _ in range(WHEEL_SLOTS)]
+        self._incoming = deque()
+        self._wake = threading.Event()
+        self._origin = time.perf_counter()
+        self._tick = 0
+
+    def add(self, player: "MultiplexedPlayer") -> None:
+        """Sends the player's first frame at the next slot, callable from any thread"""
+        self._incoming.append(player)
+        self._wake.set()
+
+    def _schedule(self, player: "MultiplexedPlayer", deadline: float) -> None:
+        slot = int((deadline - self._origin) / RESOLUTION)
+        slot = min(max(slot, self._tick), self._tick + WHEEL_SLOTS - 1)
+        self._slots[slot % WHEEL_SLOTS].append(player)
+
+    def _next_busy(self) -> int | None:
+        for tick in range(self._tick, self._tick + WHEEL_SLOTS):
+            if self._slots[tick % WHEEL_SLOTS]:
+                return tick
+        return None
+
+    def run(self) -> None:
+        while True:
+            now = time.perf_counter()
+            while self._incoming:
+                self.players += 1
+                self._schedule(self._incoming.popleft(), now)
+            current = int((now - self._origin) / RESOLUTION)
+            while self._tick <= current:
+                index = self._tick % WHEEL_SLOTS
+                due, self._slots[index] = self._slots[index], []
+                self._tick += 1
+                for player in due:
+                    try:
+                        deadline = player.tick()
+                    except Exception as e:
+                        # Never lets one player take the others down
+                        logger.exception("Voice sender dropped a player", exc_info=e)
+                        deadline = None
+                    if deadline is None:
+                        self.players -= 1
+                    else:
+                        self._schedule(player, deadline)
+            busy = self._next_busy()
+            if busy is None:
+                # Nothing is playing, sleep until a player is added
+                self._wake.wait()
+                self._wake.clear()
+                self._tick = int((time.perf_counter() - self._origin) / RESOLUTION)
+                continue
+            timeout = self._origin + busy * RESOLUTION - time.perf_counter()
+            if timeout > 0 and self._wake.wait(timeout):
+                self._wake.clear()
+
+
+class MultiplexedPlayer:
+    """Drop-in for discord.player.AudioPlayer that is driven by a SendScheduler instead of its own thread
+
+    Follows AudioPlayer's pacing, pause, reconnect and speaking behaviour, so VoiceClient's stop(), pause(),
+    resume() and source work on it unchanged. This relies on the voice internals of discord.py 2.3
+    (VoiceClient._connected, ws.speak and _player), see has_voice_internals().
+    The first frame is read by a primer thread before the player joins the scheduler,
+    so ffmpeg starting up does not stall the other guilds.
+    """
+
+    source: AudioSource
+    client: discord.VoiceClient
+    after: Callable[[Exception | None], Any] | None
+    scheduler: SendScheduler
+    loops: int
+    _start: float | None
+    _primed: bytes | None
+    _end: threading.Event
+    _resumed: threading.Event
+    _connected: threading.Event
+    _current_error: Exception | None
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        source: AudioSource,
+        client: discord.VoiceClient,
+        scheduler: SendScheduler,
+        *,
+        after: Callable[[Exception | None], Any] | None = None,
+    ) -> None:
+        self.source = source
+        self.client = client
+        self.after = after
+        self.scheduler = scheduler
+        self.loops = 0
+        self._start = None
+        self._primed = None
+        self._end = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()  # We are not paused
+        self._connected = client._connected
+        self._current_error = None
+        self._lock = threading.Lock()
+
+        if after is not None and not callable(after):
+            raise TypeError('Expected a callable for the "after" parameter.')
+
+    def start(self) -> None:
+        global _primer
+        if _primer is None:
+            _primer = ThreadPoolExecutor(PRIMERS, thread_name_prefix="voice-primer")
+        _primer.submit(self._prime)
+
+    def _prime(self) -> None:
+        try:
+            self._primed = self.source.read()
+        except Exception as e:
+            self._current_error = e
+            self._primed = b""
+        self._speak(SpeakingState.voice)
+        self.scheduler.add(self)
+
+    def tick(self) -> float | None:
+        """Sends the next frame, called by the scheduler
+
+        Returns:
+            float: When the frame after it is due
+            None: The player is done and has been cleaned up
+        """
+        if self._end.is_set():
+            self._finish()
+            return None
+        now = time.perf_counter()
+        if not self._resumed.is_set():
+            # Paused, checked again every frame
+            return now + DELAY
+        if not self._connected.is_set():
+            # Restarts the pacing once we are connected again
+            self._start = None
+            return now + DELAY
+        if self._start is None:
+            self.loops = 0
+            self._start = now
+        self.loops += 1
+        try:
+            with self._lock:
+                if self._primed is not None:
+                    data, self._primed = self._primed, None
+                else:
+                    data = self.source.read()
+                if not data:
+                    self.stop()
+                    self._finish()
+                    return None
+                self.client.send_audio_packet(data, encode=not self.source.is_opus())
+        except Exception as e:
+            self._current_error = e
+            self.stop()
+            self._finish()
+            return None
+        return self._start + DELAY * self.loops
+
+    def _finish(self) -> None:
+        error = self._current_error
+        if self.after is not None:
+            try:
+                self.after(error)
+            except Exception as e:
+                e.__context__ = error
+                logger.exception("Calling the after function failed.", exc_info=e)
+        elif error:
+            logger.exception("Exception in voice sender", exc_info=error)
+        try:
+            self.source.cleanup()
+        except Exception as e:
+            logger.exception("Cleaning up the audio source failed", exc_info=e)
+
+    def stop(self) -> None:
+        self._end.set()
+        self._resumed.set()
+        self._speak(SpeakingState.none)
+
+    def pause(self, *, update_speaking: bool = True) -> None:
+        self._resumed.clear()
+        if update_speaking:
+            self._speak(SpeakingState.none)
+
+    def resume(self, *, update_speaking: bool = True) -> None:
+        self.loops = 0
+        self._start = None
+        self._resumed.set()
+        if update_speaking:
+            self._speak(SpeakingState.voice)
+
+    def is_playing(self) -> bool:
+        return self._resumed.is_set() and not self._end.is_set()
+
+    def is_paused(self) -> bool:
+        return not self._end.is_set() and not self._resumed.is_set()
+
+    def _set_source(self, source: AudioSource) -> None:
+        with self._lock:
+            self.pause(update_speaking=False)
+            self.source = source
+            self.resume(update_speaking=False)
+
+    def _speak(self, speaking: SpeakingState) -> None:
+        try:
+            asyncio.run_coroutine_threadsafe(
+                self.client.ws.speak(speaking), self.client.client.loop
+            )
+        except Exception:
+            logger.exception("Speaking call in voice sender failed")
+
+
+def has_voice_internals(client: discord.VoiceClient) -> bool:
+    """Returns whether the client has the discord.py 2.3 internals MultiplexedPlayer drives
+
+    discord.py 2.4 rewrote the voice client, and these attributes went away or changed with it.
+    """
+    return (
+        isinstance(getattr(client, "_connected", None), threading.Event)
+        and callable(getattr(getattr(client, "ws", None), "speak", None))
+        and hasattr(client, "_player")
+    )
+
+
+def get_scheduler(key: int) -> SendScheduler:
+    """Returns the scheduler for a guild, guilds are spread over BOT_VOICE_SENDERS threads"""
+    if not _schedulers:
+        for i in range(max(VOICE_SENDERS, 1)):
+            scheduler = SendScheduler(f"voice-sender-{i}")
+            scheduler.start()
+            _schedulers.append(scheduler)
+    return _schedulers[key % len(_schedulers)]
+
+
+class MultiplexedVoiceClient(discord.VoiceClient):
+    """A VoiceClient whose players share the SendScheduler threads instead of starting a thread each
+
+    Plays with discord.py's own thread per player on versions without the internals it needs.
+    """
+
+    def play(
+        self,
+        source: AudioSource,
+        *,
+        after: Callable[[Exception | None], Any] | None = None,
+    ) -> None:
+        global _warned
+        if not has_voice_internals(self):
+            if not _warned:
+                _warned = True
+                logger.warning(
+                    "discord.py %s has no voice internals the shared senders can drive, using a thread per player",
+                    discord.__version__,
+                )
+            super().play(source, after=after)
+            return
+        if not self.is_connected():
+            raise discord.ClientException("Not connected to voice.")
+        if self.is_playing():
+            raise discord.ClientException("Already playing audio.")
+        if not isinstance(source, AudioSource):
+            raise TypeError(
+                f"source must be an AudioSource not {source.__class__.__name__}"
+            )
+        if not self.encoder and not source.is_opus():
+            self.encoder = Encoder()
+        self._player = MultiplexedPlayer(
+            source, self, get_scheduler(self.guild.id), after=after
+        )
+        self._player.start()
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Dict
+
+from ..config import CACHE_DIR
+
+if TYPE_CHECKING:
+    from ..modules.default import Default
+
+logger = logging.getLogger("strongest.snapshots")
+
+SNAPSHOT_DIR: str = f"{CACHE_DIR}/snapshots"
+
+
+def _encode(state: Dict) -> bytes:
+    return json.dumps(state, separators=(",", ":")).encode()
+
+
+class SnapshotStore:
+    """Keeps one json file per guild with the snapshot of its queue
+
+    Files are only written when the snapshot changed, and only files this process wrote or claimed are ever deleted,
+    so cluster processes sharing the cache directory leave each other's guilds alone.
+    """
+
+    directory: str
+    _written: Dict[int, bytes]
+
+    def __init__(self, directory: str = SNAPSHOT_DIR) -> None:
+        self.directory = directory
+        self._written = dict()
+
+    def _get_path(self, guild_id: int) -> str:
+        return f"{self.directory}/{guild_id}.json"
+
+    def load_all(self) -> Dict[int, Dict]:
+        """Reads every snapshot in the directory
+
+        Returns:
+            Dict[int, Dict]: Guild id to snapshot
+        """
+        states = dict()
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return states
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(f"{self.directory}/{name}", "rb") as f:
+                    states[int(name[:-5])] = json.loads(f.read())
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping unreadable snapshot %s", name, exc_info=e)
+        logger.info("Loaded %d queue snapshots", len(states))
+        return states
+
+    def claim(self, guild_id: int, state: Dict) -> None:
+        """Marks a loaded snapshot as ours, so it is replaced or deleted by the next save_all()"""
+        self._written[guild_id] = _encode(state)
+
+    def save_all(self, states: Dict[int, Dict]) -> int:
+        """Writes the snapshots that changed and deletes ours that are gone
+
+        Returns:
+            int: The number of files written or deleted
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        changed = 0
+        for guild_id, state in states.items():
+            data = _encode(state)
+            if self._written.get(guild_id) == data:
+                continue
+            path = self._get_path(guild_id)
+            # Written to a temporary file first, so a crash never leaves a half written snapshot
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            self._written[guild_id] = data
+            changed += 1
+        for guild_id in [guild_id for guild_id in self._written if guild_id not in states]:
+            try:
+                os.remove(self._get_path(guild_id))
+            except FileNotFoundError:
+                pass
+            del self._written[guild_id]
+            changed += 1
+        if changed:
+            logger.debug("Updated %d queue snapshots", changed)
+        return changed
+
+
+def collect(cog: "Default") -> Dict[int, Dict]:
+    """Returns the snapshot of every guild with a queue, active or hibernated"""
+    states = cog.hibernator.snapshots()
+    for guild_id, controller in cog.controllers.items():
+        if controller.has_queue():
+            states[guild_id] = controller.snapshot()
+        else:
+            states.pop(guild_id, None)
+    return states
+
+
+async def resume(cog: "Default", store: SnapshotStore) -> None:
+    """Resumes the guilds of this process from their snapshots
+
+    Guilds that were in a voice channel rejoin it and play on, the others are kept hibernated until they are used.
+    Snapshots of guilds this process does not have (other shards or clusters) are left alone.
+    """
+    states = await asyncio.to_thread(store.load_all)
+    resumed = 0
+    for guild_id, state in states.items():
+        guild = cog.bot.get_guild(guild_id)
+        if guild is None:
+            continue
+        store.claim(guild_id, state)
+        if state.get("channel") is None:
+            cog.hibernator.store(guild_id, state)
+            continue
+        try:
+            controller = cog._get_controller(guild)
+            if await controller.resume(state):
+                resumed += 1
+        except Exception as e:
+            logger.error("Failed to resume %s (%d)", guild.name, guild_id, exc_info=e)
+    logger.info("Resumed playback in %d guilds", resumed)
@@ -0,0 +1,105 @@
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Deque, List
+
+import discord
+
+from . import metrics
+
+FRAME_LENGTH: float = discord.opus.Encoder.FRAME_LENGTH / 1000  # 20ms
+# A read this much later than the previous one missed its 20ms slot
+LATE_THRESHOLD: float = FRAME_LENGTH * 1.5
+# Longer gaps are pauses (or the player waiting for us), not jitter
+PAUSE_THRESHOLD: float = 1.0
+GAP_HISTORY: int = 16
+
+
+class VoiceStats:
+    """Per guild counters of the audio send path
+
+    Written by discord.py's player thread on every frame, so these are plain attributes
+    and the metrics layer reads them on scrape. The frame read times are counted into the buckets
+    of metrics.FRAME_READ here, so the send path never takes the metric's lock.
+    """
+
+    frames: int  # Frames read from a source, the empty read that ends it is not one
+    late_frames: int
+    missed_frames: int
+    silent_frames: int  # Silence sent in place of audio that was not there in time, see ListenerSource
+    read_seconds: float
+    max_read_seconds: float
+    read_buckets: List[int]  # Frames per bucket of metrics.FRAME_READ, the last is +Inf
+    fragment_gaps: Deque[float]
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self.late_frames = 0
+        self.missed_frames = 0
+        self.silent_frames = 0
+        self.read_seconds = 0.0
+        self.max_read_seconds = 0.0
+        self.read_buckets = [0] * (len(metrics.FRAME_READ.buckets) + 1)
+        self.fragment_gaps = deque(maxlen=GAP_HISTORY)
+
+    def record_gap(self, seconds: float) -> None:
+        """Records the time between a fragment ending and the next one starting"""
+        self.fragment_gaps.append(seconds)
+        metrics.FRAGMENT_GAP.observe(seconds)
+
+    def describe(self) -> str:
+        average = self.read_seconds / self.frames if self.frames else 0
+        gaps = ", ".join(f"{gap * 1000:.0f}" for gap in self.fragment_gaps) or "none"
+        return (
+            f"Frames: `{self.frames}` (late `{self.late_frames}`, missed `{self.missed_frames}`, silent `{self.silent_frames}`)\n"
+            + f"- Frame read: avg `{average * 1000:.2f}ms`, max `{self.max_read_seconds * 1000:.2f}ms`\n"
+            + f"- Fragment gaps (ms): {gaps}"
+        )
+
+
+class InstrumentedSource(discord.AudioSource):
+    """Wraps an audio source and records how smoothly its frames are read into VoiceStats"""
+
+    frames: int
+    counted: bool  # Whether reads count into VoiceStats, off while a mixer reads it besides the source it sends
+    _source: discord.AudioSource
+    _stats: VoiceStats
+    _last_read: float | None
+
+    def __init__(self, source: discord.AudioSource, stats: VoiceStats) -> None:
+        self.frames = 0
+        self.counted = True
+        self._source = source
+        self._stats = stats
+        self._last_read = None
+
+    def read(self) -> bytes:
+        stats = self._stats
+        started = time.perf_counter()
+        data = self._source.read()
+        elapsed = time.perf_counter() - started
+        last_read, self._last_read = self._last_read, started
+        if not data:
+            # The end of the stream, not a frame
+            return data
+        if not self.counted:
+            self.frames += 1
+            return data
+        if last_read is not None:
+            gap = started - last_read
+            if LATE_THRESHOLD < gap < PAUSE_THRESHOLD:
+                stats.late_frames += 1
+                stats.missed_frames += int(gap / FRAME_LENGTH) - 1
+        self.frames += 1
+        stats.frames += 1
+        stats.read_seconds += elapsed
+        if elapsed > stats.max_read_seconds:
+            stats.max_read_seconds = elapsed
+        stats.read_buckets[bisect_left(metrics.FRAME_READ.buckets, elapsed)] += 1
+        return data
+
+    def is_opus(self) -> bool:
+        return self._source.is_opus()
+
+    def cleanup(self) -> None:
+        self._source.cleanup()
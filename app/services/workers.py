@@ -0,0 +1,234 @@
+import asyncio
+import atexit
+import concurrent.futures
+import logging
+import multiprocessing
+import signal
+import threading
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Deque, List, Tuple
+
+from ..config import WORKER_PROCESSES
+
+logger = logging.getLogger("strongest.workers")
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised for a job whose worker process died while running it"""
+
+
+def _worker_main(conn: Connection) -> None:
+    # Ctrl+C is handled by the bot process, which shuts us down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while 1:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        func, args = job
+        try:
+            result = (True, func(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception:
+            # Not every extractor exception survives pickling
+            conn.send((False, RuntimeError(repr(result[1]))))
+
+
+class _Worker:
+    process: multiprocessing.Process
+    conn: Connection
+    job: Tuple[concurrent.futures.Future, Callable, Tuple] | None
+
+    def __init__(self, ctx: multiprocessing.context.BaseContext) -> None:
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.job = None
+
+
+class WorkerPool:
+    """A pool of worker processes for yt-dlp extraction and downloads
+
+    Jobs are module level functions, sent to an idle worker over its pipe.
+    A supervisor thread dispatches jobs, collects results and restarts workers that crash.
+    The job that was running on a crashed worker fails with WorkerCrashedError.
+    """
+
+    size: int
+    restarts: int
+    _ctx: multiprocessing.context.BaseContext
+    _workers: List[_Worker]
+    _backlog: Deque[Tuple[concurrent.futures.Future, Callable, Tuple]]
+    _lock: threading.Lock
+    _wakeup_r: Connection
+    _wakeup_w: Connection
+    _closed: bool
+    _supervisor: threading.Thread
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.restarts = 0
+        # spawn, as forking a process with a running event loop and voice threads is not safe
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._backlog = deque()
+        self._lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = self._ctx.Pipe(duplex=False)
+        self._closed = False
+        self._supervisor = threading.Thread(
+            target=self._supervise, name="strongest-worker-supervisor", daemon=True
+        )
+
+    def start(self) -> None:
+        logger.info("Starting %d worker processes", self.size)
+        self._workers = [_Worker(self._ctx) for _ in range(self.size)]
+        self._supervisor.start()
+
+    def submit(self, func: Callable, *args: Any) -> concurrent.futures.Future:
+        """Queues a job for the worker processes
+
+        Args:
+            func (Callable): A module level (picklable) function
+            *args (Any): Picklable arguments for func
+
+        Returns:
+            concurrent.futures.Future: Resolves to the return value of func
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Worker pool is shut down")
+            self._backlog.append((future, func, args))
+            self._wakeup_w.send_bytes(b"")
+        return future
+
+    def in_flight(self) -> int:
+        """Returns the number of jobs that are queued or running"""
+        with self._lock:
+            return len(self._backlog) + sum(
+                1 for worker in self._workers if worker.job is not None
+            )
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup_w.send_bytes(b"")
+        if self._supervisor.is_alive():
+            self._supervisor.join(timeout=5)
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(timeout=1)
+            if worker.process.is_alive():
+                worker.process.kill()
+        logger.info("Worker processes stopped")
+
+    def _supervise(self) -> None:
+        while not self._closed:
+            self._dispatch()
+            sentinels = {worker.process.sentinel: worker for worker in self._workers}
+            conns = {worker.conn: worker for worker in self._workers}
+            for ready in wait([self._wakeup_r, *conns, *sentinels]):
+                if ready is self._wakeup_r:
+                    while self._wakeup_r.poll():
+                        self._wakeup_r.recv_bytes()
+                elif ready in conns:
+                    self._collect(conns[ready])
+                else:
+                    self._restart(sentinels[ready])
+        with self._lock:
+            pending = list(self._backlog)
+            self._backlog.clear()
+        for future, _, _ in pending:
+            future.cancel()
+
+    def _dispatch(self) -> None:
+        with self._lock:
+            for worker in self._workers:
+                if not self._backlog:
+                    return
+                if worker.job is not None:
+                    continue
+                job = self._backlog.popleft()
+                future, func, args = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                worker.job = job
+                try:
+                    worker.conn.send((func, args))
+                except OSError:
+                    # The worker died, its sentinel will fail the job and restart it
+                    pass
+
+    def _collect(self, worker: _Worker) -> None:
+        try:
+            ok, value = worker.conn.recv()
+        except (EOFError, OSError):
+            # The sentinel will report the crash
+            return
+        future, _, _ = worker.job
+        worker.job = None
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _restart(self, worker: _Worker) -> None:
+        worker.process.join(timeout=1)
+        logger.error(
+            "Worker process %d exited with code %s, restarting it",
+            worker.process.pid,
+            worker.process.exitcode,
+        )
+        if worker.job is not None:
+            future, func, _ = worker.job
+            future.set_exception(
+                WorkerCrashedError(f"Worker crashed while running {func.__name__}")
+            )
+        worker.conn.close()
+        self.restarts += 1
+        self._workers[self._workers.index(worker)] = _Worker(self._ctx)
+
+
+_pool: WorkerPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> WorkerPool | None:
+    """Returns the process wide worker pool, starting it on first use
+
+    Returns:
+        WorkerPool: The pool
+        None: Worker processes are disabled (BOT_WORKER_PROCESSES is 0)
+    """
+    global _pool
+    if WORKER_PROCESSES <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(WORKER_PROCESSES)
+            _pool.start()
+            atexit.register(_pool.shutdown)
+    return _pool
+
+
+async def run_job(func: Callable, *args: Any) -> Any:
+    """Runs a blocking job in a worker process, or in the calling thread if workers are disabled
+
+    Meant to be awaited from within a @threaded coroutine, so the fallback does not block the bot's event loop.
+    """
+    pool = get_pool()
+    if pool is None:
+        return func(*args)
+    return await asyncio.wrap_future(pool.submit(func, *args))
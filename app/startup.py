@@ -0,0 +1,27 @@
+import logging
+import time
+from typing import Dict
+
+logger = logging.getLogger("strongest.startup")
+
+# Taken when the app package is first imported, every phase is measured from here
+_origin: float = time.perf_counter()
+phases: Dict[str, float] = {}
+
+
+def mark(phase: str) -> float:
+    """Records that a startup phase has finished and returns the seconds since the app package was imported"""
+    elapsed = time.perf_counter() - _origin
+    phases.setdefault(phase, elapsed)
+    logger.debug("Startup phase %s finished after %.3fs", phase, elapsed)
+    return elapsed
+
+
+def format_phases() -> str:
+    """Returns the recorded phases as `phase +delta (total)`, in the order they finished"""
+    parts = []
+    previous = 0.0
+    for phase, elapsed in sorted(phases.items(), key=lambda i: i[1]):
+        parts.append(f"{phase} +{elapsed - previous:.3f}s ({elapsed:.3f}s)")
+        previous = elapsed
+    return ", ".join(parts)
@@ -1,5 +1,6 @@
 import threading
 import asyncio
+import contextvars
 from typing import Any, Coroutine, Callable
 
 # ? This might be needless-ly complicated. If this still sucks, there is an alternative solution in my chatgpt history
@@ -14,7 +15,9 @@ class ThreadedExecutor:
         self._event = asyncio.Event()
         self._coro = coro
         self._loop = asyncio.get_event_loop()
-        self._thread = threading.Thread(target=lambda: asyncio.run(self._run()))
+        # Context variables of the caller (like the guild fetches are charged to) carry over into the thread
+        context = contextvars.copy_context()
+        self._thread = threading.Thread(target=lambda: context.run(asyncio.run, self._run()))
         self._thread.start()
 
     async def wait(self) -> None:
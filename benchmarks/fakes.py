@@ -0,0 +1,189 @@
+"""Offline stand-ins for youtube, shared by the benchmarks
+
+- MediaServer: a local http server that serves synthetic media of any length, with optional latency
+- install_fake_yt_dlp: puts a fake `yt_dlp` module into sys.modules, which resolves from a catalogue
+  and downloads fragment ranges from the MediaServer, so the real resolve(), download_fragment() and
+  fetch_playlist() code paths run without the network
+
+Must be installed before anything imports yt_dlp, and only works with BOT_WORKER_PROCESSES=0,
+as spawned worker processes import the real module.
+"""
+import http.server
+import os
+import sys
+import threading
+import time
+import types
+import urllib.parse
+import urllib.request
+from typing import Dict, List, Tuple
+
+# 128 kbit/s, about what the opus streams we pick weigh
+BYTES_PER_SECOND = 16_000
+
+
+def video_id(i: int) -> str:
+    return f"vid{i:08d}"
+
+
+def video_url(vid: str) -> str:
+    return f"https://www.youtube.com/watch?v={vid}"
+
+
+def playlist_url(pid: str) -> str:
+    return f"https://www.youtube.com/playlist?list={pid}"
+
+
+def video_info(i: int, duration: int | None = None) -> Dict:
+    vid = video_id(i)
+    return {
+        "id": vid,
+        "webpage_url": video_url(vid),
+        "title": f"Song {i}",
+        "channel": f"Channel {i % 1000}",
+        "channel_url": f"https://www.youtube.com/channel/{i % 1000}",
+        "duration": duration if duration is not None else 180 + i % 600,
+    }
+
+
+class Catalogue:
+    """The videos and playlists the fake extractor knows about"""
+
+    videos: Dict[str, Dict]
+    playlists: Dict[str, List[str]]
+
+    def __init__(
+        self,
+        videos: int,
+        playlists: Dict[str, int] | None = None,
+        duration: int | None = None,
+    ) -> None:
+        self.videos = {video_id(i): video_info(i, duration) for i in range(videos)}
+        self.playlists = dict()
+        ids = list(self.videos)
+        for pid, length in (playlists or {}).items():
+            self.playlists[pid] = [ids[i % len(ids)] for i in range(length)]
+
+
+class _MediaHandler(http.server.BaseHTTPRequestHandler):
+    server: "_MediaHTTPServer"
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        start = int(query.get("start", ["0"])[0])
+        end = int(query.get("end", ["1"])[0])
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        size = max(end - start, 0) * BYTES_PER_SECOND
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/webm")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        chunk = self.server.chunk
+        while size > 0:
+            self.wfile.write(chunk[: min(size, len(chunk))])
+            size -= len(chunk)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class _MediaHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    latency: float
+    chunk: bytes
+
+
+class MediaServer:
+    """Serves /media/<vid>?start=<s>&end=<s> as (end - start) seconds of synthetic audio bytes"""
+
+    url: str
+    _server: _MediaHTTPServer
+    _thread: threading.Thread
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self._server = _MediaHTTPServer(("127.0.0.1", 0), _MediaHandler)
+        self._server.latency = latency
+        self._server.chunk = os.urandom(64 * 1024)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-media-server", daemon=True
+        )
+
+    def __enter__(self) -> "MediaServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def media_url(self, vid: str, start: int, end: int) -> str:
+        return f"{self.url}/media/{vid}?start={start}&end={end}"
+
+
+def install_fake_yt_dlp(catalogue: Catalogue, server: MediaServer) -> types.ModuleType:
+    """Registers a fake yt_dlp package backed by the catalogue and the media server
+
+    Returns:
+        types.ModuleType: The fake yt_dlp module
+    """
+    from app.models.resolver import get_video_id
+
+    def download_range_func(chapters, ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        return ranges
+
+    class YoutubeDL:
+        params: Dict
+
+        def __init__(self, params: Dict | None = None) -> None:
+            self.params = params or dict()
+
+        def __enter__(self) -> "YoutubeDL":
+            return self
+
+        def __exit__(self, *exc) -> None:
+            pass
+
+        def extract_info(self, url: str, download: bool = True, process: bool = True) -> Dict:
+            key = get_video_id(url)
+            if key in catalogue.playlists:
+                entries = [catalogue.videos[vid] for vid in catalogue.playlists[key]]
+                end = self.params.get("playlistend")
+                return {"id": key, "entries": entries[:end] if end else entries}
+            if key not in catalogue.videos:
+                raise ValueError(f"Video unavailable: {url}")
+            return dict(catalogue.videos[key], formats=[])
+
+        def download(self, url: str) -> None:
+            vid = get_video_id(url)
+            path = self.params["outtmpl"]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                for start, end in self.params["download_ranges"]:
+                    with urllib.request.urlopen(server.media_url(vid, start, end)) as response:
+                        while chunk := response.read(64 * 1024):
+                            f.write(chunk)
+
+    module = types.ModuleType("yt_dlp")
+    utils = types.ModuleType("yt_dlp.utils")
+    utils.download_range_func = download_range_func
+    module.YoutubeDL = YoutubeDL
+    module.utils = utils
+    sys.modules["yt_dlp"] = module
+    sys.modules["yt_dlp.utils"] = utils
+    return module
+
+
+def configure_environment(cache_dir: str) -> None:
+    """Points the bot's settings at a scratch cache directory, must run before `app` is imported"""
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ["BOT_CACHE_DIR"] = cache_dir
+    os.environ["BOT_WORKER_PROCESSES"] = "0"
+    os.environ.pop("BOT_META_ENDPOINT", None)
+    os.environ.pop("BOT_AUDIO_NODES", None)
+    # Synthetic media can not be analysed, and the analysis would skew download timings between commits
+    os.environ.setdefault("BOT_LOUDNESS_TARGET", "0")
+    os.environ.setdefault("BOT_LOG_LEVEL", "WARNING")
+    os.environ.setdefault("BOT_LOG_FILE", os.path.join(cache_dir, "benchmark.log"))
@@ -0,0 +1,123 @@
+"""Audio filter CPU benchmark
+
+Decodes the same fragment once per case and reads every 20ms frame the way the voice player does,
+as fast as possible, then reports the CPU time of this process (Python) and of ffmpeg (children)
+per second of audio. `core_percent` is the share of one core a single guild needs for that case.
+
+- none: the plain FFmpegPCMAudio the bot used to open
+- python_volume: discord.PCMVolumeTransformer on top of it, which scales every frame in Python
+- volume, bassboost, nightcore, all: AudioFilters compiled into the ffmpeg filter graph
+
+Needs ffmpeg with libopus, the test fragment is synthesized unless --input is given.
+
+Usage:
+    python -m benchmarks.filters [--seconds 60] [--runs 3] [--input song.webm] [--ffmpeg ffmpeg] [--output filters.json]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import discord
+
+from app.services.filters import AudioFilters
+
+FRAME_LENGTH = discord.opus.Encoder.FRAME_LENGTH / 1000
+
+CASES: Dict[str, AudioFilters] = {
+    "volume": AudioFilters(volume=0.5),
+    "bassboost": AudioFilters(bass=8),
+    "nightcore": AudioFilters(nightcore=True),
+    "all": AudioFilters(volume=0.5, bass=8, speed=1.25, nightcore=True),
+}
+
+
+def synthesize(ffmpeg: str, path: str, seconds: int) -> None:
+    subprocess.run(
+        [
+            ffmpeg,
+            "-loglevel", "error",
+            "-f", "lavfi",
+            "-i", f"sine=frequency=220:duration={seconds}:sample_rate=48000",
+            "-ac", "2",
+            "-c:a", "libopus",
+            "-b:a", "128k",
+            "-y", path,
+        ],
+        check=True,
+    )
+
+
+def children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(open_source: Callable[[], discord.AudioSource]) -> Dict[str, float]:
+    python_start = time.process_time()
+    ffmpeg_start = children_cpu()
+    source = open_source()
+    frames = 0
+    try:
+        while source.read():
+            frames += 1
+    finally:
+        # Reaps ffmpeg, so its CPU time shows up in RUSAGE_CHILDREN
+        source.cleanup()
+    audio = frames * FRAME_LENGTH
+    python = time.process_time() - python_start
+    ffmpeg = children_cpu() - ffmpeg_start
+    return {
+        "audio_seconds": audio,
+        "python_cpu": python,
+        "ffmpeg_cpu": ffmpeg,
+        "core_percent": (python + ffmpeg) / audio * 100 if audio else 0.0,
+    }
+
+
+def summarize(runs: List[Dict[str, float]]) -> Dict[str, float]:
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=int, default=60, help="Length of the synthesized fragment")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--input", help="Use this file instead of a synthesized fragment")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="The ffmpeg executable")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.input
+        if path is None:
+            path = os.path.join(tmp, "fragment.webm")
+            synthesize(args.ffmpeg, path, args.seconds)
+
+        def ffmpeg_source(options: str | None = None) -> discord.FFmpegPCMAudio:
+            return discord.FFmpegPCMAudio(path, executable=args.ffmpeg, options=options)
+
+        openers: Dict[str, Callable[[], discord.AudioSource]] = {
+            "none": ffmpeg_source,
+            "python_volume": lambda: discord.PCMVolumeTransformer(ffmpeg_source(), volume=0.5),
+        }
+        for name, filters in CASES.items():
+            openers[name] = lambda options=filters.build(): ffmpeg_source(options)
+
+        results = {"input": args.input or f"sine {args.seconds}s", "runs": args.runs, "cases": {}}
+        for name, open_source in openers.items():
+            results["cases"][name] = summarize([measure(open_source) for _ in range(args.runs)])
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Gateway intents memory and startup benchmark
+
+Feeds synthetic GUILD_CREATE payloads for large guilds into discord.py's connection state, once with
+discord.Intents.all() and once with the intents from app/intents.py, and reports the time and memory
+spent caching them. Payloads only contain what discord would send for the given intents: all members
+and presences with the privileged intents, only the bot and the members in voice without them.
+
+Usage:
+    python -m benchmarks.intents [--guilds 20] [--members 50000] [--voice 20] [--output intents.json]
+"""
+import argparse
+import gc
+import json
+import os
+import time
+import tracemalloc
+from typing import Dict, List
+
+os.environ.setdefault("BOT_TOKEN", "benchmark")
+
+import discord  # noqa: E402
+
+from app.intents import build_bot_options  # noqa: E402
+
+BOT_ID = 1
+
+
+def user(uid: int) -> Dict:
+    return {
+        "id": str(uid),
+        "username": f"user{uid}",
+        "discriminator": "0",
+        "global_name": f"User {uid}",
+        "avatar": None,
+    }
+
+
+def member(uid: int) -> Dict:
+    return {
+        "user": user(uid),
+        "roles": [],
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+
+def presence(uid: int) -> Dict:
+    return {
+        "user": {"id": str(uid)},
+        "status": "online",
+        "client_status": {"desktop": "online"},
+        "activities": [{"name": "Kazoo Simulator", "type": 0}],
+    }
+
+
+def guild_payload(gid: int, members: int, voice: int, intents: discord.Intents) -> Dict:
+    uids = range(gid * 10_000_000, gid * 10_000_000 + members)
+    in_voice = list(uids[:voice])
+    payload = {
+        "id": str(gid),
+        "name": f"Guild {gid}",
+        "owner_id": str(uids[0]),
+        "roles": [{"id": str(gid), "name": "@everyone", "permissions": "0", "position": 0, "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(gid * 10 + 1), "type": 2, "name": "Music", "position": 0, "permission_overwrites": [], "bitrate": 64000, "user_limit": 0}],
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+        "member_count": members,
+        "large": True,
+        "voice_states": [
+            {"user_id": str(uid), "channel_id": str(gid * 10 + 1), "session_id": "x", "deaf": False, "mute": False, "self_deaf": False, "self_mute": False, "suppress": False}
+            for uid in in_voice
+        ],
+    }
+    if intents.members:
+        payload["members"] = [member(uid) for uid in uids] + [member(BOT_ID)]
+    else:
+        payload["members"] = [member(uid) for uid in in_voice] + [member(BOT_ID)]
+    if intents.presences:
+        payload["presences"] = [presence(uid) for uid in uids]
+    return payload
+
+
+def measure(name: str, options: Dict, guilds: int, members: int, voice: int) -> Dict:
+    client = discord.Client(**options)
+    state = client._connection
+    payloads: List[Dict] = [guild_payload(gid + 1, members, voice, options["intents"]) for gid in range(guilds)]
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for payload in payloads:
+        state._add_guild_from_data(payload)
+    elapsed = time.perf_counter() - start
+    del payloads
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    cached = sum(len(guild.members) for guild in client.guilds)
+    return {
+        "intents": name,
+        "seconds": elapsed,
+        "retained_bytes": current,
+        "peak_bytes": peak,
+        "cached_members": cached,
+        "chunk_guilds_at_startup": options.get("chunk_guilds_at_startup", True),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=50000)
+    parser.add_argument("--voice", type=int, default=20)
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    results = {
+        "guilds": args.guilds,
+        "members": args.members,
+        "results": [
+            measure("all", {"intents": discord.Intents.all()}, args.guilds, args.members, args.voice),
+            measure("minimal", build_bot_options(), args.guilds, args.members, args.voice),
+        ],
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
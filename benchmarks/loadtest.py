@@ -0,0 +1,374 @@
+"""Multi-guild load simulator
+
+Runs the Default cog against simulated guilds, scaling the guild count in steps (1 to 1000 by default).
+Every guild joins with /play, queues --songs songs, sets /loop all and then randomly runs /queue, /seek,
+/skip and /loop until the step ends with /leave. Voice clients are fakes whose player threads read the audio
+source every 20ms like discord.py's, and songs come from the fake yt-dlp backend and the local media
+server in benchmarks/fakes.py. ffmpeg is replaced by a source reading the fragment file as raw pcm,
+so the numbers are the bot's own overhead (songs play about 12x faster than their duration).
+
+Per step it reports CPU (cores used), peak RSS and thread count, event loop lag, time to first audio
+(/play to the first frame read), the fragment gaps and late frames from each guild's VoiceStats
+and the hit rate of the in-memory fragment tier (BOT_HOT_CACHE_SIZE, disabled by default).
+Commands are called directly, cooldowns and permission checks do not apply.
+
+Usage:
+    python -m benchmarks.loadtest [--guilds 1,10,100,250,500,1000] [--duration 30] [--output load.json]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.fakes import (
+    BYTES_PER_SECOND,
+    Catalogue,
+    MediaServer,
+    configure_environment,
+    install_fake_yt_dlp,
+    video_id,
+    video_url,
+)
+
+FRAME_LENGTH = 0.02
+FRAME_SIZE = 3840  # 20ms of 48kHz 16 bit stereo pcm
+LAG_INTERVAL = 0.05
+
+
+def percentile(values: List[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def distribution(values: List[float]) -> Dict[str, float | None]:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def build_fakes():
+    """Defined after the environment is configured, as they subclass discord.py's types"""
+    import discord
+
+    class FakePCMAudio(discord.AudioSource):
+        """Replaces FFmpegPCMAudio, reads the fragment file as if it was already decoded"""
+
+        def __init__(
+            self, source: str | io.BufferedIOBase, before_options: str | None = None, pipe: bool = False, **kwargs
+        ) -> None:
+            # Piped sources are file-like objects, like the fragments played from memory
+            self._file = source if pipe else open(source, "rb")
+            if before_options and before_options.startswith("-ss "):
+                # Seeks the way ffmpeg's input offset would, the file holds BYTES_PER_SECOND per second of the song
+                self._file.seek(int(float(before_options[4:]) * BYTES_PER_SECOND))
+
+        def read(self) -> bytes:
+            data = self._file.read(FRAME_SIZE)
+            return data if len(data) == FRAME_SIZE else b""
+
+        def cleanup(self) -> None:
+            self._file.close()
+
+    class FakePlayer(threading.Thread):
+        """Paces source reads the way discord.py's AudioPlayer does, without encoding or sending"""
+
+        def __init__(self, source: discord.AudioSource, client: "FakeVoiceClient", after: Callable) -> None:
+            super().__init__(daemon=True, name=f"fake-player-{client.channel.guild.id}")
+            self.source = source
+            self.client = client
+            self.after = after
+            self._end = threading.Event()
+            self._resumed = threading.Event()
+            self._resumed.set()
+
+        def run(self) -> None:
+            error = None
+            try:
+                self._do_run()
+            except Exception as e:
+                error = e
+            finally:
+                self.after(error)
+                self.source.cleanup()
+
+        def _do_run(self) -> None:
+            loops = 0
+            start = time.perf_counter()
+            while not self._end.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait()
+                    loops = 0
+                    start = time.perf_counter()
+                    continue
+                data = self.source.read()
+                if not data:
+                    self.stop()
+                    return
+                if self.client.first_frame is None:
+                    self.client.first_frame = time.perf_counter()
+                loops += 1
+                time.sleep(max(0.0, start + FRAME_LENGTH * loops - time.perf_counter()))
+
+        def stop(self) -> None:
+            self._end.set()
+            self._resumed.set()
+
+        def is_playing(self) -> bool:
+            return not self._end.is_set() and self._resumed.is_set()
+
+    class FakeVoiceClient:
+        channel: "FakeVoiceChannel"
+        first_frame: float | None
+        _player: FakePlayer | None
+
+        def __init__(self, channel: "FakeVoiceChannel") -> None:
+            self.channel = channel
+            self.first_frame = None
+            self._player = None
+
+        def play(self, source: discord.AudioSource, *, after: Callable) -> None:
+            if self.is_playing():
+                raise discord.ClientException("Already playing audio.")
+            self._player = FakePlayer(source, self, after)
+            self._player.start()
+
+        def is_playing(self) -> bool:
+            return self._player is not None and self._player.is_playing()
+
+        def is_paused(self) -> bool:
+            return self._player is not None and not self._player._resumed.is_set()
+
+        def pause(self) -> None:
+            if self._player is not None:
+                self._player._resumed.clear()
+
+        def resume(self) -> None:
+            if self._player is not None:
+                self._player._resumed.set()
+
+        def stop(self) -> None:
+            if self._player is not None:
+                self._player.stop()
+                self._player = None
+
+        async def disconnect(self, *, force: bool = False) -> None:
+            self.stop()
+            self.channel.client = None
+
+    class FakeVoiceChannel:
+        def __init__(self, guild: "FakeGuild") -> None:
+            self.guild = guild
+            self.id = guild.id * 10
+            self.name = f"Music {guild.id}"
+            self.members = []
+            self.client = None
+
+        async def connect(self, **kwargs) -> FakeVoiceClient:
+            self.client = FakeVoiceClient(self)
+            return self.client
+
+    class FakeGuild:
+        def __init__(self, gid: int) -> None:
+            self.id = gid
+            self.name = f"Guild {gid}"
+            self.voice_channel = FakeVoiceChannel(self)
+
+    class FakeMessage:
+        async def edit(self, **kwargs) -> None:
+            pass
+
+    class FakeContext:
+        def __init__(self, guild: FakeGuild) -> None:
+            self.guild = guild
+            self.channel = type("FakeTextChannel", (), {"name": "commands", "id": guild.id})()
+            voice = type("FakeVoiceState", (), {"channel": guild.voice_channel})()
+            self.author = type("FakeMember", (), {"id": guild.id, "voice": voice})()
+
+        async def defer(self, **kwargs) -> None:
+            pass
+
+        async def reply(self, *args, **kwargs) -> FakeMessage:
+            return FakeMessage()
+
+    discord.FFmpegPCMAudio = FakePCMAudio
+    return FakeGuild, FakeContext
+
+
+async def invoke(cog, name: str, ctx, *args) -> None:
+    """Runs a command's callback the way Command.invoke would, without the checks and cooldowns"""
+    await getattr(cog, name).callback(cog, ctx, *args)
+
+
+class LagProbe:
+    """Samples how late an asyncio.sleep wakes up"""
+
+    samples: List[float]
+    _task: asyncio.Task | None
+
+    def __init__(self) -> None:
+        self.samples = []
+        self._task = None
+
+    async def _run(self) -> None:
+        while 1:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.samples.append(max(0.0, time.perf_counter() - start - LAG_INTERVAL))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        self._task.cancel()
+
+
+async def run_step(guilds: int, args: argparse.Namespace, fakes) -> Dict:
+    from app.cluster import get_rss
+    from app.config import CACHE_DIR
+    from app.modules.default import Default
+    from app.services.hotcache import get_cache
+
+    FakeGuild, FakeContext = fakes
+    # Every step starts with an empty fragment cache, only the metadata stays cached
+    for name in os.listdir(CACHE_DIR):
+        if os.path.isdir(os.path.join(CACHE_DIR, name)):
+            shutil.rmtree(os.path.join(CACHE_DIR, name), ignore_errors=True)
+    baseline_threads = threading.active_count()
+    cog = Default(object())
+    probe = LagProbe()
+    probe.start()
+    contexts = [FakeContext(FakeGuild(gid + 1)) for gid in range(guilds)]
+    play_started: Dict[int, float] = {}
+    stop_at = time.perf_counter() + args.ramp + args.duration
+    peak_rss = get_rss()
+    peak_threads = threading.active_count()
+    errors = 0
+
+    async def guild_session(ctx) -> None:
+        nonlocal errors
+        await asyncio.sleep(random.uniform(0, args.ramp))
+        songs = random.sample(range(args.catalogue), args.songs)
+        play_started[ctx.guild.id] = time.perf_counter()
+        try:
+            for i in songs:
+                await invoke(cog, "_play", ctx, video_url(video_id(i)))
+            await invoke(cog, "_loop", ctx, "all")
+            while time.perf_counter() < stop_at:
+                await asyncio.sleep(random.expovariate(1 / args.action_interval))
+                action = random.random()
+                if action < 0.4:
+                    await invoke(cog, "_queue", ctx)
+                elif action < 0.6:
+                    await invoke(cog, "_seek", ctx, str(random.randrange(args.song_length)))
+                elif action < 0.8:
+                    await invoke(cog, "_skip", ctx)
+                else:
+                    await invoke(cog, "_loop", ctx, "all")
+        except Exception:
+            errors += 1
+            raise
+
+    cache = get_cache()
+    hits, misses = cache.hits, cache.misses
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    sessions = asyncio.gather(*[guild_session(ctx) for ctx in contexts], return_exceptions=True)
+    while not sessions.done():
+        await asyncio.sleep(0.5)
+        peak_rss = max(peak_rss, get_rss())
+        peak_threads = max(peak_threads, threading.active_count())
+    cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+    probe.stop()
+    hits, misses = cache.hits - hits, cache.misses - misses
+
+    ttfa = []
+    gaps = []
+    frames = late = missed = 0
+    for ctx in contexts:
+        controller = cog.controllers.get(ctx.guild.id)
+        client = ctx.guild.voice_channel.client
+        if client is not None and client.first_frame is not None:
+            ttfa.append(client.first_frame - play_started[ctx.guild.id])
+        if controller is not None:
+            stats = controller.voice_stats
+            gaps.extend(stats.fragment_gaps)
+            frames += stats.frames
+            late += stats.late_frames
+            missed += stats.missed_frames
+    for ctx in contexts:
+        await invoke(cog, "_leave", ctx)
+    # Player threads and preloads still report back to this loop, let them finish before it closes
+    deadline = time.perf_counter() + 30
+    while threading.active_count() > baseline_threads and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+
+    return {
+        "guilds": guilds,
+        "errors": errors,
+        "cpu_cores": cpu,
+        "peak_rss_bytes": peak_rss,
+        "peak_threads": peak_threads,
+        "loop_lag_seconds": distribution(probe.samples),
+        "time_to_first_audio_seconds": distribution(ttfa),
+        "fragment_gap_seconds": distribution(gaps),
+        "frames": frames,
+        "late_frames": late,
+        "missed_frames": missed,
+        "late_ratio": late / frames if frames else None,
+        "hot_cache": {
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "used_bytes": cache.used,
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", default="1,10,100,250,500,1000", help="Comma separated guild counts, one step each")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds every step runs after the ramp")
+    parser.add_argument("--ramp", type=float, default=5, help="Seconds over which the guilds start")
+    parser.add_argument("--songs", type=int, default=3, help="Songs queued by every guild")
+    parser.add_argument("--song-length", type=int, default=30, help="Song duration in seconds")
+    parser.add_argument("--catalogue", type=int, default=500, help="Distinct songs the guilds pick from")
+    parser.add_argument("--action-interval", type=float, default=5, help="Mean seconds between commands per guild")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the media server waits per request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    steps = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # The cog warns about every repeated /play, only errors are interesting here
+        os.environ.setdefault("BOT_LOG_LEVEL", "ERROR")
+        configure_environment(cache_dir)
+        catalogue = Catalogue(args.catalogue, duration=args.song_length)
+        with MediaServer(args.latency) as server:
+            install_fake_yt_dlp(catalogue, server)
+            fakes = build_fakes()
+            for guilds in [int(count) for count in args.guilds.split(",")]:
+                step = asyncio.run(run_step(guilds, args, fakes))
+                print(json.dumps(step))
+                steps.append(step)
+
+    results = {"parameters": vars(args), "steps": steps}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
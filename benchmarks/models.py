@@ -0,0 +1,319 @@
+"""Offline benchmarks of the models and cache layers
+
+Runs against the fake yt-dlp backend and the local media server from benchmarks/fakes.py,
+so nothing touches the network and runs are comparable across commits:
+- create_fragments: Song._create_fragments for short to 10 hour songs
+- playlist_next / playlist_skip: moving the pointers of a playlist with --queue songs
+- playlist_add: queuing --adds songs (and one playlist of as many) onto a playlist with --queue songs
+- meta_cache_*: MetaCache get/set/load/save with --entries entries
+- get_queue: AudioController.get_queue rendering --queue songs
+- fragment_download: downloading every fragment of --songs songs through the local http server
+
+Every benchmark reports min/median/mean/max seconds per call over --repeat runs.
+Results carry the commit they were measured on, --compare prints the median ratio against an older result file.
+
+Usage:
+    python -m benchmarks.models [--queue 10000] [--entries 100000] [--repeat 5] [--output models.json] [--compare old.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from benchmarks.fakes import (
+    Catalogue,
+    MediaServer,
+    configure_environment,
+    install_fake_yt_dlp,
+    playlist_url,
+    video_id,
+    video_info,
+    video_url,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DURATIONS = (60, 200, 201, 400, 1800, 3600, 36000)
+
+
+class _Pending:
+    """Stands in for a running download, so preloading does not start real downloads"""
+
+    def is_set(self) -> bool:
+        return False
+
+
+def summarize(samples: List[float], calls: int = 1) -> Dict[str, float]:
+    per_call = [sample / calls for sample in samples]
+    return {
+        "min": min(per_call),
+        "median": statistics.median(per_call),
+        "mean": statistics.fmean(per_call),
+        "max": max(per_call),
+        "calls": calls,
+    }
+
+
+def measure(func: Callable[[], object], repeat: int, calls: int = 1) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, calls)
+
+
+async def measure_async(func: Callable, repeat: int, calls: int = 1) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, calls)
+
+
+def make_song(i: int, duration: int | None = None):
+    """Builds a ready Song without fetching anything or starting threads"""
+    from app.models.song import Meta, Song
+
+    info = video_info(i, duration)
+    meta = Meta.__new__(Meta)
+    meta.url = info["webpage_url"]
+    meta.vid = info["id"]
+    meta.title = info["title"]
+    meta.channel_name = info["channel"]
+    meta.channel_url = info["channel_url"]
+    meta.duration = info["duration"]
+    meta.loudness = None
+    meta._meta_injection = info
+    meta._fetch_thread = None
+    song = Song.__new__(Song)
+    song.meta = meta
+    song._create_fragments()
+    for fragment in song.fragments:
+        fragment._download_thread = _Pending()
+    ready = asyncio.get_running_loop().create_future()
+    ready.set_result(None)
+    song._setup_task = ready
+    return song
+
+
+def make_playlist(songs: int):
+    from app.models.playlist import Playlist
+
+    playlist = Playlist()
+    playlist.songs = [make_song(i) for i in range(songs)]
+    return playlist
+
+
+def bench_create_fragments(repeat: int) -> Dict[str, Dict]:
+    results = {}
+
+    async def build() -> None:
+        for duration in DURATIONS:
+            song = make_song(0, duration)
+            results[str(duration)] = measure(song._create_fragments, repeat, 1)
+
+    asyncio.run(build())
+    return results
+
+
+def bench_playlist(queue: int, adds: int, repeat: int) -> Dict[str, Dict]:
+    from app.models.playlist import Playlist
+
+    async def run() -> Dict[str, Dict]:
+        results = {}
+        playlist = make_playlist(queue)
+
+        async def walk() -> None:
+            playlist.current_song = 0
+            playlist.current_fragment = 0
+            for _ in range(queue):
+                await playlist.next()
+
+        results["playlist_next"] = await measure_async(walk, repeat, queue)
+
+        async def skip_all() -> None:
+            playlist.current_song = 0
+            playlist.current_fragment = 0
+            for _ in range(queue):
+                await playlist.skip()
+
+        results["playlist_skip"] = await measure_async(skip_all, repeat, queue)
+
+        base = [make_song(i) for i in range(queue)]
+        fresh: List[Playlist] = []
+
+        async def add_songs() -> None:
+            target = Playlist()
+            target.songs = list(base)
+            for i in range(adds):
+                await target.add(video_url(video_id(i)))
+            fresh.append(target)
+
+        results["playlist_add"] = await measure_async(add_songs, repeat, adds)
+
+        async def add_list() -> None:
+            target = Playlist()
+            target.songs = list(base)
+            await target.add(playlist_url("bench"))
+            fresh.append(target)
+
+        results["playlist_add_list"] = await measure_async(add_list, repeat, 1)
+        # Let the songs finish their (cached) metadata jobs before the loop closes
+        await asyncio.gather(
+            *[
+                song.wait_until_ready()
+                for target in fresh
+                for song in target.songs[queue:]
+            ]
+        )
+        return results
+
+    return asyncio.run(run())
+
+
+def bench_meta_cache(entries: int, lookups: int, repeat: int) -> Dict[str, Dict]:
+    from app.models.song import MetaCache, initialize_cache
+
+    initialize_cache()
+    cache = MetaCache()
+    cache._cache = {video_id(i): video_info(i) for i in range(entries)}
+    results = {"meta_cache_save": measure(cache.save, repeat)}
+    results["meta_cache_load"] = measure(cache.load, repeat)
+    urls = [video_url(video_id(random.randrange(entries))) for _ in range(lookups)]
+
+    def get_hits() -> None:
+        for url in urls:
+            cache.get(url)
+
+    results["meta_cache_get_hit"] = measure(get_hits, repeat, lookups)
+    missing = [video_url(f"missing{i}") for i in range(lookups)]
+
+    def get_misses() -> None:
+        for url in missing:
+            cache.get(url)
+
+    results["meta_cache_get_miss"] = measure(get_misses, repeat, lookups)
+    counter = iter(range(entries, entries + repeat))
+
+    def set_one() -> None:
+        i = next(counter)
+        cache.set(video_url(video_id(i)), video_info(i))
+
+    results["meta_cache_set"] = measure(set_one, repeat)
+    return results
+
+
+def bench_get_queue(queue: int, repeat: int) -> Dict[str, Dict]:
+    from app.services.audiocontroller import AudioController
+
+    async def run() -> Dict[str, Dict]:
+        guild = SimpleNamespace(id=1, name="Benchmark")
+        controller = AudioController(SimpleNamespace(), guild)
+        controller._playlist = make_playlist(queue)
+        return {"get_queue": measure(controller.get_queue, repeat)}
+
+    return asyncio.run(run())
+
+
+def bench_fragment_download(songs: int, repeat: int) -> Dict[str, Dict]:
+    import shutil
+
+    async def run() -> Dict[str, Dict]:
+        prepared = [make_song(i) for i in range(songs)]
+        fragments = [fragment for song in prepared for fragment in song.fragments]
+        size = sum(f.end - f.start for f in fragments)
+
+        async def download_all() -> None:
+            for song in prepared:
+                shutil.rmtree(song.meta.get_fragment_dir(), ignore_errors=True)
+            for fragment in fragments:
+                fragment._download_thread = None
+            await asyncio.gather(*[f.wait_until_downloaded() for f in fragments])
+
+        result = await measure_async(download_all, repeat)
+        result["fragments"] = len(fragments)
+        result["audio_seconds"] = size
+        return {"fragment_download": result}
+
+    return asyncio.run(run())
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict, path: str) -> None:
+    with open(path) as f:
+        old = json.load(f)
+    print(f"Compared to {old.get('commit')} (ratio of medians, <1 is faster):")
+    for name, current in results["benchmarks"].items():
+        previous = old.get("benchmarks", {}).get(name)
+        if previous is None:
+            continue
+        if "median" in current:
+            current, previous = {"": current}, {"": previous}
+        for case, stats in current.items():
+            if case in previous and previous[case]["median"] > 0:
+                ratio = stats["median"] / previous[case]["median"]
+                print(f"  {name}{' ' + case if case else ''}: {ratio:.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queue", type=int, default=10000, help="Songs in the large playlists")
+    parser.add_argument("--adds", type=int, default=200, help="Songs queued by playlist_add")
+    parser.add_argument("--entries", type=int, default=100000, help="Entries in the meta cache")
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--songs", type=int, default=4, help="Songs downloaded by fragment_download")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the media server waits per request")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as json to this file")
+    parser.add_argument("--compare", help="A previous result file to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        configure_environment(cache_dir)
+        catalogue = Catalogue(max(args.queue, args.adds), {"bench": args.adds})
+        with MediaServer(args.latency) as server:
+            install_fake_yt_dlp(catalogue, server)
+            benchmarks = {"create_fragments": bench_create_fragments(args.repeat)}
+            # The meta cache goes first, so the playlist benchmarks queue songs with cached metadata
+            benchmarks.update(bench_meta_cache(args.entries, args.lookups, args.repeat))
+            benchmarks.update(bench_playlist(args.queue, args.adds, args.repeat))
+            benchmarks.update(bench_get_queue(args.queue, args.repeat))
+            benchmarks.update(bench_fragment_download(args.songs, args.repeat))
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "parameters": vars(args),
+        "benchmarks": benchmarks,
+    }
+    print(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Voice send engine benchmark
+
+Plays the same number of streams through discord.py's AudioPlayer (a thread per stream) and through the
+MultiplexedPlayer (streams share SendScheduler threads) and measures how evenly the frames are sent.
+Voice clients are stubs: every frame gets an RTP header and is sent over UDP to a local socket that drops it,
+so the work per frame is what discord.py does minus opus encoding and encryption.
+
+Per stream count and engine it reports:
+- jitter: how far the gap between two frames of a stream is from 20ms, in ms
+- lateness: how far each frame is behind its place on the stream's 20ms grid, in ms
+- late_percent: frames sent more than --late ms after their place on the grid
+- cpu_cores: CPU time of the process per second of wall time
+- threads: threads the engine started for the step, the voice primers are only counted by the first step
+
+Usage:
+    python -m benchmarks.sender [--streams 50,200,500] [--duration 10] [--senders 1] [--output sender.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+from benchmarks.fakes import configure_environment
+
+FRAME_LENGTH = 0.02
+# An opus frame of silence, sources are opus so no encoder is needed
+PACKET = b"\xf8\xff\xfe"
+WARMUP = 1.0  # Seconds of frames ignored while streams are still starting
+
+
+def percentile(values: List[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def distribution(values: List[float]) -> Dict[str, float | None]:
+    return {
+        "p50": percentile(values, 0.5),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def build_stubs():
+    """Defined after the environment is configured, as they subclass discord.py's types"""
+    import discord
+
+    class FrameSource(discord.AudioSource):
+        """An endless opus stream"""
+
+        def read(self) -> bytes:
+            return PACKET
+
+        def is_opus(self) -> bool:
+            return True
+
+    class StubWebSocket:
+        async def speak(self, state) -> None:
+            pass
+
+    class StubClient:
+        loop: asyncio.AbstractEventLoop
+
+        def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+            self.loop = loop
+
+    class StubVoiceClient:
+        """What the players use of a VoiceClient, sends every frame to a local socket"""
+
+        def __init__(self, client: StubClient, sock: socket.socket, address) -> None:
+            self.client = client
+            self.ws = StubWebSocket()
+            self.encoder = None
+            self._connected = threading.Event()
+            self._connected.set()
+            self._sock = sock
+            self._address = address
+            self.sequence = 0
+            self.timestamp = 0
+            self.sent: List[float] = []
+
+        def send_audio_packet(self, data: bytes, *, encode: bool = True) -> None:
+            self.sent.append(time.perf_counter())
+            header = struct.pack(">BBHII", 0x80, 0x78, self.sequence, self.timestamp, 1)
+            self.sequence = (self.sequence + 1) % 65536
+            self.timestamp = (self.timestamp + 960) % 4294967295
+            try:
+                self._sock.sendto(header + data, self._address)
+            except BlockingIOError:
+                pass  # The sink is never read, a full buffer drops packets like the network would
+
+    return FrameSource, StubClient, StubVoiceClient
+
+
+def measure(
+    engine: str,
+    streams: int,
+    duration: float,
+    senders: int,
+    late: float,
+    stubs,
+) -> Dict[str, object]:
+    import discord
+
+    from app.services.sender import MultiplexedPlayer, SendScheduler
+
+    FrameSource, StubClient, StubVoiceClient = stubs
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="stub-loop").start()
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    client = StubClient(loop)
+    threads_before = threading.active_count()
+    schedulers = [SendScheduler(f"voice-sender-{i}") for i in range(senders)]
+    for scheduler in schedulers:
+        scheduler.start()
+
+    voice_clients = []
+    players = []
+    for i in range(streams):
+        vc = StubVoiceClient(client, sock, sink.getsockname())
+        if engine == "audioplayer":
+            player = discord.player.AudioPlayer(FrameSource(), vc)
+        else:
+            player = MultiplexedPlayer(FrameSource(), vc, schedulers[i % senders])
+        voice_clients.append(vc)
+        players.append(player)
+
+    for player in players:
+        player.start()
+    time.sleep(WARMUP)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    threads = threading.active_count() - threads_before
+    time.sleep(duration)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    for player in players:
+        player.stop()
+    # Lets the players notice, then everything is dropped with the daemon threads
+    time.sleep(0.1)
+    loop.call_soon_threadsafe(loop.stop)
+    sink.close()
+    sock.close()
+
+    jitter: List[float] = []
+    lateness: List[float] = []
+    for vc in voice_clients:
+        sent = [t for t in vc.sent if wall_start <= t <= wall_start + wall]
+        if not sent:
+            continue
+        for a, b in zip(sent, sent[1:]):
+            jitter.append(abs(b - a - FRAME_LENGTH) * 1000)
+        for i, t in enumerate(sent):
+            lateness.append((t - sent[0] - i * FRAME_LENGTH) * 1000)
+    frames = sum(len(vc.sent) for vc in voice_clients)
+    return {
+        "frames": len(lateness),
+        "expected_frames": int(streams * wall / FRAME_LENGTH),
+        "total_frames": frames,
+        "jitter_ms": distribution(jitter),
+        "lateness_ms": distribution(lateness),
+        "late_percent": (
+            sum(1 for value in lateness if value > late) / len(lateness) * 100 if lateness else None
+        ),
+        "cpu_cores": cpu / wall,
+        "threads": threads,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--streams", default="50,200,500", help="Comma separated stream counts")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds measured per step")
+    parser.add_argument("--senders", type=int, default=1, help="SendScheduler threads of the multiplexed engine")
+    parser.add_argument("--late", type=float, default=5.0, help="Milliseconds after which a frame is late")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(tmp)
+        stubs = build_stubs()
+        results = {"duration": args.duration, "senders": args.senders, "cpus": os.cpu_count(), "steps": []}
+        for streams in (int(i) for i in args.streams.split(",")):
+            step = {"streams": streams}
+            for engine in ("audioplayer", "multiplexed"):
+                step[engine] = measure(engine, streams, args.duration, args.senders, args.late, stubs)
+            results["steps"].append(step)
+            print(json.dumps(step), flush=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Startup time benchmark
+
+Measures every startup phase in a fresh interpreter, so import caching does not hide regressions:
+- import: `import app`, which must stay cheap for worker processes, audio nodes and the launcher
+- bootstrap: discord.py and building the bot (the `from . import bot` in __main__)
+- cache: loading meta.json with --entries synthetic songs
+- yt_dlp: importing yt-dlp, which is deferred until after login
+- login/ready (only with --login): logging in with BOT_TOKEN and waiting for on_ready
+
+Usage:
+    python -m benchmarks.startup [--entries 10000] [--runs 5] [--login] [--output startup.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the fresh interpreter and prints a json object of phase -> seconds
+PROBE = """
+import json, time
+t = time.perf_counter()
+import app
+result = {"import": time.perf_counter() - t}
+t = time.perf_counter()
+import app.bootstrap
+result["bootstrap"] = time.perf_counter() - t
+t = time.perf_counter()
+from app.models.song import meta_cache
+meta_cache.warm()
+result["cache"] = time.perf_counter() - t
+t = time.perf_counter()
+import yt_dlp
+result["yt_dlp"] = time.perf_counter() - t
+print(json.dumps(result))
+"""
+
+LOGIN_PROBE = """
+import json
+from app import bot, startup
+from app.config import TOKEN
+
+@bot.listen("on_ready")
+async def _stop():
+    await bot.close()
+
+bot.run(TOKEN, log_handler=None)
+print(json.dumps(startup.phases))
+"""
+
+
+def write_meta(cache_dir: str, entries: int) -> None:
+    meta = {
+        f"vid{i:08d}": {
+            "id": f"vid{i:08d}",
+            "webpage_url": f"https://www.youtube.com/watch?v=vid{i:08d}",
+            "title": f"Song {i}",
+            "channel": f"Channel {i % 1000}",
+            "channel_url": f"https://www.youtube.com/channel/{i % 1000}",
+            "duration": 180 + i % 600,
+        }
+        for i in range(entries)
+    }
+    with open(os.path.join(cache_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+
+
+def run_probe(code: str, env: Dict[str, str]) -> Dict[str, float]:
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(runs: List[Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    return {
+        phase: {
+            "median": statistics.median(run[phase] for run in runs),
+            "min": min(run[phase] for run in runs),
+            "max": max(run[phase] for run in runs),
+        }
+        for phase in runs[0]
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--login", action="store_true", help="Also measure login to ready, needs BOT_TOKEN")
+    parser.add_argument("--output", help="Write the results as json to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        write_meta(cache_dir, args.entries)
+        env = dict(os.environ, BOT_CACHE_DIR=cache_dir)
+        env.setdefault("BOT_TOKEN", "benchmark")
+        results = {"entries": args.entries, "runs": args.runs}
+        results["phases"] = summarize([run_probe(PROBE, env) for _ in range(args.runs)])
+        if args.login:
+            results["login"] = run_probe(LOGIN_PROBE, env)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()